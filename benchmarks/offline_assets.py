@@ -0,0 +1,38 @@
+import os
+from transformers import BartConfig, BartTokenizer
+from tokenizers import ByteLevelBPETokenizer
+
+
+# The benchmarks must run without network access, so instead of "facebook/bart-base" and "roberta-base" they use a
+# byte-level BPE tokenizer trained on the synthetic corpus and randomly initialized BART models.
+
+special_tokens = ["<s>", "<pad>", "</s>", "<unk>", "<mask>"]
+
+bart_sizes = {
+    "tiny": {"d_model": 64, "encoder_layers": 2, "decoder_layers": 2, "encoder_attention_heads": 4,
+             "decoder_attention_heads": 4, "encoder_ffn_dim": 128, "decoder_ffn_dim": 128},
+    # Same architecture as facebook/bart-base
+    "base": {"d_model": 768, "encoder_layers": 6, "decoder_layers": 6, "encoder_attention_heads": 12,
+             "decoder_attention_heads": 12, "encoder_ffn_dim": 3072, "decoder_ffn_dim": 3072},
+}
+
+
+def build_offline_tokenizer(output_folder, texts, vocab_size=8000):
+    os.makedirs(output_folder, exist_ok=True)
+
+    bpe_tokenizer = ByteLevelBPETokenizer()
+    bpe_tokenizer.train_from_iterator(texts, vocab_size=vocab_size, min_frequency=2, special_tokens=special_tokens,
+                                      show_progress=False)
+    bpe_tokenizer.save_model(output_folder)
+
+    # Saved in the transformers format so that both BartTokenizer and RobertaTokenizer can load it with from_pretrained
+    tokenizer = BartTokenizer(vocab_file=os.path.join(output_folder, "vocab.json"),
+                              merges_file=os.path.join(output_folder, "merges.txt"))
+    tokenizer.save_pretrained(output_folder)
+    return output_folder
+
+
+def create_bart_config(model_size, vocab_size):
+    return BartConfig(vocab_size=vocab_size, attention_dropout=0.123, pad_token_id=1, bos_token_id=0,
+                      eos_token_id=2, decoder_start_token_id=2, forced_bos_token_id=0, forced_eos_token_id=2,
+                      **bart_sizes[model_size])
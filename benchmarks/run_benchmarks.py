@@ -0,0 +1,439 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+benchmarks_folder = os.path.dirname(os.path.abspath(__file__))
+project_folder = os.path.dirname(benchmarks_folder)
+sys.path.append(os.path.join(project_folder, "train"))
+
+from synthetic_corpus import dataset_names, write_synthetic_dataset, create_masked_examples  # noqa: E402
+from offline_assets import build_offline_tokenizer, create_bart_config  # noqa: E402
+from paper_token_store import PaperTokenStore  # noqa: E402
+from stage_timing import measure_peak_rss_mb, run_in_spawned_process  # noqa: E402
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--output_file", type=str, default="benchmark_results.json", help="Path of the JSON file that "
+                                                                                      "the results are written to")
+parser.add_argument("--work_folder", type=str, default=None, help="Folder for the synthetic corpus, tokenizer and "
+                                                                  "preprocessing outputs. A temporary folder is used "
+                                                                  "if it is not given")
+parser.add_argument("--benchmarks", type=str, nargs="+", default=["preprocessing", "tokenization", "training",
+                                                                  "training_options", "generation", "startup"],
+                    help="Benchmarks to run")
+parser.add_argument("--num_contexts", type=int, default=2000, help="Number of synthetic contexts per dataset")
+parser.add_argument("--token_limits", type=int, nargs="+", default=[200, 300, 350, 400], help="max_token_limit "
+                                                                                              "values to measure")
+parser.add_argument("--model_size", type=str, default="tiny", choices=["tiny", "base"], help="Size of the randomly "
+                                                                                             "initialized BART model")
+parser.add_argument("--batch_size", type=int, default=8, help="Batch size for the training benchmark")
+parser.add_argument("--train_steps", type=int, default=5, help="Number of measured training steps per token limit")
+parser.add_argument("--num_tokenization_examples", type=int, default=2000, help="Number of examples passed to "
+                                                                                "preprocess_function")
+parser.add_argument("--num_generation_examples", type=int, default=5, help="Number of fill_mask calls per "
+                                                                           "generation profile")
+parser.add_argument("--generation_token_limit", type=int, default=400, help="max_token_limit used by fill_mask")
+parser.add_argument("--training_options_token_limit", type=int, default=350, help="max_token_limit used to compare "
+                                                                                    "the training loop options")
+parser.add_argument("--num_startup_runs", type=int, default=5, help="Number of runs of each entry point and start-up "
+                                                                    "case")
+
+preprocessing_scripts = {
+    "acl200_base": "preprocessing/base_datasets/data_preprocess_for_acl200_base.py",
+    "arxiv_base": "preprocessing/base_datasets/data_preprocess_for_arxiv_base.py",
+    "peerread_base": "preprocessing/base_datasets/data_preprocess_for_peerread_base.py",
+    "refseer_base": "preprocessing/base_datasets/data_preprocess_for_refseer_base.py",
+    "acl200_global": "preprocessing/global_datasets/preprocess_acl200_global.py",
+    "arxiv_global": "preprocessing/global_datasets/preprocess_arxiv_global.py",
+    "peerread_global": "preprocessing/global_datasets/preprocess_peerread_global.py",
+    "refseer_global": "preprocessing/global_datasets/preprocess_refseer_global.py",
+}
+
+train_scripts = {
+    "base": "train/train_base_cit_pred_BART.py",
+    "global": "train/train_global_cit_pred_BART.py",
+}
+
+# Training script and pretokenized_abstracts setting of each tokenization measurement
+tokenization_profiles = {
+    "base": ("base", False),
+    "global": ("global", False),
+    "global_pretokenized": ("global", True),
+}
+
+# Training loop options of the training scripts (--bf16, --torch_compile, --dataloader_num_workers,
+# --disable_pin_memory and --gradient_accumulation_steps)
+training_profiles = {
+    "default": {},
+    "bf16": {"bf16": True},
+    "torch_compile": {"torch_compile": True},
+    "gradient_accumulation": {"gradient_accumulation_steps": 4},
+    "dataloader_workers": {"dataloader_num_workers": 2, "dataloader_pin_memory": True},
+}
+
+# Entry points whose start-up time is measured, and the arguments of their "invalid_dataset" case
+startup_scripts = {
+    "preprocess_dataset": ("preprocessing/preprocess_dataset.py", ["--dataset", "acl200_base", "--contexts_file",
+                                                                   "{missing}", "--papers_file", "{missing}"]),
+    "train_base": (train_scripts["base"], ["--dataset_path", "{missing}"]),
+    "train_global": (train_scripts["global"], ["--dataset_path", "{missing}"]),
+    "qualitative_base": ("utils/base_version_generate_qualititative_analysis.py", ["--dataset_path", "{missing}"]),
+    "qualitative_global": ("utils/global_version_generate_qualitative_analysis.py", ["--dataset_path", "{missing}"]),
+}
+
+generation_profiles = {
+    "diverse_beam_search": {"early_stop_generation": False},
+    "diverse_beam_search_early_stop": {"early_stop_generation": True},
+}
+
+
+def load_script_module(script_path, module_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(project_folder, script_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(values, q):
+    sorted_values = sorted(values)
+    return sorted_values[min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))]
+
+
+def collect_environment_info():
+    import torch
+    import transformers
+
+    try:
+        git_revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=project_folder, capture_output=True,
+                                      text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_revision = None
+
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "torch": torch.__version__, "transformers": transformers.__version__, "git_revision": git_revision}
+
+
+def benchmark_preprocessing(corpus_folders, tokenizer_folder, work_folder, num_contexts):
+    from transformers import RobertaTokenizer
+
+    # The scripts load "roberta-base", which is redirected to the offline tokenizer.
+    offline_roberta_tokenizer = RobertaTokenizer.from_pretrained(tokenizer_folder)
+
+    results = {}
+    for script_name, script_path in preprocessing_scripts.items():
+        module = load_script_module(script_path, f"bench_{script_name}")
+
+        dataset_name = script_name.split("_")[0]
+        output_folder = os.path.join(work_folder, "preprocessed", script_name)
+        os.makedirs(output_folder, exist_ok=True)
+
+        module.contexts_file = os.path.join(corpus_folders[dataset_name], "contexts.json")
+        module.papers_file = os.path.join(corpus_folders[dataset_name], "papers.json")
+        module.dataset_output_file = os.path.join(output_folder, "context_dataset.csv")
+        module.vocab_output_file = os.path.join(output_folder, "citation_item_list.csv")
+        module.train_set_output_file = os.path.join(output_folder, "context_dataset_train.csv")
+        module.eval_set_output_file = os.path.join(output_folder, "context_dataset_eval.csv")
+
+        with contextlib.redirect_stdout(io.StringIO()), \
+                mock.patch.object(RobertaTokenizer, "from_pretrained", return_value=offline_roberta_tokenizer):
+            start_time = time.perf_counter()
+            module.preprocess_dataset()
+            preprocess_seconds = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            module.split_dataset()
+            split_seconds = time.perf_counter() - start_time
+
+        results[script_name] = {"contexts": num_contexts, "preprocess_seconds": preprocess_seconds,
+                                "split_seconds": split_seconds,
+                                "records_per_second": num_contexts / (preprocess_seconds + split_seconds)}
+        print(f"--> Preprocessing {script_name}: {results[script_name]['records_per_second']:.1f} records/sec")
+    return results
+
+
+def benchmark_tokenization(tokenizer_folder, token_limits, num_examples):
+    from transformers import BartTokenizer
+
+    results = {}
+    for variant, (script_variant, pretokenized_abstracts) in tokenization_profiles.items():
+        module = load_script_module(train_scripts[script_variant], f"bench_train_{variant}")
+        module.tokenizer = BartTokenizer.from_pretrained(tokenizer_folder)
+        module.pretokenized_abstracts = pretokenized_abstracts
+
+        examples = create_masked_examples(num_examples, with_abstracts=(script_variant == "global"),
+                                          separate_abstracts=pretokenized_abstracts)
+        batch = {key: [e[key] for e in examples] for key in examples[0]}
+
+        results[variant] = {}
+        for max_token_limit in token_limits:
+            module.max_token_limit = max_token_limit
+            if pretokenized_abstracts:  # A new store, so every limit includes tokenizing each paper once
+                module.paper_token_store = PaperTokenStore(module.tokenizer)
+
+            start_time = time.perf_counter()
+            model_inputs = module.preprocess_function(batch)
+            elapsed_seconds = time.perf_counter() - start_time
+
+            input_tokens = sum(sum(mask) for mask in model_inputs["attention_mask"])
+            results[variant][str(max_token_limit)] = {"examples": num_examples, "seconds": elapsed_seconds,
+                                                      "examples_per_second": num_examples / elapsed_seconds,
+                                                      "input_tokens_per_second": input_tokens / elapsed_seconds}
+            print(f"--> Tokenization {variant} ({max_token_limit} tokens): "
+                  f"{num_examples / elapsed_seconds:.1f} examples/sec")
+    return results
+
+
+def run_training_job(job):
+    # Runs inside its own spawned process so that the peak RSS belongs to this configuration only.
+    import torch
+    from transformers import BartForConditionalGeneration, BartTokenizer, DataCollatorForSeq2Seq
+
+    options = job.get("options", {})
+    accumulation_steps = options.get("gradient_accumulation_steps", 1)
+
+    torch.manual_seed(42)
+    tokenizer = BartTokenizer.from_pretrained(job["tokenizer_folder"])
+    model = BartForConditionalGeneration(create_bart_config(job["model_size"], len(tokenizer)))
+
+    module = load_script_module(train_scripts[job["variant"]], f"bench_train_{job['variant']}")
+    module.tokenizer = tokenizer
+    module.max_token_limit = job["max_token_limit"]
+    module.pretokenized_abstracts = False
+
+    batch_size = job["batch_size"]
+    examples = create_masked_examples(batch_size * accumulation_steps * (job["train_steps"] + 1),
+                                      with_abstracts=(job["variant"] == "global"))
+    features = module.preprocess_function({"masked_cit_context": [e["masked_cit_context"] for e in examples],
+                                           "masked_token_target": [e["masked_token_target"] for e in examples]})
+    rows = [{key: features[key][i] for key in features} for i in range(len(examples))]
+
+    # Batches are loaded as the Trainer loads them, with the dataloader workers and pinned memory of the options
+    data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, model=model)
+    data_loader = torch.utils.data.DataLoader(rows, batch_size=batch_size, collate_fn=data_collator,
+                                              num_workers=options.get("dataloader_num_workers", 0),
+                                              pin_memory=options.get("dataloader_pin_memory", False))
+    batches = iter(data_loader)
+
+    optimizer = torch.optim.AdamW(model.parameters(), lr=2e-5, weight_decay=0.01)
+    model.train()
+    if options.get("torch_compile", False):
+        model = torch.compile(model)
+
+    def autocast():
+        if options.get("bf16", False):
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def training_step():
+        # One optimizer step over accumulation_steps batches, as with --gradient_accumulation_steps
+        for _ in range(accumulation_steps):
+            with autocast():
+                loss = model(**next(batches)).loss / accumulation_steps
+            loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    training_step()  # Warm-up step (and compilation), excluded from the measurement
+
+    start_time = time.perf_counter()
+    for _ in range(job["train_steps"]):
+        training_step()
+    elapsed_seconds = time.perf_counter() - start_time
+
+    return {"batch_size": batch_size, "gradient_accumulation_steps": accumulation_steps, "steps": job["train_steps"],
+            "seconds_per_step": elapsed_seconds / job["train_steps"],
+            "samples_per_second": batch_size * accumulation_steps * job["train_steps"] / elapsed_seconds,
+            "peak_rss_mb": measure_peak_rss_mb()}
+
+
+def format_training_result(result):
+    if "error" in result:
+        return f"failed ({result['error']})"
+    return f"{result['samples_per_second']:.2f} samples/sec, peak RSS {result['peak_rss_mb']:.0f} MB"
+
+
+def benchmark_training(tokenizer_folder, token_limits, model_size, batch_size, train_steps):
+    results = {}
+    for variant in train_scripts:
+        results[variant] = {}
+        for max_token_limit in token_limits:
+            job = {"tokenizer_folder": tokenizer_folder, "variant": variant, "max_token_limit": max_token_limit,
+                   "model_size": model_size, "batch_size": batch_size, "train_steps": train_steps}
+            results[variant][str(max_token_limit)] = run_in_spawned_process(run_training_job, job)
+            print(f"--> Training {variant} ({max_token_limit} tokens): "
+                  f"{format_training_result(results[variant][str(max_token_limit)])}")
+    return results
+
+
+def benchmark_training_options(tokenizer_folder, max_token_limit, model_size, batch_size, train_steps):
+    results = {}
+    for variant in train_scripts:
+        results[variant] = {}
+        for profile_name, options in training_profiles.items():
+            job = {"tokenizer_folder": tokenizer_folder, "variant": variant, "max_token_limit": max_token_limit,
+                   "model_size": model_size, "batch_size": batch_size, "train_steps": train_steps,
+                   "options": options}
+            results[variant][profile_name] = run_in_spawned_process(run_training_job, job)
+            results[variant][profile_name]["options"] = options
+            print(f"--> Training {variant} with {profile_name}: "
+                  f"{format_training_result(results[variant][profile_name])}")
+    return results
+
+
+def benchmark_generation(tokenizer_folder, model_size, max_token_limit, num_examples):
+    import torch
+    from transformers import BartForConditionalGeneration, BartTokenizer
+    from cit_generation import CitationStoppingCriteria, create_cit_generation_config
+
+    torch.manual_seed(42)
+    tokenizer = BartTokenizer.from_pretrained(tokenizer_folder)
+    model = BartForConditionalGeneration(create_bart_config(model_size, len(tokenizer)))
+    model.eval()
+
+    module = load_script_module(train_scripts["base"], "bench_train_generation")
+    module.tokenizer = tokenizer
+    module.model = model
+    module.max_token_limit = max_token_limit
+    module.cit_generation_config = create_cit_generation_config(model)
+    module.cit_stopping_criteria = CitationStoppingCriteria(tokenizer)
+
+    examples = create_masked_examples(num_examples)
+
+    results = {}
+    for profile_name, profile in generation_profiles.items():
+        module.early_stop_generation = profile["early_stop_generation"]
+        module.decoder_step_counts = []
+
+        latencies = []
+        for e in examples:
+            start_time = time.perf_counter()
+            module.fill_mask(e["masked_cit_context"])
+            latencies.append(time.perf_counter() - start_time)
+
+        results[profile_name] = {"examples": num_examples, "max_token_limit": max_token_limit,
+                                 "mean_latency_ms": 1000 * sum(latencies) / len(latencies),
+                                 "p50_latency_ms": 1000 * percentile(latencies, 50),
+                                 "p95_latency_ms": 1000 * percentile(latencies, 95),
+                                 "avg_decoder_steps": sum(module.decoder_step_counts) / len(module.decoder_step_counts)}
+        print(f"--> Generation {profile_name}: {results[profile_name]['mean_latency_ms']:.1f} ms/example")
+    return results
+
+
+def benchmark_startup(work_folder, num_runs):
+    # Each run is a new interpreter, as for a short eval job. "help" and "invalid_dataset" exit after the argument
+    # checks, and "full_import" loads the script like the other benchmarks do, with all of its imports, which is the
+    # least that a run doing actual work pays before it starts.
+    missing_dataset_path = os.path.join(work_folder, "missing_dataset")
+    results = {}
+    for script_name, (script_path, invalid_dataset_args) in startup_scripts.items():
+        script_folder, script_file = os.path.split(os.path.join(project_folder, script_path))
+        full_import_code = (f"import importlib.util; spec = importlib.util.spec_from_file_location('startup', "
+                            f"{script_file!r}); spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+        startup_cases = {
+            "help": [sys.executable, script_file, "--help"],
+            "invalid_dataset": [sys.executable, script_file] + [argument.format(missing=missing_dataset_path)
+                                                                for argument in invalid_dataset_args],
+            "full_import": [sys.executable, "-c", full_import_code],
+        }
+
+        results[script_name] = {}
+        for case_name, command in startup_cases.items():
+            run_seconds = []
+            for _ in range(num_runs):
+                start_time = time.perf_counter()
+                completed_process = subprocess.run(command, cwd=script_folder, capture_output=True)
+                run_seconds.append(time.perf_counter() - start_time)
+            # 0 for "help" and "full_import" and 2 (argparse error) for "invalid_dataset", otherwise the time is not
+            # that of the measured case
+            results[script_name][case_name] = {"runs": num_runs, "mean_seconds": sum(run_seconds) / num_runs,
+                                               "p50_seconds": percentile(run_seconds, 50),
+                                               "min_seconds": min(run_seconds),
+                                               "exit_code": completed_process.returncode}
+        print(f"--> Start-up {script_name}: " + ", ".join(f"{case_name} {case['mean_seconds']:.2f} s"
+                                                          for case_name, case in results[script_name].items()))
+    return results
+
+
+def benchmark_tokenizer_loading(tokenizer_folder, work_folder, num_runs):
+    from transformers import BartTokenizer, BartTokenizerFast
+    from pretrained_assets import register_asset, resolve_asset_folder
+
+    # The offline tokenizer is registered under the bart-base name, which adds its serialized fast tokenizer
+    registry_file = os.path.join(work_folder, "assets", "asset_registry.json")
+    os.makedirs(os.path.dirname(registry_file), exist_ok=True)
+    register_asset("facebook/bart-base", tokenizer_folder, registry_file)
+    asset_folder = resolve_asset_folder("facebook/bart-base", registry_file)
+
+    loading_cases = {
+        "slow": lambda: BartTokenizer.from_pretrained(tokenizer_folder),
+        # The tokenizer folder has no tokenizer.json, so the fast tokenizer is converted from vocab.json and merges.txt
+        "fast_converted": lambda: BartTokenizerFast.from_pretrained(tokenizer_folder),
+        "fast_serialized": lambda: BartTokenizerFast.from_pretrained(asset_folder),
+    }
+
+    results = {}
+    for case_name, load_tokenizer in loading_cases.items():
+        load_seconds = []
+        for _ in range(num_runs):
+            start_time = time.perf_counter()
+            load_tokenizer()
+            load_seconds.append(time.perf_counter() - start_time)
+        results[case_name] = {"runs": num_runs, "mean_ms": 1000 * sum(load_seconds) / num_runs,
+                              "p50_ms": 1000 * percentile(load_seconds, 50)}
+    print("--> Tokenizer loading: " + ", ".join(f"{case_name} {case['mean_ms']:.1f} ms"
+                                                for case_name, case in results.items()))
+    return results
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    work_folder = args.work_folder if args.work_folder is not None else tempfile.mkdtemp(prefix="citebart_bench_")
+
+    corpus_folders = {}
+    for name in dataset_names:
+        corpus_folders[name] = write_synthetic_dataset(name, os.path.join(work_folder, "corpus", name),
+                                                       args.num_contexts)
+
+    tokenizer_texts = [e["masked_cit_context"] + " " + e["masked_token_target"]
+                       for e in create_masked_examples(2000, seed=7, with_abstracts=True)]
+    offline_tokenizer_folder = build_offline_tokenizer(os.path.join(work_folder, "tokenizer"), tokenizer_texts)
+
+    benchmark_results = {"environment": collect_environment_info(), "settings": vars(args)}
+
+    if "preprocessing" in args.benchmarks:
+        benchmark_results["preprocessing"] = benchmark_preprocessing(corpus_folders, offline_tokenizer_folder,
+                                                                     work_folder, args.num_contexts)
+    if "tokenization" in args.benchmarks:
+        benchmark_results["tokenization"] = benchmark_tokenization(offline_tokenizer_folder, args.token_limits,
+                                                                   args.num_tokenization_examples)
+    if "training" in args.benchmarks:
+        benchmark_results["training"] = benchmark_training(offline_tokenizer_folder, args.token_limits,
+                                                           args.model_size, args.batch_size, args.train_steps)
+    if "training_options" in args.benchmarks:
+        benchmark_results["training_options"] = benchmark_training_options(offline_tokenizer_folder,
+                                                                           args.training_options_token_limit,
+                                                                           args.model_size, args.batch_size,
+                                                                           args.train_steps)
+    if "generation" in args.benchmarks:
+        benchmark_results["generation"] = benchmark_generation(offline_tokenizer_folder, args.model_size,
+                                                               args.generation_token_limit,
+                                                               args.num_generation_examples)
+    if "startup" in args.benchmarks:
+        benchmark_results["startup"] = benchmark_startup(work_folder, args.num_startup_runs)
+        benchmark_results["startup"]["tokenizer_loading"] = benchmark_tokenizer_loading(offline_tokenizer_folder,
+                                                                                        work_folder,
+                                                                                        args.num_startup_runs)
+
+    with open(args.output_file, "w") as outfile:
+        json.dump(benchmark_results, outfile, indent=2)
+    print(f"\n--> Benchmark results are written to {args.output_file}\n")
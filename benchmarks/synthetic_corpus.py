@@ -0,0 +1,260 @@
+import argparse
+import functools
+import json
+import math
+import os
+import random
+
+
+# Synthetic corpora that follow the contexts.json/papers.json schemas of the four original datasets, so that the
+# preprocessing and training code can be tested and load-tested without the real downloads.
+#
+# Both files are written as a stream and the paper metadata is derived from the paper index on demand, so memory use
+# stays flat from 10K up to 10M contexts.
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--datasets", type=str, nargs="+", default=["acl200", "arxiv", "peerread", "refseer"],
+                    help="Schemas of the generated corpora")
+parser.add_argument("--num_contexts", type=int, default=10000, help="Number of citation contexts per corpus")
+parser.add_argument("--num_papers", type=int, default=None, help="Number of papers per corpus. Defaults to a quarter "
+                                                                 "of the number of contexts")
+parser.add_argument("--zipf_exponent", type=float, default=1.0, help="Exponent of the Zipfian citation frequencies")
+parser.add_argument("--output_folder", type=str, default="../preprocessing/original_datasets",
+                    help="Each corpus is written into a '<dataset>_synthetic' folder inside this folder")
+parser.add_argument("--seed", type=int, default=42, help="Random seed of the generator")
+
+dataset_names = ["acl200", "arxiv", "peerread", "refseer"]
+
+# Context lengths are in words for each side of the citation. ACL-200 and PeerRead have much longer contexts than
+# arXiv and RefSeer. Year ranges follow the ranges used for the missing years in the preprocessing scripts.
+dataset_profiles = {
+    "acl200": {"first_year": 1965, "last_year": 2015, "context_words": (60, 140), "null_year_rate": 0.0,
+               "yearless_marker_rate": 0.01, "other_citation_rate": 0.0},
+    "arxiv": {"first_year": 1991, "last_year": 2020, "context_words": (40, 90), "null_year_rate": 0.0,
+              "yearless_marker_rate": 0.0, "other_citation_rate": 0.3},
+    "peerread": {"first_year": 1990, "last_year": 2017, "context_words": (60, 140), "null_year_rate": 0.0,
+                 "yearless_marker_rate": 0.0, "other_citation_rate": 0.3},
+    "refseer": {"first_year": 1960, "last_year": 2014, "context_words": (15, 50), "null_year_rate": 0.05,
+                "yearless_marker_rate": 0.0, "other_citation_rate": 0.0},
+}
+
+word_list = ["model", "language", "translation", "neural", "network", "training", "data", "corpus", "parsing",
+             "semantic", "syntactic", "alignment", "attention", "encoder", "decoder", "sequence", "task", "results",
+             "performance", "baseline", "approach", "method", "features", "learning", "representation", "word",
+             "sentence", "document", "retrieval", "citation", "graph", "evaluation", "accuracy", "tree", "grammar",
+             "statistical", "probabilistic", "inference", "optimization", "gradient", "layer", "embedding",
+             "context", "prediction", "annotation", "dataset", "benchmark", "we", "propose", "show", "that", "the",
+             "a", "of", "in", "for", "with", "on", "and", "is", "are", "this", "our", "previous", "work", "recent",
+             "improves", "outperforms", "uses", "based", "large", "small", "new", "standard", "following"]
+
+first_names = ["John", "Mary", "Wei", "Anna", "David", "Maria", "Hiroshi", "Elena", "Ahmed", "Laura", "Pierre",
+               "Olga", "Juan", "Sara", "Michael", "Yuki", "Peter", "Ines", "Rahul", "Emma"]
+
+common_surnames = ["Smith", "Chen", "Garcia", "Kumar", "Nguyen", "Brown", "Müller", "Rossi", "Tanaka", "Ivanov",
+                   "Silva", "Kim", "Dubois", "Johansson", "Novak", "Cohen", "Papadopoulos", "Yilmaz", "Kowalski",
+                   "Andersen", "Och", "Ney", "Collins", "Manning", "Koehn", "Papineni", "Mikolov", "Vaswani",
+                   "Devlin", "Lewis"]
+
+# Real author lists contain punctuation that has to survive the citation regexes of the preprocessing scripts.
+unusual_surnames = ["O'Brien", "Smith-Jones", "D'Souza", "Saint-Pierre", "Martínez-López"]
+
+surname_syllables = ["ka", "ro", "mi", "ten", "sha", "lo", "ber", "vin", "ga", "del", "mur", "son", "an", "ti", "wa",
+                     "ry", "zen", "po", "la", "ki"]
+
+# Share of papers with 1, 2, 3, ... 8 authors
+num_authors_weights = [17, 27, 22, 14, 8, 5, 4, 3]
+
+
+def generate_surname(rng):
+    roll = rng.random()
+    if roll < 0.3:
+        return rng.choice(common_surnames)
+    if roll < 0.31:
+        return rng.choice(unusual_surnames)
+    return "".join(rng.choices(surname_syllables, k=rng.randint(2, 4))).capitalize()
+
+
+def random_text(rng, num_words):
+    return " ".join(rng.choices(word_list, k=num_words))
+
+
+def clipped_lognormal(rng, median, sigma, low, high):
+    return max(low, min(high, int(rng.lognormvariate(math.log(median), sigma))))
+
+
+class SyntheticCorpus:
+
+    def __init__(self, dataset_name, num_papers, zipf_exponent=1.0, seed=42):
+        self.dataset_name = dataset_name
+        self.profile = dataset_profiles[dataset_name]
+        self.num_papers = num_papers
+        self.zipf_exponent = zipf_exponent
+        self.seed = seed
+
+        # Popularity ranks are spread over the paper ids with a multiplicative permutation, so that the most cited
+        # papers are not simply the first ones.
+        self.rank_multiplier = 2654435761 % num_papers or 1
+        while math.gcd(self.rank_multiplier, num_papers) != 1:
+            self.rank_multiplier += 1
+
+    def paper_id(self, paper_idx):
+        if self.dataset_name == "acl200":
+            return f"P{paper_idx // 10000:02d}-{paper_idx % 10000:04d}"
+        if self.dataset_name == "peerread":
+            return f"pr{paper_idx}"
+        return str(paper_idx)
+
+    @functools.lru_cache(maxsize=200000)
+    def paper_metadata(self, paper_idx):
+        rng = random.Random(f"{self.seed}-{self.dataset_name}-{paper_idx}")
+
+        num_authors = rng.choices(range(1, len(num_authors_weights) + 1), weights=num_authors_weights)[0]
+        authors = [f"{rng.choice(first_names)} {generate_surname(rng)}" for _ in range(num_authors)]
+
+        # Publication counts grow every year, so recent years are much more frequent.
+        year = max(self.profile["first_year"], self.profile["last_year"] - int(rng.expovariate(1 / 8)))
+        if rng.random() < self.profile["null_year_rate"]:
+            year = "NULL"
+        return authors, year
+
+    def paper_record(self, paper_idx):
+        rng = random.Random(f"{self.seed}-{self.dataset_name}-text-{paper_idx}")
+        authors, year = self.paper_metadata(paper_idx)
+        return {"title": random_text(rng, clipped_lognormal(rng, 9, 0.3, 3, 25)).capitalize(),
+                "abstract": random_text(rng, clipped_lognormal(rng, 150, 0.45, 20, 600)).capitalize() + ".",
+                "authors": authors, "year": year}
+
+    def sample_cited_paper(self, rng):
+        # Inverse CDF of the continuous Zipf distribution on [1, num_papers]
+        u = rng.random()
+        if abs(self.zipf_exponent - 1) < 1e-9:
+            rank = self.num_papers ** u
+        else:
+            one_minus_s = 1 - self.zipf_exponent
+            rank = ((self.num_papers ** one_minus_s - 1) * u + 1) ** (1 / one_minus_s)
+        rank = min(self.num_papers, int(rank)) - 1
+        return (rank * self.rank_multiplier) % self.num_papers
+
+    def citation_names_and_year(self, paper_idx):
+        authors, year = self.paper_metadata(paper_idx)
+        cit_year = year if year != "NULL" else "n.d."
+        surnames = [a.split(" ")[-1] for a in authors]
+        if len(surnames) == 1:
+            return surnames[0], cit_year
+        if len(surnames) == 2:
+            return f"{surnames[0]} and {surnames[1]}", cit_year
+        return f"{surnames[0]} et al.", cit_year
+
+    def create_target_citation(self, paper_idx):
+        # Same format as the masked_token_target column, e.g. "Smith et al., 2015"
+        names, cit_year = self.citation_names_and_year(paper_idx)
+        return f"{names}, {cit_year}"
+
+    def create_in_text_citation(self, paper_idx, rng):
+        names, cit_year = self.citation_names_and_year(paper_idx)
+        if rng.random() < 0.5:
+            return f"({names}, {cit_year})"
+        return f"{names} ({cit_year})"
+
+    def create_marker(self, paper_idx, rng):
+        authors, year = self.paper_metadata(paper_idx)
+        if rng.random() < self.profile["yearless_marker_rate"]:  # e.g. "[S91]", which ACL-200 preprocessing skips
+            return f"[{authors[0].split(' ')[-1][0]}{rng.randint(10, 99)}]"
+        return ", ".join(authors + [str(year)])
+
+    def contexts(self, num_contexts):
+        rng = random.Random(f"{self.seed}-{self.dataset_name}-contexts")
+        min_words, max_words = self.profile["context_words"]
+
+        citing_idx = 0
+        contexts_left_for_citing_paper = 0
+        for context_idx in range(num_contexts):
+            # Contexts of the same citing paper come together, as in the original datasets.
+            if contexts_left_for_citing_paper == 0:
+                citing_idx = rng.randrange(self.num_papers)
+                contexts_left_for_citing_paper = 1 + int(rng.expovariate(1 / 15))
+            contexts_left_for_citing_paper -= 1
+
+            ref_idx = self.sample_cited_paper(rng)
+            citing_id = self.paper_id(citing_idx)
+            ref_id = self.paper_id(ref_idx)
+            left_text = random_text(rng, rng.randint(min_words, max_words))
+            right_text = random_text(rng, rng.randint(min_words, max_words))
+            if rng.random() < self.profile["other_citation_rate"]:
+                right_text = right_text.replace(" ", " OTHERCIT ", 1)
+
+            context_id = f"{citing_id}_{ref_id}_{context_idx}"
+            row = {"context_id": context_id, "citing_id": citing_id, "refid": ref_id}
+            if self.dataset_name == "acl200":
+                row["marker"] = self.create_marker(ref_idx, rng)
+                row["citation_context"] = f"{left_text} {self.create_in_text_citation(ref_idx, rng)} {right_text}"
+                row["masked_text"] = f"{left_text} TARGETCIT {right_text}"
+            elif self.dataset_name == "refseer":
+                row["raw"] = f"{left_text} =-={self.create_in_text_citation(ref_idx, rng)}-=- {right_text}"
+            else:
+                row["masked_text"] = f"{left_text} TARGETCIT {right_text}"
+            yield context_id, row
+
+    def papers(self):
+        for paper_idx in range(self.num_papers):
+            yield self.paper_id(paper_idx), self.paper_record(paper_idx)
+
+
+def write_json_object_stream(file_path, key_value_pairs):
+    # Writes {"key": value, ...} without holding the whole object in memory.
+    with open(file_path, "w") as outfile:
+        outfile.write("{")
+        for idx, (key, value) in enumerate(key_value_pairs):
+            if idx > 0:
+                outfile.write(", ")
+            outfile.write(json.dumps(key))
+            outfile.write(": ")
+            outfile.write(json.dumps(value))
+        outfile.write("}")
+
+
+def write_synthetic_dataset(dataset_name, output_folder, num_contexts, num_papers=None, zipf_exponent=1.0, seed=42):
+    if num_papers is None:
+        num_papers = max(10, num_contexts // 4)
+
+    corpus = SyntheticCorpus(dataset_name, num_papers, zipf_exponent=zipf_exponent, seed=seed)
+
+    os.makedirs(output_folder, exist_ok=True)
+    write_json_object_stream(os.path.join(output_folder, "contexts.json"), corpus.contexts(num_contexts))
+    write_json_object_stream(os.path.join(output_folder, "papers.json"), corpus.papers())
+    return output_folder
+
+
+def create_masked_examples(num_examples, seed=42, with_abstracts=False, separate_abstracts=False):
+    # Rows shaped like the preprocessed context_dataset_train.csv files, used by the tokenization and model benchmarks.
+    # With separate_abstracts, the citing title and abstract are kept in their own columns instead of being joined.
+    rng = random.Random(seed)
+    corpus = SyntheticCorpus("arxiv", max(10, num_examples // 4), seed=seed)
+    min_words, max_words = corpus.profile["context_words"]
+
+    examples = []
+    for _ in range(num_examples):
+        ref_idx = corpus.sample_cited_paper(rng)
+        masked_context = (f"{random_text(rng, rng.randint(min_words, max_words))} <mask> "
+                          f"{random_text(rng, rng.randint(min_words, max_words))}")
+        example = {"masked_token_target": corpus.create_target_citation(ref_idx)}
+        if with_abstracts or separate_abstracts:
+            citing_paper = corpus.paper_record(rng.randrange(corpus.num_papers))
+            if separate_abstracts:
+                example["citing_title"] = citing_paper["title"]
+                example["citing_abstract"] = citing_paper["abstract"]
+            else:
+                masked_context = citing_paper["title"] + " </s> " + citing_paper["abstract"] + " </s> " + masked_context
+        example["masked_cit_context"] = masked_context
+        examples.append(example)
+    return examples
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    for name in args.datasets:
+        dataset_folder = os.path.join(args.output_folder, f"{name}_synthetic")
+        write_synthetic_dataset(name, dataset_folder, args.num_contexts, num_papers=args.num_papers,
+                                zipf_exponent=args.zipf_exponent, seed=args.seed)
+        print(f"--> Synthetic {name} corpus with {args.num_contexts} contexts is written to {dataset_folder}")
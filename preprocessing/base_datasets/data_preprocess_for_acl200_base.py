@@ -1,6 +1,10 @@
-import pandas as pd
-from dateutil.parser import parse
-import re
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "train"))
+from preprocessing_engine import create_dataset_config, run_preprocessing, run_split  # noqa: E402
+from pretrained_assets import load_pretrained  # noqa: E402
 
 
 contexts_file = "../original_datasets/acl200_original/contexts.json"
@@ -11,134 +15,24 @@ vocab_output_file = "./acl200_base/citation_item_list.csv"
 train_set_output_file = "./acl200_base/context_dataset_train.csv"
 eval_set_output_file = "./acl200_base/context_dataset_eval.csv"
 
+num_workers = 1  # Number of processes used for the tokenization stages
 
-def check_if_string_contains_year(marker):
-    if len(marker) < 8:  # Eliminate smaller citation markers.
-        return False
-    match = re.match(r'.*([1-2][0-9]{3})', marker)
-    if match is not None:
-        return True
-    return False
-
-
-def create_target_token_for_ref_paper_id(marker_from_contexts_file):
-    temp_marker = marker_from_contexts_file.replace('(', ' ').replace(')', ' ')
-
-    if not check_if_string_contains_year(temp_marker):  # Skip marker without any years, e.g. "[S91]", "[Chodorov]"
-        return ""
-    year_from_marker_info = str(parse(temp_marker, fuzzy=True).year)
-
-    authors_from_marker = marker_from_contexts_file.split(", ")[:-1]
-
-    target_cit_token = ""
-    if len(authors_from_marker) == 1:
-        target_cit_token = authors_from_marker[0].split(" ")[-1] + ", " + year_from_marker_info  # No capitalize()
-    elif len(authors_from_marker) == 2:
-        target_cit_token = authors_from_marker[0].split(" ")[-1] + " and " + \
-                           authors_from_marker[1].split(" ")[-1] + ", " + year_from_marker_info
-    elif len(authors_from_marker) > 2:
-        target_cit_token = authors_from_marker[0].split(" ")[-1] + " et al., " + year_from_marker_info
-
-    return target_cit_token
-
-
-def place_mask_and_target_cit_on_ground_truth_context(ground_truth_context, target_cit_token,
-                                                      marker_from_contexts_file):
-    number_of_authors = len(marker_from_contexts_file.split(", ")[:-1])
-
-    masked_context = ""
-    unmasked_context = ""
-
-    if number_of_authors > 2:
-        split_target_cit = target_cit_token.split(" et al., ")
-        regex_string = re.compile(rf"{split_target_cit[0]}(.{{0,10}}?){split_target_cit[1]}")
-
-        masked_context = re.sub(regex_string, ' <mask> ', ground_truth_context)
-        unmasked_context = re.sub(regex_string, f' {target_cit_token} ', ground_truth_context)
-
-    elif number_of_authors == 2:
-        temp_split_target_cit = target_cit_token.split(" and ")
-        temp_split_target_cit_2 = temp_split_target_cit[1].split(", ")
-        split_target_cit = [temp_split_target_cit[0], temp_split_target_cit_2[0], temp_split_target_cit_2[1]]
-        regex_string = re.compile(rf"{split_target_cit[0]}(.{{0,10}}?){split_target_cit[1]}(.{{0,10}}?)"
-                                  rf"{split_target_cit[2]}")
-
-        masked_context = re.sub(regex_string, ' <mask> ', ground_truth_context)
-        unmasked_context = re.sub(regex_string, f' {target_cit_token} ', ground_truth_context)
-
-    elif number_of_authors == 1:
-        split_target_cit = target_cit_token.split(", ")
-        regex_string = re.compile(rf"{split_target_cit[0]}(.{{0,10}}?){split_target_cit[1]}")
 
-        masked_context = re.sub(regex_string, ' <mask> ', ground_truth_context)
-        unmasked_context = re.sub(regex_string, f' {target_cit_token} ', ground_truth_context)
-
-    if masked_context.find("<mask>") == -1:
-        masked_context = ""
-        unmasked_context = ""
-
-    return masked_context, unmasked_context
+# The dataset specific parsing and all shared stages are in the preprocessing engine, see "preprocess_dataset.py".
+def create_config():
+    return create_dataset_config("acl200_base", contexts_file=contexts_file, papers_file=papers_file,
+                                 dataset_output_file=dataset_output_file, vocab_output_file=vocab_output_file,
+                                 train_set_output_file=train_set_output_file,
+                                 eval_set_output_file=eval_set_output_file,
+                                 num_workers=num_workers)
 
 
 def preprocess_dataset():
-    contexts_df = pd.read_json(contexts_file)
-
-    cit_contexts_list = []
-    masked_cit_contexts_list = []
-    masked_token_target_list = []
-
-    skip_count = 0
-    for i in contexts_df:
-        temp_context_row = contexts_df[i]
-        ground_truth_context = temp_context_row['citation_context']
-
-        marker_from_contexts_file = temp_context_row['marker']
-        temp_target_token = create_target_token_for_ref_paper_id(marker_from_contexts_file)
-        if temp_target_token == "":
-            skip_count += 1
-            continue
-
-        temp_masked_text, temp_unmasked_text = \
-            place_mask_and_target_cit_on_ground_truth_context(ground_truth_context, temp_target_token,
-                                                              marker_from_contexts_file)
-        if temp_masked_text == "" or temp_unmasked_text == "":
-            skip_count += 1
-            continue
-
-        masked_token_target_list.append(temp_target_token)
-        masked_cit_contexts_list.append(temp_masked_text)
-        cit_contexts_list.append(temp_unmasked_text)
-
-    new_df_table = pd.DataFrame({'citation_context': cit_contexts_list, 'masked_cit_context': masked_cit_contexts_list,
-                                 'masked_token_target': masked_token_target_list})
-    new_df_table.to_csv(dataset_output_file)
-
-    citations_for_vocab = list(set(masked_token_target_list))
-    vocab_additions = pd.DataFrame({'citation_items': citations_for_vocab})
-    vocab_additions.to_csv(vocab_output_file)
-
-    print("--> Length of whole set: ", len(cit_contexts_list))
-    print("--> Skip count: ", skip_count, "\n")
-    print("--> Citation item size: ", len(citations_for_vocab), "\n")
+    run_preprocessing(create_config(), load_pretrained)
 
 
 def split_dataset():
-    contexts_df = pd.read_csv(dataset_output_file)
-
-    # Shuffle the DataFrame rows
-    contexts_df = contexts_df.sample(frac=1, random_state=42)
-
-    split_threshold = int(len(contexts_df) * 80 / 100)  # I have selected 20% as the eval set.
-
-    # Split the df into train and eval sets
-    df_train = contexts_df.iloc[:split_threshold, 1:]
-    df_eval = contexts_df.iloc[split_threshold:, 1:]
-
-    print("--> Length of train set: ", len(df_train))
-    print("--> Length of eval set: ", len(df_eval))
-
-    df_train.to_csv(train_set_output_file, index=False)
-    df_eval.to_csv(eval_set_output_file, index=False)
+    run_split(create_config())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,51 @@
+import argparse
+import json
+import random
+import time
+from preprocessing_engine.citations import (create_target_token_from_marker,
+                                            create_target_token_from_marker_with_dateutil, parse_citation_marker)
+
+
+# Compares the citation tokens of the marker parser with the tokens of the previous dateutil based implementation
+# on a sample of ACL-200 markers. Run it before preprocessing a new dump. tests/test_marker_parser.py checks the parser
+# against recorded tokens of the previous implementation without the dataset or dateutil.
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--contexts_file", type=str, default="./original_datasets/acl200_original/contexts.json",
+                    help="Path of contexts.json of ACL-200")
+parser.add_argument("--sample_size", type=int, default=10000, help="Number of markers compared, 0 compares all")
+parser.add_argument("--seed", type=int, default=42, help="Seed of the marker sample")
+parser.add_argument("--max_printed_mismatches", type=int, default=20, help="Number of mismatching markers printed")
+
+
+def time_marker_function(function, markers):
+    start_time = time.perf_counter()
+    tokens = [function(m) for m in markers]
+    return tokens, time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    with open(args.contexts_file) as infile:
+        contexts = json.load(infile)
+
+    markers = [context_row['marker'] for context_row in contexts.values()]
+    if 0 < args.sample_size < len(markers):
+        markers = random.Random(args.seed).sample(markers, args.sample_size)
+
+    reference_tokens, reference_seconds = time_marker_function(create_target_token_from_marker_with_dateutil, markers)
+    parse_citation_marker.cache_clear()
+    parsed_tokens, parser_seconds = time_marker_function(create_target_token_from_marker, markers)
+
+    mismatches = [(m, r, p) for m, r, p in zip(markers, reference_tokens, parsed_tokens) if r != p]
+    for marker, reference_token, parsed_token in mismatches[:args.max_printed_mismatches]:
+        print(f"Marker: {marker!r} --> dateutil: {reference_token!r}, parser: {parsed_token!r}")
+
+    print("--> Compared markers: ", len(markers))
+    print("--> Mismatching markers: ", len(mismatches))
+    print(f"--> dateutil: {reference_seconds:.3f} s, parser: {parser_seconds:.3f} s "
+          f"({reference_seconds / max(parser_seconds, 1e-9):.1f}x faster)\n")
+
+    if mismatches:
+        raise SystemExit(1)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+from preprocessing_engine import create_dataset_config, dataset_defaults
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset", type=str, required=True, choices=list(dataset_defaults), help="Dataset and variant "
+                                                                                                "to preprocess")
+parser.add_argument("--config_file", type=str, default=None, help="JSON file with settings that override the "
+                                                                  "defaults of the dataset")
+parser.add_argument("--contexts_file", type=str, default=None, help="Path of contexts.json of the original dataset")
+parser.add_argument("--papers_file", type=str, default=None, help="Path of papers.json of the original dataset")
+parser.add_argument("--output_folder", type=str, default=None, help="Folder of the preprocessed dataset files")
+parser.add_argument("--max_token_limit", type=int, default=None, help="Token limit of the contexts of base datasets")
+parser.add_argument("--context_limit", type=int, default=None, help="Token limit of the contexts of global datasets")
+parser.add_argument("--abstract_limit", type=int, default=None, help="Token limit of the abstracts of global "
+                                                                     "datasets")
+parser.add_argument("--num_workers", type=int, default=None, help="Number of processes for the tokenization stages")
+parser.add_argument("--chunk_size", type=int, default=None, help="Number of contexts processed and written at once")
+parser.add_argument("--fast_tokenizer", type=bool, default=None, help="Make this flag True to use the Rust based "
+                                                                      "tokenizer for trimming and shortening")
+parser.add_argument("--incremental", type=bool, default=None, help="Make this flag True to only tokenize the contexts "
+                                                                   "and papers that changed since the previous run")
+parser.add_argument("--split_mode", type=str, default=None, choices=["shuffle", "hash"], help="'hash' assigns each "
+                    "row to the train or eval set while it is written, and keeps its split when the dataset grows")
+parser.add_argument("--split_by", type=str, default=None, choices=["context", "citing_paper"], help="Identity hashed "
+                    "by the hash split. 'citing_paper' keeps all contexts of a paper in the same split")
+parser.add_argument("--output_format", type=str, default=None, choices=["csv", "parquet"], help="File format of the "
+                    "preprocessed dataset files")
+parser.add_argument("--paper_table", type=bool, default=None, help="Make this flag True for global datasets to write "
+                                                                  "the titles and abstracts once to a paper table")
+parser.add_argument("--store_token_ids", type=bool, default=None, help="Make this flag True for global datasets to "
+                                                                      "also store the trimmed contexts as token ids "
+                                                                      "of the training tokenizer")
+parser.add_argument("--skip_split", type=bool, default=False, help="Skips creating the train and eval splits")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    dataset_config = create_dataset_config(args.dataset, config_file=args.config_file,
+                                           contexts_file=args.contexts_file, papers_file=args.papers_file,
+                                           output_folder=args.output_folder, max_token_limit=args.max_token_limit,
+                                           context_limit=args.context_limit, abstract_limit=args.abstract_limit,
+                                           num_workers=args.num_workers, chunk_size=args.chunk_size,
+                                           fast_tokenizer=args.fast_tokenizer, incremental=args.incremental,
+                                           split_mode=args.split_mode, split_by=args.split_by,
+                                           output_format=args.output_format, paper_table=args.paper_table,
+                                           store_token_ids=args.store_token_ids)
+    for input_key in ["contexts_file", "papers_file"]:
+        if not os.path.exists(dataset_config[input_key]):
+            parser.error(f"{dataset_config[input_key]} does not exist, set it with --{input_key} or --config_file")
+
+    from preprocessing_engine import run_preprocessing, run_split  # Imports pandas and the engine
+
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train"))
+    from pretrained_assets import load_pretrained
+
+    run_preprocessing(dataset_config, load_pretrained)
+
+    if not args.skip_split:
+        run_split(dataset_config)
@@ -0,0 +1,10 @@
+from .config import create_dataset_config, dataset_defaults
+
+
+def __getattr__(name):
+    # The engine imports pandas, so it is only imported when run_preprocessing or run_split is first used. Scripts
+    # can set up and check their config before that.
+    if name in ("run_preprocessing", "run_split"):
+        from . import engine
+        return getattr(engine, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,96 @@
+import re
+from .citations import (create_target_token_for_paper, create_target_token_from_marker,
+                        place_mask_and_target_cit_on_ground_truth_context)
+
+
+# A source adapter turns one row of an original contexts.json file into a citation record with the masked context,
+# the target citation token and the ids of the citing and cited papers. It returns None for rows that are skipped.
+
+refseer_citation_tags = re.compile(r'=-=(.*?)-=-')
+
+
+# This check exists to check raw data just in case. However, all raw data already contains =-=, -=-.
+def check_if_raw_text_has_special_tags(raw_text):
+    if raw_text.find('=-=') == -1:
+        return False
+    if raw_text.find('-=-') == -1:
+        return False
+    return True
+
+
+# ACL-200 has no author lists in papers.json, so the target token is built from the citation marker.
+def parse_acl200_context(context_row, papers, config, year_assigner):
+    marker_from_contexts_file = context_row['marker']
+    temp_target_token = create_target_token_from_marker(marker_from_contexts_file)
+    if temp_target_token == "":
+        return None
+
+    record = {"target_token": temp_target_token, "citing_id": str(context_row['citing_id']),
+              "ref_id": context_row['context_id'].split("_")[1]}
+
+    if config["variant"] == "base":
+        temp_masked_text, temp_unmasked_text = \
+            place_mask_and_target_cit_on_ground_truth_context(context_row['citation_context'], temp_target_token,
+                                                              marker_from_contexts_file)
+        if temp_masked_text == "" or temp_unmasked_text == "":
+            return None
+        record["masked_context"] = temp_masked_text
+        record["ground_truth_context"] = temp_unmasked_text
+        return record
+
+    temp_masked_text = context_row['masked_text']
+    if config["strip_other_citations"]:
+        temp_masked_text = temp_masked_text.replace('OTHERCIT', '')
+    record["masked_context"] = temp_masked_text.replace('TARGETCIT', config["mask_text"])
+    return record
+
+
+# arXiv and PeerRead mark the target citation with TARGETCIT and the other citations with OTHERCIT.
+def parse_masked_text_context(context_row, papers, config, year_assigner):
+    ref_id = str(context_row['refid'])
+    if ref_id not in papers:
+        return None
+
+    temp_target_token = create_target_token_for_paper(papers[ref_id], ref_id, year_assigner,
+                                                      config["capitalize_surnames"])
+    if temp_target_token == "":  # If author names are invalid, the function above returns an empty string.
+        return None
+
+    temp_masked_text = context_row['masked_text']
+    if config["strip_other_citations"]:
+        temp_masked_text = temp_masked_text.replace('OTHERCIT', '')
+
+    return {"target_token": temp_target_token, "citing_id": str(context_row['citing_id']), "ref_id": ref_id,
+            "masked_context": temp_masked_text.replace('TARGETCIT', config["mask_text"]),
+            "ground_truth_context": temp_masked_text.replace('TARGETCIT', temp_target_token)}
+
+
+# RefSeer contexts are raw text with the target citation between =-= and -=- tags.
+def parse_refseer_context(context_row, papers, config, year_assigner):
+    ref_id = str(context_row['refid'])
+    if ref_id not in papers:
+        return None
+
+    temp_target_token = create_target_token_for_paper(papers[ref_id], ref_id, year_assigner,
+                                                      config["capitalize_surnames"])
+    if temp_target_token == "":
+        return None
+
+    temp_raw_text = context_row['raw']
+    if not check_if_raw_text_has_special_tags(temp_raw_text):  # This if branch is never entered.
+        return None
+
+    # Some examples in the dataset contain '\\' substrings that cause problems with re package. They get replaced.
+    temp_target_token = temp_target_token.replace("\\", "//")
+
+    return {"target_token": temp_target_token, "citing_id": str(context_row['citing_id']), "ref_id": ref_id,
+            "masked_context": refseer_citation_tags.sub(' <mask> ', temp_raw_text),
+            "ground_truth_context": refseer_citation_tags.sub(f' {temp_target_token} ', temp_raw_text)}
+
+
+source_adapters = {
+    "acl200": parse_acl200_context,
+    "arxiv": parse_masked_text_context,
+    "peerread": parse_masked_text_context,
+    "refseer": parse_refseer_context,
+}
@@ -0,0 +1,140 @@
+import functools
+import random
+import re
+
+
+# Author-date citation tokens, e.g. "Smith, 2015", "Smith and Chen, 2015" or "Smith et al., 2015"
+def create_target_token_from_authors(author_names, year, capitalize_surnames=True):
+    surnames = [a.split(" ")[-1] for a in author_names]
+    if capitalize_surnames:
+        surnames = [s.capitalize() for s in surnames]
+
+    target_cit_token = ""
+    if len(surnames) == 1:
+        target_cit_token = surnames[0] + ", " + year
+    elif len(surnames) == 2:
+        target_cit_token = surnames[0] + " and " + surnames[1] + ", " + year
+    elif len(surnames) > 2:
+        target_cit_token = surnames[0] + " et al., " + year
+
+    return target_cit_token
+
+
+class MissingYearAssigner:
+    # Papers with a 'NULL' year get a random year, which stays the same for every context citing that paper.
+    def __init__(self, year_range=(1960, 2014), seed=42):
+        self.year_range = year_range
+        self.rng = random.Random(seed)
+        self.dict_missing_years_for_refid = {}
+        self.assigned_year_and_names = set()
+
+    def assign_year(self, ref_id, author_names):
+        if ref_id in self.dict_missing_years_for_refid:
+            return str(self.dict_missing_years_for_refid[ref_id])
+
+        random_year = self.rng.randint(*self.year_range)
+        # Avoid giving the same year to a different paper with the same authors, which would merge two citations
+        if (random_year, tuple(author_names)) in self.assigned_year_and_names:
+            random_year = self.rng.randint(1960, 2014)
+
+        self.dict_missing_years_for_refid[ref_id] = random_year
+        self.assigned_year_and_names.add((random_year, tuple(author_names)))
+        return str(random_year)
+
+
+def create_target_token_for_paper(paper_info, ref_id, year_assigner, capitalize_surnames=True):
+    authors_from_paper_info = paper_info['authors']
+
+    if paper_info['year'] == 'NULL':
+        year_from_paper_info = year_assigner.assign_year(ref_id, authors_from_paper_info)
+    else:
+        year_from_paper_info = str(int(float(paper_info['year'])))
+
+    return create_target_token_from_authors(authors_from_paper_info, year_from_paper_info, capitalize_surnames)
+
+
+def check_if_string_contains_year(marker):
+    if len(marker) < 8:  # Eliminate smaller citation markers.
+        return False
+    match = re.match(r'.*([1-2][0-9]{3})', marker)
+    if match is not None:
+        return True
+    return False
+
+
+marker_year_pattern = re.compile(r"(?<![0-9])[1-2][0-9]{3}(?![0-9])")
+
+
+# ACL-200 markers list the author names and the year, e.g. "Franz Josef Och, Hermann Ney, 2003". Markers repeat for
+# every context citing the same paper, so parsed markers are cached.
+@functools.lru_cache(maxsize=65536)
+def parse_citation_marker(marker_from_contexts_file):
+    # Returns the author surnames and the year of the marker, or None for markers without a year, e.g. "[S91]"
+    if len(marker_from_contexts_file) < 8:  # Eliminate smaller citation markers.
+        return None
+
+    # The year is the last standalone 4-digit number, which is always the final item of the marker
+    year_matches = marker_year_pattern.findall(marker_from_contexts_file)
+    if not year_matches:
+        return None
+
+    surnames = tuple(a.split(" ")[-1] for a in marker_from_contexts_file.split(", ")[:-1])
+    return surnames, year_matches[-1]
+
+
+def create_target_token_from_marker(marker_from_contexts_file):
+    parsed_marker = parse_citation_marker(marker_from_contexts_file)
+    if parsed_marker is None:
+        return ""
+
+    surnames, year_from_marker_info = parsed_marker
+    return create_target_token_from_authors(surnames, year_from_marker_info, capitalize_surnames=False)
+
+
+# Previous implementation based on fuzzy date parsing. It is only kept as the reference of check_marker_parser.py.
+def create_target_token_from_marker_with_dateutil(marker_from_contexts_file):
+    from dateutil.parser import parse
+
+    temp_marker = marker_from_contexts_file.replace('(', ' ').replace(')', ' ')
+
+    if not check_if_string_contains_year(temp_marker):  # Skip marker without any years, e.g. "[S91]", "[Chodorov]"
+        return ""
+    year_from_marker_info = str(parse(temp_marker, fuzzy=True).year)
+
+    authors_from_marker = marker_from_contexts_file.split(", ")[:-1]
+
+    return create_target_token_from_authors(authors_from_marker, year_from_marker_info, capitalize_surnames=False)
+
+
+# Target citations repeat across many contexts, so their patterns are compiled once. The names are escaped, which
+# keeps surnames with regex metacharacters literal, and the gaps are bounded, so matching cost does not depend on
+# the surname.
+@functools.lru_cache(maxsize=8192)
+def compile_target_citation_pattern(target_cit_token, number_of_authors):
+    if number_of_authors > 2:
+        split_target_cit = target_cit_token.split(" et al., ")
+    elif number_of_authors == 2:
+        temp_split_target_cit = target_cit_token.split(" and ")
+        temp_split_target_cit_2 = temp_split_target_cit[1].split(", ")
+        split_target_cit = [temp_split_target_cit[0], temp_split_target_cit_2[0], temp_split_target_cit_2[1]]
+    else:
+        split_target_cit = target_cit_token.split(", ")
+
+    # Non-capturing gaps, so that split() returns only the text around the citations
+    return re.compile(r"(?:.{0,10}?)".join(re.escape(part) for part in split_target_cit))
+
+
+def place_mask_and_target_cit_on_ground_truth_context(ground_truth_context, target_cit_token,
+                                                      marker_from_contexts_file):
+    number_of_authors = len(marker_from_contexts_file.split(", ")[:-1])
+    if number_of_authors == 0:
+        return "", ""
+
+    # One scan finds every citation occurrence, and both outputs are joined from the same pieces.
+    context_pieces = compile_target_citation_pattern(target_cit_token, number_of_authors).split(ground_truth_context)
+    if len(context_pieces) == 1:  # The target citation does not appear in the context
+        return "", ""
+
+    masked_context = ' <mask> '.join(context_pieces)
+    unmasked_context = f' {target_cit_token} '.join(context_pieces)
+    return masked_context, unmasked_context
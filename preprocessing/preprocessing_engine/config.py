@@ -0,0 +1,75 @@
+import json
+import os
+
+
+# Settings shared by every dataset. The dataset entries below only list what differs from these.
+common_defaults = {
+    "variant": "base",
+    "max_token_limit": None,  # Base datasets: contexts longer than this are cut from both sides
+    "max_cut_tokens": None,  # Base datasets: contexts that need a larger cut than this are skipped
+    "context_limit": 100,  # Global datasets: number of context tokens kept around the mask
+    "abstract_limit": 200,  # Global datasets: number of abstract tokens kept
+    "strip_other_citations": False,
+    "capitalize_surnames": True,
+    "mask_text": "<mask>",
+    "null_year_range": [1960, 2014],
+    "tokenizer_name": "roberta-base",
+    # Global datasets: also store the trimmed contexts as token ids of the training tokenizer
+    "store_token_ids": False,
+    "training_tokenizer_name": "facebook/bart-base",
+    "fast_tokenizer": False,
+    "num_workers": 1,
+    "chunk_size": 10000,
+    "seed": 42,
+    "incremental": False,  # Reuse the rows of the previous run whose inputs have not changed
+    # "shuffle": shuffle the written dataset and cut it at 80%. "hash": assign each row while it is written by a hash
+    # of its context ("split_by": "context") or of its citing paper ("split_by": "citing_paper")
+    "split_mode": "shuffle",
+    "split_by": "context",
+    "eval_percentage": 20,
+    # Global datasets: write the titles and abstracts once to a paper table, which the rows reference by paper ids
+    "paper_table": False,
+    "output_format": "csv",  # "csv" or "parquet", which stores the repeated titles and abstracts dictionary encoded
+}
+
+dataset_defaults = {
+    "acl200_base": {"source": "acl200", "capitalize_surnames": False},
+    "acl200_global": {"source": "acl200", "variant": "global", "capitalize_surnames": False},
+    "arxiv_base": {"source": "arxiv", "max_token_limit": 300, "max_cut_tokens": 150, "strip_other_citations": True,
+                   "null_year_range": [1991, 2020]},
+    "arxiv_global": {"source": "arxiv", "variant": "global", "null_year_range": [1991, 2020]},
+    "peerread_base": {"source": "peerread"},
+    "peerread_global": {"source": "peerread", "variant": "global", "mask_text": " <mask> "},
+    "refseer_base": {"source": "refseer", "max_token_limit": 200},
+    "refseer_global": {"source": "refseer", "variant": "global"},
+}
+
+
+def create_dataset_config(dataset, config_file=None, **overrides):
+    # Priority: keyword overrides (e.g. from the command line) > config file > dataset defaults > common defaults
+    if dataset not in dataset_defaults:
+        raise ValueError(f"Unknown dataset '{dataset}'. Choose one of: {', '.join(dataset_defaults)}")
+
+    config = dict(common_defaults)
+    config.update(dataset_defaults[dataset])
+    config["dataset"] = dataset
+
+    if config_file is not None:
+        with open(config_file) as infile:
+            config.update(json.load(infile))
+
+    config.update({key: value for key, value in overrides.items() if value is not None})
+
+    output_folder = config.get("output_folder", f"./{dataset}")
+    extension = config["output_format"]
+    config.setdefault("dataset_output_file", os.path.join(output_folder, f"context_dataset.{extension}"))
+    config.setdefault("vocab_output_file", os.path.join(output_folder, f"citation_item_list.{extension}"))
+    config.setdefault("train_set_output_file", os.path.join(output_folder, f"context_dataset_train.{extension}"))
+    config.setdefault("eval_set_output_file", os.path.join(output_folder, f"context_dataset_eval.{extension}"))
+    config.setdefault("papers_output_file", os.path.join(output_folder, f"papers_table.{extension}"))
+    config.setdefault("cache_file", os.path.join(output_folder, "preprocessing_cache.sqlite"))
+
+    for required_key in ["contexts_file", "papers_file"]:
+        if required_key not in config:
+            raise ValueError(f"'{required_key}' is missing from the preprocessing config of {dataset}")
+    return config
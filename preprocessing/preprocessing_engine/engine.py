@@ -0,0 +1,320 @@
+import itertools
+import json
+import multiprocessing
+import os
+import pandas as pd
+from .adapters import source_adapters
+from .citations import MissingYearAssigner
+from .incremental import ProcessedRowCache
+from .outputs import TableFileWriter, write_table_file
+from .stages import (trim_context_from_both_sides, trim_context_token_ids, shorten_abstract,
+                     shorten_unmasked_context_with_more_than_k_tokens, has_more_than_k_tokens, write_citation_item_list,
+                     is_eval_split, split_dataset)
+
+
+base_output_columns = ['citation_context', 'masked_cit_context', 'masked_token_target']
+global_output_columns = ['masked_cit_context', 'masked_token_target', 'citing_title', 'citing_abstract',
+                         'target_title', 'target_abstract']
+# With the paper table, global rows only reference the papers, whose titles and abstracts are written once to a table.
+normalized_global_output_columns = ['masked_cit_context', 'masked_token_target', 'citing_id', 'ref_id']
+paper_table_columns = ['paper_id', 'title', 'abstract']
+# Global rows can also store the context as token ids of the training tokenizer, separated by spaces.
+token_id_columns = ['context_token_ids']
+
+# Tokenizer and config of the current process. Worker processes fill it in init_worker.
+worker_state = {}
+
+
+# transformers is imported when a tokenizer is loaded, which the worker processes do in init_worker, instead of when
+# the engine is imported. load_pretrained(loader_class, name_or_path, **kwargs) is passed in by the calling script, e.g.
+# the one of "train/pretrained_assets.py", which reads the asset registry.
+def load_tokenizer(config, load_pretrained):
+    from transformers import RobertaTokenizer, RobertaTokenizerFast
+
+    tokenizer_class = RobertaTokenizerFast if config["fast_tokenizer"] else RobertaTokenizer
+    return load_pretrained(tokenizer_class, config["tokenizer_name"], truncation=True, padding='max_length',
+                           max_length=500)
+
+
+def load_training_tokenizer(config, load_pretrained):
+    from transformers import BartTokenizer, BartTokenizerFast
+
+    tokenizer_class = BartTokenizerFast if config["fast_tokenizer"] else BartTokenizer
+    return load_pretrained(tokenizer_class, config["training_tokenizer_name"])
+
+
+def init_worker(config, load_pretrained):
+    worker_state["config"] = config
+    worker_state["tokenizer"] = load_tokenizer(config, load_pretrained)
+    if config["store_token_ids"]:
+        worker_state["training_tokenizer"] = load_training_tokenizer(config, load_pretrained)
+
+
+def process_record(record):
+    # Token-level stages of one citation record. Returns the output row, or None if the context is skipped.
+    config = worker_state["config"]
+    tokenizer = worker_state["tokenizer"]
+
+    if "<mask>" not in record["masked_context"]:
+        return None
+
+    if config["variant"] == "global":
+        trimmed_masked_context = trim_context_from_both_sides(tokenizer, record["masked_context"],
+                                                              context_length=config["context_limit"])
+        if trimmed_masked_context.find("<mask>") == -1:
+            return None
+        row = {"masked_cit_context": trimmed_masked_context, "masked_token_target": record["target_token"]}
+        if config["store_token_ids"]:
+            # Trimmed from the untrimmed context, so the ids do not depend on decoding the RoBERTa tokens. The global
+            # training script removes OTHERCIT from the contexts, so the ids are created without it.
+            context_token_ids = trim_context_token_ids(worker_state["training_tokenizer"],
+                                                       record["masked_context"].replace("OTHERCIT", ""),
+                                                       context_length=config["context_limit"])
+            row["context_token_ids"] = " ".join(map(str, context_token_ids))
+        return row
+
+    ground_truth_text = record["ground_truth_context"]
+    masked_text = record["masked_context"]
+    more_than_k_tokens = False
+    if config["max_token_limit"] is not None:
+        ground_truth_text, masked_text = shorten_unmasked_context_with_more_than_k_tokens(
+            tokenizer, ground_truth_text, masked_text, k=config["max_token_limit"],
+            max_cut_tokens=config["max_cut_tokens"])
+        if ground_truth_text == "X" or masked_text == "X":
+            return None
+        more_than_k_tokens = has_more_than_k_tokens(tokenizer, masked_text, k=config["max_token_limit"])
+
+    return {"citation_context": ground_truth_text, "masked_cit_context": masked_text,
+            "masked_token_target": record["target_token"], "more_than_k_tokens": more_than_k_tokens}
+
+
+def process_abstract(abstract):
+    return shorten_abstract(worker_state["tokenizer"], abstract,
+                            max_abstract_limit=worker_state["config"]["abstract_limit"])
+
+
+def get_split_identity(record, split_by):
+    if split_by == "citing_paper":  # All contexts of a citing paper are in the same split, so none of them leaks
+        return record["citing_id"]
+    return f'{record["citing_id"]}|{record["ref_id"]}|{record["masked_context"]}'
+
+
+def iter_json_object_values(file_path, read_size=1 << 20):
+    # The values of the top-level JSON object of a file, parsed one at a time, so that a large contexts file is not
+    # held in memory as a whole
+    decoder = json.JSONDecoder()
+    with open(file_path) as infile:
+        text = ""
+        position = 0
+
+        def read_more():
+            nonlocal text, position
+            more_text = infile.read(read_size)
+            text, position = text[position:] + more_text, 0
+            return bool(more_text)
+
+        def peek():
+            # The next character after whitespace, or None at the end of the file
+            nonlocal position
+            while True:
+                while position < len(text) and text[position].isspace():
+                    position += 1
+                if position < len(text):
+                    return text[position]
+                if not read_more():
+                    return None
+
+        def expect(characters):
+            nonlocal position
+            character = peek()
+            if character is None or character not in characters:
+                raise ValueError(f"{file_path} is not a JSON object, expected one of {characters!r}")
+            position += 1
+            return character
+
+        def decode_value():
+            nonlocal position
+            peek()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(text, position)
+                    if end < len(text):  # A number at the end of the text could continue in the next read
+                        position = end
+                        return value
+                except json.JSONDecodeError:
+                    pass
+                if not read_more():
+                    value, position = decoder.raw_decode(text, position)  # Raises the error of an invalid value
+                    return value
+
+        expect("{")
+        if peek() == "}":
+            return
+        while True:
+            decode_value()  # The key of the value
+            expect(":")
+            yield decode_value()
+            if expect(",}") == "}":
+                return
+
+
+def map_in_workers(pool, function, items, num_workers):
+    if pool is None:
+        return [function(i) for i in items]
+    return pool.map(function, items, chunksize=max(1, len(items) // (4 * num_workers)))
+
+
+def run_preprocessing(config, load_pretrained):
+    # The adapters look up the papers of each context, so the papers are loaded as a whole. The contexts are read one
+    # chunk at a time.
+    with open(config["papers_file"]) as infile:
+        papers = json.load(infile)
+
+    adapter = source_adapters[config["source"]]
+    year_assigner = MissingYearAssigner(tuple(config["null_year_range"]), seed=config["seed"])
+    is_global = config["variant"] == "global"
+    write_paper_table = is_global and config["paper_table"]
+    if write_paper_table:
+        output_columns = normalized_global_output_columns
+    else:
+        output_columns = global_output_columns if is_global else base_output_columns
+    if is_global and config["store_token_ids"]:
+        output_columns = output_columns + token_id_columns
+
+    os.makedirs(os.path.dirname(os.path.abspath(config["dataset_output_file"])), exist_ok=True)
+
+    # In incremental mode, only the records and abstracts that are not in the cache of the previous run are tokenized.
+    # The output files are still written completely, so they are the same as the output of a full run.
+    row_cache = ProcessedRowCache(config["cache_file"], config) if config["incremental"] else None
+
+    def process_in_workers(kind, function, items):
+        if row_cache is None:
+            return map_in_workers(pool, function, items, config["num_workers"])
+        return row_cache.map(kind, lambda missing_items: map_in_workers(pool, function, missing_items,
+                                                                        config["num_workers"]), items)
+
+    pool = None
+    if config["num_workers"] > 1:
+        pool = multiprocessing.get_context("spawn").Pool(config["num_workers"], initializer=init_worker,
+                                                         initargs=(config, load_pretrained))
+    else:
+        init_worker(config, load_pretrained)
+
+    # With the hash split, the train and eval sets are written together with the whole set, without a second pass.
+    split_while_writing = config["split_mode"] == "hash"
+    table_writers = {"dataset": TableFileWriter(config["dataset_output_file"], output_columns, write_index=True)}
+    if split_while_writing:
+        table_writers["train"] = TableFileWriter(config["train_set_output_file"], output_columns)
+        table_writers["eval"] = TableFileWriter(config["eval_set_output_file"], output_columns)
+
+    # Abstracts are shortened once per paper, although global datasets repeat them in every context of the paper.
+    shortened_abstracts = {}
+    citation_items = set()
+    context_count = 0
+    skip_count = 0
+    more_than_k_count = 0
+
+    try:
+        context_rows = iter_json_object_values(config["contexts_file"])
+        is_first_chunk = True
+        while True:
+            chunk = list(itertools.islice(context_rows, config["chunk_size"]))
+            context_count += len(chunk)
+            if not chunk and not is_first_chunk:
+                break
+
+            # Adapters run in this process, so missing years are assigned in the same order on every run.
+            records = []
+            for context_row in chunk:
+                record = adapter(context_row, papers, config, year_assigner)
+                if record is None or (is_global and (record["ref_id"] not in papers or
+                                                     record["citing_id"] not in papers)):
+                    skip_count += 1
+                    continue
+                records.append(record)
+
+            processed_rows = process_in_workers("rows", process_record, records)
+
+            if is_global:
+                new_paper_ids = sorted({paper_id for r in records for paper_id in (r["ref_id"], r["citing_id"])}
+                                       - shortened_abstracts.keys())
+                new_abstracts = process_in_workers("abstracts", process_abstract,
+                                                   [papers[paper_id]["abstract"] or "" for paper_id in new_paper_ids])
+                shortened_abstracts.update(zip(new_paper_ids, new_abstracts))
+
+            output_rows = []
+            split_rows = {"train": [], "eval": []}
+            for record, row in zip(records, processed_rows):
+                if row is None:
+                    skip_count += 1
+                    continue
+                if write_paper_table:
+                    row["citing_id"] = record["citing_id"]
+                    row["ref_id"] = record["ref_id"]
+                elif is_global:
+                    row["citing_title"] = (papers[record["citing_id"]]["title"] or "").replace("\n", "")
+                    row["citing_abstract"] = shortened_abstracts[record["citing_id"]]
+                    row["target_title"] = (papers[record["ref_id"]]["title"] or "").replace("\n", "")
+                    row["target_abstract"] = shortened_abstracts[record["ref_id"]]
+                elif row.pop("more_than_k_tokens"):
+                    more_than_k_count += 1
+                citation_items.add(row["masked_token_target"])
+                output_rows.append(row)
+                if split_while_writing:
+                    split_name = "eval" if is_eval_split(get_split_identity(record, config["split_by"]),
+                                                         config["eval_percentage"]) else "train"
+                    split_rows[split_name].append(row)
+
+            table_writers["dataset"].write(output_rows)
+            if split_while_writing:
+                table_writers["train"].write(split_rows["train"])
+                table_writers["eval"].write(split_rows["eval"])
+            is_first_chunk = False
+    finally:
+        for table_writer in table_writers.values():
+            table_writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    write_citation_item_list(citation_items, config["vocab_output_file"])
+    if write_paper_table:
+        # Every paper of a written row has its shortened abstract here, and only those papers are in the table
+        paper_ids = sorted(shortened_abstracts)
+        write_table_file(pd.DataFrame({
+            "paper_id": paper_ids,
+            "title": [(papers[paper_id]["title"] or "").replace("\n", "") for paper_id in paper_ids],
+            "abstract": [shortened_abstracts[paper_id] for paper_id in paper_ids]}, columns=paper_table_columns),
+            config["papers_output_file"])
+    if row_cache is not None:
+        row_cache.save()
+
+    written_count = table_writers["dataset"].written_count
+    if config["max_token_limit"] is not None and not is_global:
+        print(f"--->> Number of masked contexts with more than {config['max_token_limit']} tokens =",
+              more_than_k_count, "\n")
+    print("--> Length of whole set: ", written_count)
+    print("--> Skip count: ", skip_count, "\n")
+    print("--> Citation item size: ", len(citation_items), "\n")
+    if split_while_writing:
+        print("--> Length of train set: ", table_writers["train"].written_count)
+        print("--> Length of eval set: ", table_writers["eval"].written_count, "\n")
+
+    summary = {"contexts": context_count, "written": written_count, "skipped": skip_count,
+               "citation_items": len(citation_items)}
+    if split_while_writing:
+        summary["train"] = table_writers["train"].written_count
+        summary["eval"] = table_writers["eval"].written_count
+    if row_cache is not None:
+        summary["reused_rows"] = row_cache.reused_count["rows"]
+        summary["reused_abstracts"] = row_cache.reused_count["abstracts"]
+        print("--> Rows reused from the previous run: ", summary["reused_rows"])
+        if is_global:
+            print("--> Abstracts reused from the previous run: ", summary["reused_abstracts"], "\n")
+    return summary
+
+
+def run_split(config):
+    if config["split_mode"] == "hash":  # The splits were written by run_preprocessing
+        return
+    split_dataset(config["dataset_output_file"], config["train_set_output_file"], config["eval_set_output_file"])
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import sqlite3
+
+
+# Settings that do not change the processed rows, so changing them keeps the cache valid.
+fingerprint_excluded_keys = {"contexts_file", "papers_file", "output_folder", "dataset_output_file",
+                             "vocab_output_file", "train_set_output_file", "eval_set_output_file",
+                             "papers_output_file", "cache_file", "num_workers", "chunk_size", "incremental",
+                             "split_mode", "split_by", "eval_percentage", "output_format", "paper_table"}
+
+# Number of keys looked up with one query, below the variable limit of older SQLite versions
+lookup_batch_size = 500
+
+
+def hash_content(content):
+    return hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ProcessedRowCache:
+    # Outputs of the token-level stages in an SQLite database, keyed by the content hash of their inputs. The adapters
+    # still run on every context, so a new or changed context (or paper) gets a new hash and only that one is tokenized
+    # again. Each chunk only looks up its own keys, and only the entries of new contexts are written, so a refresh
+    # neither loads nor rewrites the entries of the unchanged ones. Entries that are not used in a run are deleted
+    # when the cache is saved.
+    def __init__(self, cache_file, config):
+        self.cache_file = cache_file
+        self.config_fingerprint = hash_content({key: value for key, value in config.items()
+                                                if key not in fingerprint_excluded_keys})
+        self.reused_count = {"rows": 0, "abstracts": 0}
+
+        self.connection = sqlite3.connect(cache_file)
+        try:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+        except sqlite3.DatabaseError as error:
+            self.connection.close()
+            raise ValueError(f"{cache_file} is not a preprocessing cache database. Delete it or choose another "
+                             f"cache_file") from error
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value TEXT, "
+                                "PRIMARY KEY (kind, key)) WITHOUT ROWID")
+        # Keys used in this run. It is a temporary table, so it is not written to the cache file.
+        self.connection.execute("CREATE TEMP TABLE used_keys (kind TEXT, key TEXT, PRIMARY KEY (kind, key)) "
+                                "WITHOUT ROWID")
+
+        # A cache created with different settings would give different rows, so its entries are dropped.
+        stored_fingerprint = self.connection.execute("SELECT value FROM settings WHERE name = 'config_fingerprint'"
+                                                     ).fetchone()
+        if stored_fingerprint is None or stored_fingerprint[0] != self.config_fingerprint:
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('config_fingerprint', ?)",
+                                    (self.config_fingerprint,))
+
+    def lookup(self, kind, keys):
+        keys = list(keys)
+        values = {}
+        for start in range(0, len(keys), lookup_batch_size):
+            batch_keys = keys[start:start + lookup_batch_size]
+            rows = self.connection.execute(f"SELECT key, value FROM entries WHERE kind = ? AND key IN "
+                                           f"({', '.join('?' * len(batch_keys))})", (kind, *batch_keys))
+            values.update((key, json.loads(value)) for key, value in rows)
+        return values
+
+    def map(self, kind, process_items, items):
+        # process_items is called once with the list of items that are not in the cache.
+        keys = [hash_content(i) for i in items]
+        values = self.lookup(kind, set(keys))
+        missing_items = {key: item for key, item in zip(keys, items) if key not in values}
+        new_values = dict(zip(missing_items, process_items(list(missing_items.values()))))
+        self.connection.executemany("INSERT OR REPLACE INTO entries (kind, key, value) VALUES (?, ?, ?)",
+                                    [(kind, key, json.dumps(value, ensure_ascii=False))
+                                     for key, value in new_values.items()])
+        self.connection.executemany("INSERT OR IGNORE INTO used_keys (kind, key) VALUES (?, ?)",
+                                    [(kind, key) for key in set(keys)])
+        values.update(new_values)
+
+        self.reused_count[kind] += len(keys) - len(missing_items)
+        # Rows are copied, since the engine adds columns to them
+        return [dict(values[key]) if isinstance(values[key], dict) else values[key] for key in keys]
+
+    def save(self):
+        self.connection.execute("DELETE FROM entries WHERE NOT EXISTS (SELECT 1 FROM used_keys "
+                                "WHERE used_keys.kind = entries.kind AND used_keys.key = entries.key)")
+        # The changes of a run are committed together, so an interrupted run keeps the previous cache
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,59 @@
+import pandas as pd
+
+
+# Columns that repeat the same value in many rows, e.g. the abstracts of global datasets are repeated in every context
+# of a paper. Parquet files store them dictionary encoded, so each distinct value is stored once per row group.
+dictionary_encoded_columns = ["masked_token_target", "citing_title", "citing_abstract", "target_title",
+                              "target_abstract"]
+
+
+def is_parquet_file(file_path):
+    return file_path.endswith(".parquet")
+
+
+class TableFileWriter:
+    # Appends chunks of rows to a CSV or a Parquet file, selected by the file extension. Every chunk becomes one row
+    # group of the Parquet file.
+    def __init__(self, output_file, columns, write_index=False):
+        self.output_file = output_file
+        self.columns = columns
+        self.write_index = write_index  # Only CSV files have an index column
+        self.parquet_writer = None
+        self.written_count = 0
+
+    def write(self, rows):
+        self.write_dataframe(pd.DataFrame(rows, columns=self.columns,
+                                          index=range(self.written_count, self.written_count + len(rows))))
+
+    def write_dataframe(self, chunk_df):
+        if is_parquet_file(self.output_file):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([(column, pa.string()) for column in self.columns])
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(
+                    self.output_file, schema, compression="zstd",
+                    use_dictionary=[c for c in self.columns if c in dictionary_encoded_columns])
+            self.parquet_writer.write_table(pa.Table.from_pandas(chunk_df, schema=schema, preserve_index=False))
+        else:
+            is_first_chunk = self.written_count == 0
+            chunk_df.to_csv(self.output_file, mode="w" if is_first_chunk else "a", header=is_first_chunk,
+                            index=self.write_index)
+        self.written_count += len(chunk_df)
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def write_table_file(table_df, output_file, write_index=False):
+    table_writer = TableFileWriter(output_file, list(table_df.columns), write_index=write_index)
+    table_writer.write_dataframe(table_df)
+    table_writer.close()
+
+
+def read_table_file(input_file, columns=None):
+    if is_parquet_file(input_file):
+        return pd.read_parquet(input_file, columns=columns)
+    return pd.read_csv(input_file, usecols=columns)
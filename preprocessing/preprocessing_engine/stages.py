@@ -0,0 +1,105 @@
+import hashlib
+import pandas as pd
+from .outputs import is_parquet_file, read_table_file, write_table_file
+
+
+# Token-level stages shared by all datasets. The tokenizer is passed in, so the same functions run in the main
+# process and in the worker processes of the engine.
+
+def trim_context_from_both_sides(tokenizer, masked_context, context_length=100):
+    tokenized_context = tokenizer.tokenize(masked_context)
+    if len(tokenized_context) <= context_length:
+        return masked_context
+
+    mask_idx = tokenized_context.index("<mask>")
+    half_context_len = int(context_length / 2)
+    if mask_idx - half_context_len <= 0:
+        shorter_context_tokenized = tokenized_context[:mask_idx + half_context_len]
+    elif mask_idx + half_context_len >= len(tokenized_context):
+        shorter_context_tokenized = tokenized_context[mask_idx - half_context_len:]
+    else:
+        shorter_context_tokenized = tokenized_context[mask_idx - half_context_len: mask_idx + half_context_len]
+
+    shorter_context_masked = tokenizer.convert_tokens_to_string(shorter_context_tokenized)
+    shorter_context_masked = shorter_context_masked.replace('<mask>', ' <mask> ')
+    return shorter_context_masked
+
+
+def trim_context_token_ids(training_tokenizer, masked_context, context_length=100):
+    # Token ids of the training tokenizer for the context around the first mask, which training uses without
+    # tokenizing the context again. The window has exactly context_length tokens (or the whole context if it is
+    # shorter), and the mask is at index context_length // 2 unless the context has fewer tokens before the mask.
+    single_mask_context = masked_context.replace("<mask>", "<extra_id_0>", 1).replace("<mask>", " ")
+    single_mask_context = single_mask_context.replace("<extra_id_0>", "<mask>")
+    # The leading space stands for the space after "</s>" in the global training inputs
+    context_ids = training_tokenizer.encode(" " + single_mask_context, add_special_tokens=False)
+
+    mask_idx = context_ids.index(training_tokenizer.mask_token_id)
+    window_start = max(0, mask_idx - context_length // 2)
+    window_start = max(0, min(window_start, len(context_ids) - context_length))
+    return context_ids[window_start:window_start + context_length]
+
+
+def shorten_abstract(tokenizer, temp_abstract, max_abstract_limit=200):
+    tokenized_abstract = tokenizer.tokenize(temp_abstract)
+    if len(tokenized_abstract) > max_abstract_limit:
+        shortened_tokenized_abstract = tokenized_abstract[:max_abstract_limit]
+        shortened_abstract = tokenizer.convert_tokens_to_string(shortened_tokenized_abstract)
+        return shortened_abstract
+    else:
+        return temp_abstract
+
+
+def shorten_unmasked_context_with_more_than_k_tokens(tokenizer, unmasked_cit_context, masked_cit_context, k=400,
+                                                     max_cut_tokens=None):
+    tokenized_unmasked_text = tokenizer.tokenize(unmasked_cit_context)
+    if len(tokenized_unmasked_text) > k:
+        diff_from_k = len(tokenized_unmasked_text) - k
+        # Eliminate examples that need to be cut too much
+        if max_cut_tokens is not None and diff_from_k > max_cut_tokens:
+            return "X", "X"
+        cut_amount = int((diff_from_k + 3) / 2)  # Make the cut amount slightly larger thanks to +3.
+        shortened_tokenized_unmasked = tokenized_unmasked_text[cut_amount:-cut_amount]
+        shortened_unmasked_str = tokenizer.convert_tokens_to_string(shortened_tokenized_unmasked)
+
+        temp_tokenized_masked = tokenizer.tokenize(masked_cit_context)
+        shortened_tokenized_masked = temp_tokenized_masked[cut_amount:-cut_amount]
+        shortened_masked_str = tokenizer.convert_tokens_to_string(shortened_tokenized_masked)
+        return shortened_unmasked_str, shortened_masked_str
+    return unmasked_cit_context, masked_cit_context
+
+
+def has_more_than_k_tokens(tokenizer, masked_cit_context, k=400):
+    return len(tokenizer.encode(masked_cit_context)[1:-1]) > k
+
+
+def write_citation_item_list(citation_items, vocab_output_file):
+    vocab_additions = pd.DataFrame({'citation_items': sorted(citation_items)})
+    write_table_file(vocab_additions, vocab_output_file, write_index=True)
+
+
+def is_eval_split(split_identity, eval_percentage=20):
+    # A stable hash of the identity, so a row keeps its split across runs and when the dataset grows
+    split_bucket = int(hashlib.md5(split_identity.encode("utf-8")).hexdigest()[:8], 16) % 100
+    return split_bucket < eval_percentage
+
+
+def split_dataset(dataset_output_file, train_set_output_file, eval_set_output_file):
+    contexts_df = read_table_file(dataset_output_file)
+    if not is_parquet_file(dataset_output_file):
+        contexts_df = contexts_df.iloc[:, 1:]  # Drop the index column of the CSV file
+
+    # Shuffle the DataFrame rows
+    contexts_df = contexts_df.sample(frac=1, random_state=42)
+
+    split_threshold = int(len(contexts_df) * 80 / 100)  # I have selected 20% as the eval set.
+
+    # Split the df into train and eval sets
+    df_train = contexts_df.iloc[:split_threshold]
+    df_eval = contexts_df.iloc[split_threshold:]
+
+    print("--> Length of train set: ", len(df_train))
+    print("--> Length of eval set: ", len(df_eval), "\n")
+
+    write_table_file(df_train, train_set_output_file)
+    write_table_file(df_eval, eval_set_output_file)
@@ -0,0 +1,61 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+project_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(project_folder, "train"))
+sys.path.append(os.path.join(project_folder, "benchmarks"))
+
+from transformers import BartForConditionalGeneration, BartTokenizer  # noqa: E402
+from cit_generation import create_cit_generation_config  # noqa: E402
+from export_model import create_runtime_config, export_model  # noqa: E402
+from exported_runtime import CitationBeamSearch, TorchScriptGraphs  # noqa: E402
+from offline_assets import build_offline_tokenizer, create_bart_config  # noqa: E402
+from synthetic_corpus import create_masked_examples  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def tiny_model_folder(tmp_path_factory):
+    # A randomly initialized tiny BART. The larger init_std spreads its logits, so that the beams do not depend on
+    # rounding differences between the traced graphs and model.generate.
+    model_folder = str(tmp_path_factory.mktemp("tiny_bart"))
+    examples = create_masked_examples(500, seed=7)
+    build_offline_tokenizer(model_folder, [e["masked_cit_context"] + " " + e["masked_token_target"] for e in examples],
+                            vocab_size=1000)
+    tokenizer = BartTokenizer.from_pretrained(model_folder)
+    config = create_bart_config("tiny", len(tokenizer))
+    config.init_std = 0.5
+    torch.manual_seed(0)
+    BartForConditionalGeneration(config).save_pretrained(model_folder)
+    return model_folder
+
+
+def strip_special_tokens(token_ids, special_token_ids):
+    return [token_id for token_id in token_ids if token_id not in special_token_ids]
+
+
+def test_citation_beam_search_matches_generate(tiny_model_folder, tmp_path):
+    export_folder = str(tmp_path / "export")
+    export_model(tiny_model_folder, export_folder, export_format="torchscript")
+
+    tokenizer = BartTokenizer.from_pretrained(tiny_model_folder)
+    model = BartForConditionalGeneration.from_pretrained(tiny_model_folder, attn_implementation="eager")
+    model.eval()
+    generation_config = create_cit_generation_config(model)
+    beam_search = CitationBeamSearch(TorchScriptGraphs(export_folder), create_runtime_config(model, tokenizer))
+    special_token_ids = {tokenizer.eos_token_id, tokenizer.pad_token_id}
+
+    for example in create_masked_examples(3, seed=11):
+        input_ids = tokenizer.encode(example["masked_cit_context"], return_tensors="pt", max_length=64,
+                                     truncation=True)
+        with torch.no_grad():
+            generated = model.generate(input_ids, generation_config=generation_config)
+        searched = beam_search.search(input_ids.numpy().astype(np.int64))
+
+        assert len(searched) == generation_config.num_return_sequences
+        assert [strip_special_tokens(sequence, special_token_ids) for sequence in searched] == \
+            [strip_special_tokens(sequence, special_token_ids) for sequence in generated.tolist()]
@@ -0,0 +1,79 @@
+import os
+import sys
+import pytest
+
+project_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(project_folder, "preprocessing"))
+
+from preprocessing_engine.citations import (create_target_token_from_marker,  # noqa: E402
+                                            create_target_token_from_marker_with_dateutil)
+
+
+# ACL-200 style markers and the citation tokens that the previous dateutil based implementation returned for them
+dateutil_reference_tokens = [
+    # Author names and the year
+    ("Franz Josef Och, 2003", "Och, 2003"),
+    ("Franz Josef Och, Hermann Ney, 2003", "Och and Ney, 2003"),
+    ("L. van der Plas, J. Tiedemann, 2006", "Plas and Tiedemann, 2006"),
+    ("C. Manning, H. Schütze, 1999", "Manning and Schütze, 1999"),
+    ("M. O'Connor, 2010", "O'Connor, 2010"),
+    ("Hal Daumé III, 2007", "III, 2007"),
+    ("Mary Smith, 1060", "Smith, 1060"),
+    # Three or more authors
+    ("Kishore Papineni, Salim Roukos, Todd Ward, Wei-Jing Zhu, 2002", "Papineni et al., 2002"),
+    ("Mitchell P Marcus, Beatrice Santorini, Mary Ann Marcinkiewicz, 1993", "Marcus et al., 1993"),
+    # "et al." and "and" in the marker itself
+    ("Peter F. Brown et al., 1993", "al., 1993"),
+    ("Brown et al., 1993", "al., 1993"),
+    ("Brown et al. 1993", ""),
+    ("Brown et al. (1993)", ""),
+    ("Yamada and Knight, 2001", "Knight, 2001"),
+    # Parenthesized
+    ("(Michael Collins, 1999)", "Collins, 1999"),
+    ("(Kevin Knight, Jonathan Graehl, 1998)", "Knight and Graehl, 1998"),
+    ("(Brown et al., 1993)", "al., 1993"),
+    ("(Och and Ney, 2003)", "Ney, 2003"),
+    ("Kevin Knight, (1998)", "Knight, 1998"),
+    ("Michael Collins (1999)", ""),
+    ("(2005)", ""),
+    # Other numbers next to the year
+    ("Kevin Knight, 12 2001", "Knight, 2001"),
+    ("Kevin Knight, 10 12 2001", "Knight, 2001"),
+    ("Smith, 2001 3", "Smith, 2001"),
+    ("Smith, vol 2 2001", "Smith, 2001"),
+    ("Jones, 5 May 2001", "Jones, 2001"),
+    ("Smith, 12, 2001", "Smith and 12, 2001"),
+    ("Smith, 2001, 3", "Smith and 2001, 2001"),
+    # Without a year, or too short
+    ("[S91]", ""),
+    ("Chodorov", ""),
+    ("Martin Chodorov, Claudia Leacock", ""),
+    ("ACL 2005", ""),
+    ("R 2003", ""),
+    ("Smith and Jones 1995", ""),
+]
+
+# The previous implementation raised a ParserError for years with a letter suffix, so a dump with these markers
+# could not be preprocessed before. The parser takes the 4-digit year.
+year_suffix_tokens = [
+    ("Franz Josef Och, Hermann Ney, 2003a", "Och and Ney, 2003"),
+    ("Dan Klein, Christopher D. Manning, 2003a", "Klein and Manning, 2003"),
+    ("Michael Collins, 2003b", "Collins, 2003"),
+]
+
+
+@pytest.mark.parametrize("marker, reference_token", dateutil_reference_tokens)
+def test_marker_parser_matches_dateutil_tokens(marker, reference_token):
+    assert create_target_token_from_marker(marker) == reference_token
+
+
+@pytest.mark.parametrize("marker, expected_token", year_suffix_tokens)
+def test_marker_parser_drops_year_suffix(marker, expected_token):
+    assert create_target_token_from_marker(marker) == expected_token
+
+
+@pytest.mark.parametrize("marker, reference_token", dateutil_reference_tokens)
+def test_reference_tokens_are_dateutil_tokens(marker, reference_token):
+    # Checks the recorded sample itself where dateutil is installed
+    pytest.importorskip("dateutil")
+    assert create_target_token_from_marker_with_dateutil(marker) == reference_token
@@ -0,0 +1,101 @@
+from typing import List, Any
+import numpy as np
+import torch
+
+
+def compare_pred_with_correct_value(predictions, ground_truth):
+    hits_at_10_flag = False
+    exact_match_flag = False
+    temp_reciprocal_rank = 0
+
+    if "and" in ground_truth:
+        truth_tokens = ground_truth.replace(" and ", ", ").replace(",", "").split()
+        if len(truth_tokens) == 3:
+            for p_idx in range(len(predictions)):
+                if (truth_tokens[0] in predictions[p_idx] and truth_tokens[1] in predictions[p_idx] and
+                        truth_tokens[2] in predictions[p_idx]):
+                    hits_at_10_flag = True
+                    temp_reciprocal_rank = 1 / (p_idx + 1)
+                    break
+            if (truth_tokens[0] in predictions[0] and truth_tokens[1] in predictions[0] and
+                    truth_tokens[2] in predictions[0]):
+                exact_match_flag = True
+
+    elif "et al" in ground_truth:
+        truth_tokens = ground_truth.replace(" et al.,", "").split()
+        for p_idx in range(len(predictions)):
+            if truth_tokens[0] in predictions[p_idx] and truth_tokens[1] in predictions[p_idx]:
+                hits_at_10_flag = True
+                temp_reciprocal_rank = 1 / (p_idx + 1)
+                break
+        if truth_tokens[0] in predictions[0] and truth_tokens[1] in predictions[0]:
+            exact_match_flag = True
+    else:
+        truth_tokens = ground_truth.replace(",", "").split()
+        for p_idx in range(len(predictions)):
+            if truth_tokens[0] in predictions[p_idx] and truth_tokens[1] in predictions[p_idx]:
+                hits_at_10_flag = True
+                temp_reciprocal_rank = 1 / (p_idx + 1)
+                break
+        if truth_tokens[0] in predictions[0] and truth_tokens[1] in predictions[0]:
+            exact_match_flag = True
+
+    if hits_at_10_flag is False:
+        for p_idx in range(len(predictions)):
+            if predictions[p_idx] == ground_truth:
+                hits_at_10_flag = True
+                temp_reciprocal_rank = 1 / (p_idx + 1)
+                break
+
+    if predictions[0] == ground_truth:
+        exact_match_flag = True
+
+    return hits_at_10_flag, exact_match_flag, temp_reciprocal_rank
+
+
+def select_top_predictions(decoded_outputs, num_predictions=10):
+    # The top unique predictions in beam order, padded with the last one like fill_mask does
+    unique_predictions: List[Any] = list(dict.fromkeys(output.strip() for output in decoded_outputs))
+    last_item_of_predictions = unique_predictions[-1]
+    while len(unique_predictions) < num_predictions:
+        unique_predictions.append(last_item_of_predictions)
+    return unique_predictions[:num_predictions]
+
+
+class BatchedEvaluator:
+    """Hits@10, exact match and MRR of beam search predictions, generated for `batch_size` inputs at once.
+
+    The inputs are the padded (num_examples, max_token_limit) token ids that fill_mask uses. Each batch is cut to its
+    longest input, so a batch of short contexts does not attend over padding. The predictions of an input are the
+    same as those of fill_mask without early stopping, whose stopping criteria look at all beams of a batch together.
+    """
+
+    def __init__(self, model, tokenizer, generation_config, batch_size=8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generation_config = generation_config
+        self.batch_size = batch_size
+
+    def predict(self, input_ids):
+        pad_token_id = self.model.config.pad_token_id
+        num_return_sequences = self.generation_config.num_return_sequences
+        all_predictions = []
+        for batch_start in range(0, len(input_ids), self.batch_size):
+            batch_input_ids = input_ids[batch_start:batch_start + self.batch_size]
+            attention_mask = (batch_input_ids != pad_token_id).long()
+            batch_length = int(attention_mask.sum(dim=1).max())
+            with torch.no_grad():
+                outputs = self.model.generate(input_ids=batch_input_ids[:, :batch_length].to(self.model.device),
+                                              attention_mask=attention_mask[:, :batch_length].to(self.model.device),
+                                              generation_config=self.generation_config)
+            decoded_outputs = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            for output_start in range(0, len(decoded_outputs), num_return_sequences):
+                all_predictions.append(select_top_predictions(decoded_outputs[output_start:
+                                                                              output_start + num_return_sequences]))
+        return all_predictions
+
+    def evaluate(self, input_ids, targets):
+        results = np.array([compare_pred_with_correct_value(predictions, target)
+                            for predictions, target in zip(self.predict(input_ids), targets)], dtype=np.float64)
+        return {"num_examples": len(targets), "hits_at_10": float(results[:, 0].mean()),
+                "exact_match": float(results[:, 1].mean()), "mrr": float(results[:, 2].mean())}
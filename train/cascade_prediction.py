@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+import numpy as np
+import torch
+from encoder_embeddings import embed_mean_pooled
+
+
+def fingerprint_encoder(model):
+    # Hash of the encoder weights, which are all the table depends on. A retrained or distilled model that is saved to
+    # the same path gets a different fingerprint.
+    encoder_hash = hashlib.sha1()
+    for name, tensor in model.get_encoder().state_dict().items():
+        encoder_hash.update(name.encode("utf-8"))
+        encoder_hash.update(tensor.detach().float().cpu().numpy().tobytes())
+    return encoder_hash.hexdigest()
+
+
+class PopularityPriorStage:
+    """Cheap first stage for frequent citations: encoder-only scoring against a table of citation embeddings.
+
+    Each of the `top_k` most frequent training citations is represented by the mean of the mean-pooled encoder
+    states of up to `contexts_per_citation` of its training inputs. An input is scored against every citation with
+    `cosine_similarity / temperature + prior_weight * log(citation frequency)`, and the softmax probability of the
+    best citation is the confidence of the prediction. No decoder step is run.
+    """
+
+    def __init__(self, model, top_k=1000, contexts_per_citation=16, temperature=0.05, prior_weight=1.0,
+                 batch_size=32):
+        self.model = model
+        self.top_k = top_k
+        self.contexts_per_citation = contexts_per_citation
+        self.temperature = temperature
+        self.prior_weight = prior_weight
+        self.batch_size = batch_size
+        self.citations = []
+        self.citation_embeddings = None
+        self.log_priors = None
+
+    def embed(self, input_ids):
+        return embed_mean_pooled(self.model, input_ids)
+
+    def build(self, train_examples, create_input_ids):
+        # create_input_ids turns a training example into the (1, max_token_limit) input ids that fill_mask uses
+        targets = [example["masked_token_target"] for example in train_examples]
+        citation_counts = Counter(targets)
+        self.citations = [citation for citation, _ in citation_counts.most_common(self.top_k)]
+        if not self.citations:
+            raise ValueError(f"The popularity-prior stage has no citations to score against: there are "
+                             f"{len(targets)} training examples and top_k is {self.top_k}")
+        citation_indices = {citation: idx for idx, citation in enumerate(self.citations)}
+
+        selected_examples, selected_citation_indices = [], []
+        examples_per_citation = Counter()
+        for example_idx, target in enumerate(targets):
+            if target in citation_indices and examples_per_citation[target] < self.contexts_per_citation:
+                examples_per_citation[target] += 1
+                selected_examples.append(example_idx)
+                selected_citation_indices.append(citation_indices[target])
+
+        embedding_sums = None
+        for batch_start in range(0, len(selected_examples), self.batch_size):
+            batch_examples = selected_examples[batch_start:batch_start + self.batch_size]
+            batch_embeddings = self.embed(torch.cat([create_input_ids(train_examples[idx]) for idx in batch_examples]))
+            if embedding_sums is None:
+                embedding_sums = torch.zeros(len(self.citations), batch_embeddings.shape[-1])
+            embedding_sums.index_add_(0, torch.tensor(selected_citation_indices[batch_start:
+                                                                                batch_start + self.batch_size]),
+                                      batch_embeddings)
+
+        self.citation_embeddings = torch.nn.functional.normalize(embedding_sums, dim=-1)
+        frequencies = np.array([citation_counts[citation] for citation in self.citations], dtype=np.float64)
+        self.log_priors = torch.tensor(np.log(frequencies / len(targets)), dtype=torch.float32)
+
+    def create_table_settings(self, model_path, train_examples):
+        # Everything the table is built from. A table saved with other settings is built again.
+        targets = [example["masked_token_target"] for example in train_examples]
+        return {"model_path": os.path.abspath(model_path) if os.path.isdir(model_path) else model_path,
+                "encoder_fingerprint": fingerprint_encoder(self.model), "top_k": self.top_k,
+                "contexts_per_citation": self.contexts_per_citation,
+                "train_targets_hash": hashlib.sha1(json.dumps(targets).encode("utf-8")).hexdigest()}
+
+    def save(self, table_path, table_settings):
+        torch.save({"citations": self.citations, "citation_embeddings": self.citation_embeddings,
+                    "log_priors": self.log_priors, "settings": table_settings}, table_path)
+
+    def load(self, table_path, table_settings):
+        """Loads the table if it was saved with `table_settings`, otherwise returns the settings it was saved with."""
+        # The table only holds the citation strings, tensors and settings, so no pickled code is run when it is loaded
+        citation_table = torch.load(table_path, weights_only=True)
+        if citation_table.get("settings") != table_settings:
+            return citation_table.get("settings", {})
+        self.citations = citation_table["citations"]
+        self.citation_embeddings = citation_table["citation_embeddings"]
+        self.log_priors = citation_table["log_priors"]
+        return None
+
+    def predict(self, input_ids, num_predictions=10):
+        scores = self.embed(input_ids)[0] @ self.citation_embeddings.T / self.temperature + \
+            self.prior_weight * self.log_priors
+        probabilities = torch.softmax(scores, dim=-1)
+        top_probabilities, top_indices = probabilities.topk(min(num_predictions, len(self.citations)))
+        predictions = [self.citations[idx] for idx in top_indices.tolist()]
+        while len(predictions) < num_predictions:
+            predictions.append(predictions[-1])
+        return predictions, float(top_probabilities[0])
+
+
+class CascadePredictor:
+    """Answers with the popularity-prior stage when it is confident enough, otherwise with beam search.
+
+    Keeps the share of inputs, the latency and (when the caller records them) the accuracy of each stage. The
+    confidence and first-stage accuracy of every input are also kept, to show how other thresholds would do.
+    """
+
+    def __init__(self, first_stage, confidence_threshold=0.5):
+        self.first_stage = first_stage
+        self.confidence_threshold = confidence_threshold
+        self.stage_latencies = {"popularity_prior": [], "beam_search": []}
+        self.stage_metrics = {"popularity_prior": [], "beam_search": []}
+        self.first_stage_results = []
+        self.last_first_stage_predictions = None
+        self.last_confidence = None
+
+    def predict(self, input_ids, beam_search_function):
+        # beam_search_function runs the full fill_mask for this input, only if the first stage is not confident
+        start_time = time.perf_counter()
+        predictions, confidence = self.first_stage.predict(input_ids)
+        self.last_first_stage_predictions, self.last_confidence = predictions, confidence
+
+        if confidence >= self.confidence_threshold:
+            stage = "popularity_prior"
+        else:
+            stage = "beam_search"
+            predictions = beam_search_function()
+        self.stage_latencies[stage].append(time.perf_counter() - start_time)
+        return predictions, stage
+
+    def record_metrics(self, stage, hit_at_10, exact_match, reciprocal_rank, first_stage_hit_at_10,
+                       first_stage_exact_match):
+        self.stage_metrics[stage].append((hit_at_10, exact_match, reciprocal_rank))
+        self.first_stage_results.append((self.last_confidence, first_stage_hit_at_10, first_stage_exact_match))
+
+    def report(self, thresholds=(0.3, 0.5, 0.7, 0.9)):
+        num_inputs = sum(len(latencies) for latencies in self.stage_latencies.values())
+        stage_report = {}
+        for stage, latencies in self.stage_latencies.items():
+            metrics = np.array(self.stage_metrics[stage], dtype=np.float64).reshape(-1, 3)
+            stage_report[stage] = {
+                "share_of_inputs": len(latencies) / num_inputs if num_inputs else 0.0,
+                "count": len(latencies),
+                "mean_latency_ms": float(np.mean(latencies) * 1000) if latencies else None,
+                "p95_latency_ms": float(np.percentile(latencies, 95) * 1000) if latencies else None,
+                "hits_at_10": float(metrics[:, 0].mean()) if len(metrics) else None,
+                "exact_match": float(metrics[:, 1].mean()) if len(metrics) else None,
+                "mrr": float(metrics[:, 2].mean()) if len(metrics) else None,
+            }
+
+        # Share of inputs the first stage would answer, and its accuracy on them, at other thresholds
+        first_stage_results = np.array(self.first_stage_results, dtype=np.float64).reshape(-1, 3)
+        threshold_report = {}
+        for threshold in sorted(set(thresholds) | {self.confidence_threshold}):
+            answered = first_stage_results[first_stage_results[:, 0] >= threshold]
+            threshold_report[str(threshold)] = {
+                "first_stage_share": len(answered) / len(first_stage_results) if len(first_stage_results) else 0.0,
+                "first_stage_hits_at_10": float(answered[:, 1].mean()) if len(answered) else None,
+                "first_stage_exact_match": float(answered[:, 2].mean()) if len(answered) else None,
+            }
+        return {"confidence_threshold": self.confidence_threshold, "stages": stage_report,
+                "thresholds": threshold_report}
+
+
+def create_popularity_prior_stage(model, train_examples, create_input_ids, model_path, table_path=None, top_k=1000,
+                                  contexts_per_citation=16):
+    # Loads the citation table from table_path if it was built with the same model, training targets and settings,
+    # otherwise builds it and saves it there
+    first_stage = PopularityPriorStage(model, top_k=top_k, contexts_per_citation=contexts_per_citation)
+    table_settings = first_stage.create_table_settings(model_path, train_examples) if table_path else None
+    if table_path and os.path.exists(table_path):
+        saved_table_settings = first_stage.load(table_path, table_settings)
+        if saved_table_settings is None:
+            print(f"--> Citation table of the popularity-prior stage is loaded from {table_path}")
+            return first_stage
+        changed_settings = [name for name in table_settings
+                            if saved_table_settings.get(name) != table_settings[name]]
+        print(f"--> The citation table in {table_path} was built with another {', '.join(changed_settings)} (model "
+              f"{saved_table_settings.get('model_path')}), it is built again for {table_settings['model_path']}")
+
+    first_stage.build(train_examples, create_input_ids)
+    if table_path:
+        first_stage.save(table_path, table_settings)
+    return first_stage
@@ -0,0 +1,48 @@
+import re
+import torch
+from transformers import GenerationConfig, StoppingCriteria
+
+
+# Target citations always end with their year, e.g. "Smith et al., 2015" or "Kingma and Ba, 2014".
+citation_year_suffix = re.compile(r"[12][0-9]{3}$")
+
+
+class CitationStoppingCriteria(StoppingCriteria):
+    """Ends beam search early for citation generation.
+
+    Decoding stops once every running beam holds a complete citation, i.e. it ends with a year, after which the
+    only sensible continuation is EOS. Beams that already emitted EOS are kept by the beam scorer as finished
+    hypotheses and are no longer among the running beams, so only the running beams are checked.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        # A beam can only end with a year if its last token ends with a digit, which is checked before decoding
+        self.digit_suffix_token_ids = torch.tensor([token_id for token, token_id in tokenizer.get_vocab().items()
+                                                    if token[-1:].isdigit()])
+
+    def __call__(self, input_ids, scores, **kwargs):
+        last_token_ids = input_ids[:, -1].to(self.digit_suffix_token_ids.device)
+        if not torch.isin(last_token_ids, self.digit_suffix_token_ids).all():
+            return False
+
+        decoded_beams = self.tokenizer.batch_decode(input_ids, skip_special_tokens=True)
+        return all(citation_year_suffix.search(decoded_text.strip()) is not None for decoded_text in decoded_beams)
+
+
+def create_cit_generation_config(model):
+    # Diverse beam search that returns 20 candidate citations, of which fill_mask keeps the top 10 unique ones.
+    cit_generation_config = GenerationConfig.from_model_config(model.config)
+
+    cit_generation_config.max_new_tokens = 25
+    cit_generation_config.do_sample = False
+    cit_generation_config.top_k = 50
+    cit_generation_config.num_return_sequences = 20
+    cit_generation_config.early_stopping = False
+    cit_generation_config.num_beams = 20
+    cit_generation_config.forced_bos_token_id = 0
+
+    cit_generation_config.num_beam_groups = 10
+    cit_generation_config.diversity_penalty = 1.5
+
+    return cit_generation_config
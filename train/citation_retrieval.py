@@ -0,0 +1,223 @@
+import argparse
+import json
+import math
+import os
+import time
+import numpy as np
+from transformers import BartForConditionalGeneration, BartTokenizer
+from dataset_files import find_dataset_file, iter_dataset_column_chunks, read_dataset_column_names, read_papers_table
+from encoder_embeddings import embed_mean_pooled
+from pretrained_assets import load_pretrained
+
+
+parser = argparse.ArgumentParser(description="Builds a dense retrieval index over the cited papers of a global "
+                                             "dataset: a memory-mapped matrix of their BART encoder embeddings and "
+                                             "an inverted file index for approximate nearest neighbour search.")
+parser.add_argument("--dataset_path", type=str, help="Path to the folder of the global dataset")
+parser.add_argument("--index_folder", type=str, help="Folder the index is written to")
+parser.add_argument("--pretrained_model_path", type=str, default="facebook/bart-base", help="Path or name of the "
+                                                                                            "model whose encoder "
+                                                                                            "embeds the papers")
+parser.add_argument("--num_lists", type=int, default=0, help="Number of inverted lists of the index. 0 uses the "
+                                                             "square root of the number of papers")
+parser.add_argument("--batch_size", type=int, default=32, help="Number of papers embedded at once")
+parser.add_argument("--max_length", type=int, default=256, help="Max amount of tokens of the embedded paper texts "
+                                                                "and contexts")
+parser.add_argument("--num_eval_examples", type=int, default=500, help="Number of eval set contexts used to measure "
+                                                                       "the shortlist recall after building. 0 skips "
+                                                                       "the measurement")
+parser.add_argument("--shortlist_size", type=int, default=50, help="Number of citations in a shortlist")
+parser.add_argument("--num_probes", type=int, default=8, help="Number of inverted lists searched per query")
+
+embeddings_file_name = "paper_embeddings.npy"
+ivf_file_name = "ivf_index.npz"
+index_info_file_name = "citation_index.json"
+
+
+def normalize_model_path(model_path):
+    # Local folders are compared by their absolute path, hub names as they are
+    return os.path.abspath(model_path) if os.path.isdir(model_path) else model_path
+
+
+def create_query_text(masked_context):
+    # Queries are the masked context alone, without the citing title and abstract of the global model inputs
+    return masked_context.replace("OTHERCIT", "")
+
+
+def collect_target_papers(dataset_file_path, chunk_size=100000):
+    # Distinct cited papers -> (citation, title, abstract). Datasets with a paper table identify them by ref_id,
+    # the others by their inline target title and abstract.
+    column_names = read_dataset_column_names(dataset_file_path)
+    target_papers = {}
+    if "ref_id" in column_names:
+        papers_table = read_papers_table(os.path.dirname(dataset_file_path))
+        for chunk_df in iter_dataset_column_chunks(dataset_file_path, ["ref_id", "masked_token_target"], chunk_size,
+                                                   dtype=str):
+            for ref_id, citation in zip(chunk_df["ref_id"], chunk_df["masked_token_target"]):
+                if ref_id not in target_papers:
+                    target_papers[ref_id] = (citation,) + papers_table[ref_id]
+    elif "target_title" in column_names:
+        for chunk_df in iter_dataset_column_chunks(dataset_file_path, ["target_title", "target_abstract",
+                                                                       "masked_token_target"], chunk_size, dtype=str):
+            chunk_df = chunk_df.fillna("")
+            for title, abstract, citation in zip(chunk_df["target_title"], chunk_df["target_abstract"],
+                                                 chunk_df["masked_token_target"]):
+                if (title, abstract) not in target_papers:
+                    target_papers[(title, abstract)] = (citation, title, abstract)
+    else:
+        raise ValueError(f"{dataset_file_path} has no cited papers, only global datasets can be indexed")
+    return target_papers
+
+
+def embed_texts(model, tokenizer, texts, max_length=256):
+    input_ids = tokenizer(texts, max_length=max_length, truncation=True, padding=True,
+                          return_tensors="pt")["input_ids"]
+    return embed_mean_pooled(model, input_ids).numpy()
+
+
+def write_paper_embeddings(model, tokenizer, paper_texts, embeddings_path, batch_size=32, max_length=256):
+    # Papers of similar length are embedded together to limit padding, and each row is written to the memory-mapped
+    # matrix at the position of its paper, so the whole matrix is never held in memory
+    order = np.argsort([len(text) for text in paper_texts], kind="stable")
+    embeddings = None
+    for batch_start in range(0, len(order), batch_size):
+        batch_indices = order[batch_start:batch_start + batch_size]
+        batch_embeddings = embed_texts(model, tokenizer, [paper_texts[idx] for idx in batch_indices], max_length)
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(embeddings_path, mode="w+", dtype=np.float16,
+                                                   shape=(len(paper_texts), batch_embeddings.shape[-1]))
+        embeddings[np.sort(batch_indices)] = batch_embeddings[np.argsort(batch_indices)]
+    embeddings.flush()
+    return embeddings
+
+
+def train_ivf_index(embeddings, num_lists, sample_size=50000, num_iterations=20, block_size=65536, seed=42):
+    """Inverted file index: spherical k-means centroids and the papers of each centroid's list.
+
+    The centroids are trained on a sample of the embeddings, and all embeddings are then assigned block by block.
+    Returns the centroids, the start offset of each list in `list_members`, and the paper ids ordered by list.
+    """
+    rng = np.random.default_rng(seed)
+    sample_indices = np.sort(rng.choice(len(embeddings), min(len(embeddings), sample_size), replace=False))
+    sample = np.asarray(embeddings[sample_indices], dtype=np.float32)
+    num_lists = min(num_lists, len(sample))
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)]
+
+    for _ in range(num_iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=num_lists)
+        non_empty_lists = np.nonzero(counts)[0]
+        sums = np.add.reduceat(sample[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty_lists])
+        new_centroids = sample[rng.choice(len(sample), num_lists)]  # Empty lists restart from a random embedding
+        new_centroids[non_empty_lists] = sums
+        centroids = new_centroids / np.maximum(np.linalg.norm(new_centroids, axis=1, keepdims=True), 1e-12)
+
+    assignments = np.concatenate([np.argmax(np.asarray(embeddings[start:start + block_size], dtype=np.float32) @
+                                            centroids.T, axis=1)
+                                  for start in range(0, len(embeddings), block_size)])
+    list_members = np.argsort(assignments, kind="stable")
+    list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=num_lists))])
+    return centroids, list_offsets, list_members
+
+
+def build_citation_index(dataset_file_path, index_folder, model, tokenizer, model_path, num_lists=0, batch_size=32,
+                         max_length=256):
+    os.makedirs(index_folder, exist_ok=True)
+    target_papers = collect_target_papers(dataset_file_path)
+    citations = [citation for citation, _, _ in target_papers.values()]
+    # The same "title </s> abstract" layout as the citing papers in the model inputs
+    paper_texts = [title + " </s> " + abstract for _, title, abstract in target_papers.values()]
+    print(f"--> Embedding {len(paper_texts)} cited papers")
+
+    embeddings = write_paper_embeddings(model, tokenizer, paper_texts, os.path.join(index_folder, embeddings_file_name),
+                                        batch_size, max_length)
+    num_lists = num_lists or max(1, int(math.sqrt(len(paper_texts))))
+    centroids, list_offsets, list_members = train_ivf_index(embeddings, num_lists)
+    np.savez(os.path.join(index_folder, ivf_file_name), centroids=centroids, list_offsets=list_offsets,
+             list_members=list_members)
+
+    with open(os.path.join(index_folder, index_info_file_name), "w") as outfile:
+        json.dump({"dataset_file": dataset_file_path, "model_path": normalize_model_path(model_path),
+                   "max_length": max_length, "num_papers": len(citations), "num_lists": len(centroids),
+                   "citations": citations}, outfile)
+
+
+class CitationIndex:
+    """Approximate nearest neighbour search over the cited paper embeddings of an index folder.
+
+    A query is compared with the list centroids, and only the papers of the `num_probes` closest lists are scored
+    exactly, reading their rows from the memory-mapped embedding matrix. The queries are only comparable with the
+    papers if `model` is the model that embedded them, so a different `model_path` is reported.
+    """
+
+    def __init__(self, index_folder, model, tokenizer, model_path, num_probes=8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.num_probes = num_probes
+        self.embeddings = np.load(os.path.join(index_folder, embeddings_file_name), mmap_mode="r")
+        ivf_index = np.load(os.path.join(index_folder, ivf_file_name))
+        self.centroids = ivf_index["centroids"]
+        self.list_offsets = ivf_index["list_offsets"]
+        self.list_members = ivf_index["list_members"]
+        with open(os.path.join(index_folder, index_info_file_name), "r") as infile:
+            index_info = json.load(infile)
+        self.citations = index_info["citations"]
+        self.max_length = index_info["max_length"]
+
+        index_model_path = index_info.get("model_path")
+        if index_model_path != normalize_model_path(model_path):
+            print(f"--> Warning: the citation index in {index_folder} was built with the model {index_model_path}, "
+                  f"but is queried with {normalize_model_path(model_path)}. The contexts and papers are not "
+                  f"embedded in the same space, rebuild the index with citation_retrieval.py")
+
+    def search(self, query_embedding, top_n=50):
+        probed_lists = np.argsort(-(self.centroids @ query_embedding))[:self.num_probes]
+        candidate_ids = np.sort(np.concatenate([self.list_members[self.list_offsets[list_idx]:
+                                                                  self.list_offsets[list_idx + 1]]
+                                                for list_idx in probed_lists]))
+        scores = np.asarray(self.embeddings[candidate_ids], dtype=np.float32) @ query_embedding
+        top_indices = np.argsort(-scores, kind="stable")[:top_n]
+        return candidate_ids[top_indices], scores[top_indices]
+
+    def shortlist(self, masked_context, shortlist_size=50):
+        # Distinct citations of the nearest papers, for reranking or constrained generation. Papers can share a
+        # citation string, so more papers than citations are searched.
+        query_embedding = embed_texts(self.model, self.tokenizer, [create_query_text(masked_context)],
+                                      self.max_length)[0]
+        paper_ids, _ = self.search(query_embedding, top_n=2 * shortlist_size)
+        return list(dict.fromkeys(self.citations[paper_id] for paper_id in paper_ids))[:shortlist_size]
+
+
+def measure_shortlist_recall(citation_index, eval_dataset_path, num_examples, shortlist_size=50):
+    eval_df = next(iter_dataset_column_chunks(eval_dataset_path, ["masked_cit_context", "masked_token_target"],
+                                              num_examples, dtype=str))
+    hits = 0
+    latencies = []
+    for masked_context, target in zip(eval_df["masked_cit_context"], eval_df["masked_token_target"]):
+        start_time = time.perf_counter()
+        shortlist = citation_index.shortlist(masked_context, shortlist_size)
+        latencies.append(time.perf_counter() - start_time)
+        hits += target in shortlist
+    return {"num_examples": len(eval_df), f"recall_at_{shortlist_size}": hits / len(eval_df),
+            "mean_latency_ms": float(np.mean(latencies) * 1000)}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    tokenizer = load_pretrained(BartTokenizer, args.pretrained_model_path)
+    model = load_pretrained(BartForConditionalGeneration, args.pretrained_model_path)
+    model.eval()
+
+    start_time = time.perf_counter()
+    build_citation_index(find_dataset_file(args.dataset_path, "context_dataset"), args.index_folder, model, tokenizer,
+                         args.pretrained_model_path, args.num_lists, args.batch_size, args.max_length)
+    print(f"--> Citation index is written to {args.index_folder} in {time.perf_counter() - start_time:.1f} seconds")
+
+    if args.num_eval_examples:
+        recall_results = measure_shortlist_recall(CitationIndex(args.index_folder, model, tokenizer,
+                                                                args.pretrained_model_path, args.num_probes),
+                                                  find_dataset_file(args.dataset_path, "context_dataset_eval"),
+                                                  args.num_eval_examples, args.shortlist_size)
+        print(f"--> Shortlist recall on the eval set: {json.dumps(recall_results)}")
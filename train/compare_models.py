@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from stage_timing import measure_peak_rss_mb, run_in_spawned_process
+
+
+parser = argparse.ArgumentParser(description="Compares models (e.g. a teacher and its distilled students) on the "
+                                             "same eval subsample: single-input beam search latency, memory, and "
+                                             "Hits@10, exact match and MRR.")
+parser.add_argument("--model_paths", type=str, nargs="+", help="Paths of the compared models")
+parser.add_argument("--dataset_path", type=str, help="Path to the folder of the dataset the models are trained on")
+parser.add_argument("--output_file", type=str, default="model_comparison.json", help="Path of the JSON file that the "
+                                                                                     "results are written to")
+parser.add_argument("--cache_folder", type=str, default=".", help="Folder the tokenized eval subsample is cached in")
+parser.add_argument("--max_token_limit", type=int, default=400, help="Max amount allowed for tokens used for training "
+                                                                     "and evaluation")
+parser.add_argument("--num_eval_examples", type=int, default=500, help="Number of eval set examples in the subsample")
+parser.add_argument("--num_latency_examples", type=int, default=50, help="Number of subsample examples that are "
+                                                                         "generated for one at a time to measure the "
+                                                                         "latency")
+parser.add_argument("--seed", type=int, default=42, help="Seed of the eval subsample")
+parser.add_argument("--batch_size", type=int, default=8, help="Number of inputs generated for at once when measuring "
+                                                              "the accuracy")
+
+
+def measure_model(job):
+    # Runs inside its own spawned process so that the peak RSS belongs to this model only
+    import torch
+    from transformers import BartForConditionalGeneration, BartTokenizer
+    from batched_evaluation import BatchedEvaluator
+    from cit_generation import create_cit_generation_config
+    from select_checkpoints import load_eval_subsample, read_input_settings
+
+    start_time = time.perf_counter()
+    tokenizer = BartTokenizer.from_pretrained(job["model_path"])
+    model = BartForConditionalGeneration.from_pretrained(job["model_path"])
+    model.eval()
+    load_seconds = time.perf_counter() - start_time
+
+    input_ids, targets = load_eval_subsample(tokenizer, job["dataset_path"], job["cache_folder"],
+                                             job["num_eval_examples"], job["seed"], job["max_token_limit"],
+                                             read_input_settings(job["model_path"]))
+    evaluator = BatchedEvaluator(model, tokenizer, create_cit_generation_config(model), batch_size=1)
+
+    # Latency of one input, as in interactive use: from token ids to the top-10 citations
+    evaluator.predict(input_ids[:1])  # Warm-up, excluded from the measurement
+    latencies = []
+    for example_idx in range(min(job["num_latency_examples"], len(input_ids))):
+        example_start_time = time.perf_counter()
+        evaluator.predict(input_ids[example_idx:example_idx + 1])
+        latencies.append(time.perf_counter() - example_start_time)
+
+    evaluator.batch_size = job["batch_size"]
+    metrics = evaluator.evaluate(input_ids, targets)
+
+    num_parameters = sum(parameter.numel() for parameter in model.parameters())
+    parameter_bytes = sum(parameter.numel() * parameter.element_size() for parameter in model.parameters())
+    return {"model_path": job["model_path"], "encoder_layers": model.config.encoder_layers,
+            "decoder_layers": model.config.decoder_layers, "num_parameters": num_parameters,
+            "parameter_memory_mb": parameter_bytes / (1024 * 1024), "peak_rss_mb": measure_peak_rss_mb(),
+            "load_seconds": load_seconds, "torch_threads": torch.get_num_threads(),
+            "mean_latency_ms": float(np.mean(latencies) * 1000),
+            "p50_latency_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_latency_ms": float(np.percentile(latencies, 95) * 1000), **metrics}
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    results = []
+    for model_path in args.model_paths:
+        job = {"model_path": model_path, "dataset_path": args.dataset_path, "cache_folder": args.cache_folder,
+               "max_token_limit": args.max_token_limit, "num_eval_examples": args.num_eval_examples,
+               "num_latency_examples": args.num_latency_examples, "seed": args.seed, "batch_size": args.batch_size}
+        result = run_in_spawned_process(measure_model, job)
+        if "error" in result:
+            print(f"--> {model_path}: failed ({result['error']})")
+            result["model_path"] = model_path
+        else:
+            print(f"--> {model_path}: {result['mean_latency_ms']:.1f} ms/input, peak RSS {result['peak_rss_mb']:.0f} "
+                  f"MB, Hits@10 = {result['hits_at_10']:.4f}, MRR = {result['mrr']:.4f}")
+        results.append(result)
+
+    # Each model relative to the first one that was measured, e.g. the teacher
+    measured_results = [result for result in results if "error" not in result]
+    for result in measured_results:
+        result["speedup"] = measured_results[0]["mean_latency_ms"] / result["mean_latency_ms"]
+        result["hits_at_10_difference"] = result["hits_at_10"] - measured_results[0]["hits_at_10"]
+        result["mrr_difference"] = result["mrr"] - measured_results[0]["mrr"]
+
+    with open(args.output_file, "w") as outfile:
+        json.dump({"settings": vars(args), "models": results}, outfile, indent=2)
+    print(f"\n--> Comparison is written to {os.path.abspath(args.output_file)}")
@@ -0,0 +1,83 @@
+import os
+
+
+def parse_core_list(core_list):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cores = set()
+    for part in core_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first_core, last_core = part.split("-")
+            cores.update(range(int(first_core), int(last_core) + 1))
+        else:
+            cores.add(int(part))
+    return sorted(cores)
+
+
+def format_core_list(cores):
+    # [0, 1, 2, 3, 8] -> "0-3,8"
+    ranges = []
+    for core in sorted(cores):
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def get_available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def add_cpu_thread_arguments(parser):
+    parser.add_argument("--intra_op_threads", type=int, default=0, help="Number of threads used inside torch "
+                                                                        "operations. 0 keeps the torch default, or "
+                                                                        "the number of pinned cores")
+    parser.add_argument("--inter_op_threads", type=int, default=0, help="Number of threads that run independent torch "
+                                                                        "operations in parallel. 0 keeps the torch "
+                                                                        "default")
+    parser.add_argument("--cpu_cores", type=str, default=None, help="Cores that the process is pinned to, e.g. "
+                                                                    "\"0-7\" or \"0-3,8-11\" (Linux only)")
+    parser.add_argument("--disable_tokenizers_parallelism", type=bool, default=False, help="Make this flag True to "
+                                                                                           "run the tokenizers on a "
+                                                                                           "single thread")
+
+
+def configure_cpu_threads(intra_op_threads=0, inter_op_threads=0, cpu_cores=None,
+                          disable_tokenizers_parallelism=False):
+    """Pins the process to `cpu_cores` and sets the torch and tokenizer thread counts.
+
+    Must be called before the first torch operation, since the inter-op thread pool can not be resized once it is
+    started. With pinned cores and no explicit `intra_op_threads`, torch uses one thread per pinned core instead of
+    one per core of the host.
+    """
+    import torch  # Imported here, so that the job launcher does not need torch
+
+    if cpu_cores:
+        cores = parse_core_list(cpu_cores)
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        else:
+            print("--> Core pinning is not supported on this platform, --cpu_cores is ignored")
+        if not intra_op_threads:
+            intra_op_threads = len(cores)
+
+    if disable_tokenizers_parallelism:
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        torch.set_num_interop_threads(inter_op_threads)
+
+    print(f"--> torch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op"
+          + (f", cores {format_core_list(get_available_cores())}" if cpu_cores else ""))
+
+
+def configure_cpu_threads_from_args(args):
+    configure_cpu_threads(args.intra_op_threads, args.inter_op_threads, args.cpu_cores,
+                          args.disable_tokenizers_parallelism)
@@ -0,0 +1,67 @@
+import os
+
+
+# The preprocessing scripts write the dataset files either as CSV or as Parquet. These functions find and read both,
+# loading only the columns that the caller uses. pandas is imported by the functions that read, so that the scripts
+# can check their dataset files before any slow import.
+
+def find_dataset_file(dataset_folder, file_name):
+    parquet_file_path = os.path.join(dataset_folder, file_name + ".parquet")
+    if os.path.exists(parquet_file_path):
+        return parquet_file_path
+    return os.path.join(dataset_folder, file_name + ".csv")
+
+
+def find_missing_dataset_files(dataset_folder, file_names):
+    return [file_name for file_name in file_names
+            if not os.path.exists(find_dataset_file(dataset_folder, file_name))]
+
+
+def read_dataset_columns(dataset_file_path, columns, nrows=None, dtype=None):
+    import pandas as pd
+
+    if not dataset_file_path.endswith(".parquet"):
+        return pd.read_csv(dataset_file_path, usecols=columns, nrows=nrows, dtype=dtype)
+
+    dataset_df = pd.read_parquet(dataset_file_path, columns=columns)
+    return dataset_df if nrows is None else dataset_df.head(nrows)
+
+
+def read_dataset_column_names(dataset_file_path):
+    import pandas as pd
+
+    if not dataset_file_path.endswith(".parquet"):
+        return list(pd.read_csv(dataset_file_path, nrows=0).columns)
+
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(dataset_file_path).schema_arrow.names
+
+
+def iter_dataset_column_chunks(dataset_file_path, columns, chunk_size=100000, dtype=None):
+    # Streams the columns in chunks of chunk_size rows, for dataset files that do not fit into memory
+    import pandas as pd
+
+    if not dataset_file_path.endswith(".parquet"):
+        yield from pd.read_csv(dataset_file_path, usecols=columns, dtype=dtype, chunksize=chunk_size)
+        return
+
+    import pyarrow.parquet as pq
+    for record_batch in pq.ParquetFile(dataset_file_path).iter_batches(batch_size=chunk_size, columns=columns):
+        chunk_df = record_batch.to_pandas()
+        yield chunk_df if dtype is None else chunk_df.astype(dtype)
+
+
+def read_papers_table(dataset_folder):
+    # Global datasets preprocessed with "paper_table" store the title and abstract of each paper once, and the rows
+    # only have the paper ids. Returns None for datasets with the titles and abstracts inline in every row.
+    papers_table_path = find_dataset_file(dataset_folder, "papers_table")
+    if not os.path.exists(papers_table_path):
+        return None
+
+    papers_df = read_dataset_columns(papers_table_path, ["paper_id", "title", "abstract"], dtype=str).fillna("")
+    return dict(zip(papers_df["paper_id"], zip(papers_df["title"], papers_df["abstract"])))
+
+
+def join_citing_paper_text(papers_table, citing_id, masked_context):
+    citing_title, citing_abstract = papers_table[citing_id]
+    return citing_title + " </s> " + citing_abstract + " </s> " + masked_context
@@ -0,0 +1,144 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import numpy as np
+import torch
+from transformers import BartForConditionalGeneration, Trainer
+from batched_evaluation import BatchedEvaluator
+from cit_generation import create_cit_generation_config
+
+
+def select_layer_indices(num_teacher_layers, num_student_layers):
+    # Evenly spaced teacher layers, always including the first and the last one
+    return [int(idx) for idx in np.linspace(0, num_teacher_layers - 1, num_student_layers).round()]
+
+
+def create_student_model(teacher_model, num_encoder_layers=0, num_decoder_layers=2):
+    """A shallower copy of the teacher, initialized from its embeddings and a subset of its layers.
+
+    0 layers keeps the teacher's number of layers. Copying evenly spaced layers of the fine-tuned teacher
+    ("shrink and fine-tune") gives the student a much better start than a smaller pretrained model would.
+    """
+    student_config = copy.deepcopy(teacher_model.config)
+    student_config.encoder_layers = num_encoder_layers or teacher_model.config.encoder_layers
+    student_config.decoder_layers = num_decoder_layers or teacher_model.config.decoder_layers
+    student_model = BartForConditionalGeneration(student_config)
+
+    layer_maps = {
+        "encoder": select_layer_indices(teacher_model.config.encoder_layers, student_config.encoder_layers),
+        "decoder": select_layer_indices(teacher_model.config.decoder_layers, student_config.decoder_layers),
+    }
+    teacher_state_dict = teacher_model.state_dict()
+    student_state_dict = {}
+    for name in student_model.state_dict():
+        layer_match = re.search(r"\.(encoder|decoder)\.layers\.([0-9]+)\.", name)
+        teacher_name = name
+        if layer_match:
+            teacher_layer = layer_maps[layer_match.group(1)][int(layer_match.group(2))]
+            teacher_name = name.replace(layer_match.group(0),
+                                        f".{layer_match.group(1)}.layers.{teacher_layer}.", 1)
+        student_state_dict[name] = teacher_state_dict[teacher_name].clone()
+    student_model.load_state_dict(student_state_dict)
+    print(f"--> Student model with encoder layers {layer_maps['encoder']} and decoder layers "
+          f"{layer_maps['decoder']} of the teacher")
+    return student_model
+
+
+class DistillationTrainer(Trainer):
+    """Trainer whose training loss mixes the label loss of the student with a loss on the teacher's logits.
+
+    At each target position, the student is trained towards the softmax (at `temperature`) of the teacher's
+    `top_k` largest logits: `(1 - alpha) * label_loss + alpha * temperature ** 2 * soft_target_loss`. Only the top-k
+    logits are used, since the rest of the 50k token vocabulary has almost no probability for a citation. Evaluation
+    uses the label loss only, so the eval loss stays comparable with that of a model trained without a teacher.
+    """
+
+    def __init__(self, *args, teacher_model, alpha=0.5, temperature=2.0, top_k=20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.teacher_model = teacher_model.eval()
+        self.alpha = alpha
+        self.temperature = temperature
+        self.top_k = top_k
+
+    def compute_loss(self, model, inputs, return_outputs=False, **kwargs):
+        outputs = model(**inputs)
+        if not model.training:
+            return (outputs.loss, outputs) if return_outputs else outputs.loss
+
+        if self.teacher_model.device != outputs.logits.device:
+            self.teacher_model.to(outputs.logits.device)
+        with torch.no_grad():
+            teacher_logits = self.teacher_model(**inputs).logits
+
+        top_logits, top_indices = teacher_logits.float().topk(self.top_k, dim=-1)
+        teacher_probabilities = torch.softmax(top_logits / self.temperature, dim=-1)
+        student_log_probabilities = torch.log_softmax(outputs.logits.float() / self.temperature, dim=-1)
+        soft_target_losses = -(teacher_probabilities * student_log_probabilities.gather(-1, top_indices)).sum(-1)
+
+        # The label padding of preprocess_function is not part of the targets
+        labels = inputs["labels"]
+        target_mask = ((labels != -100) & (labels != model.config.pad_token_id)).float()
+        soft_target_loss = (soft_target_losses * target_mask).sum() / target_mask.sum().clamp(min=1)
+
+        loss = (1 - self.alpha) * outputs.loss + self.alpha * self.temperature ** 2 * soft_target_loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def hash_example_inputs(examples, create_input_ids):
+    # Hash of the input ids of all examples in their order, so a reordered or re-split train set gets another hash
+    inputs_hash = hashlib.sha1()
+    for example in examples:
+        inputs_hash.update(create_input_ids(example).numpy().astype(np.int64).tobytes())
+    return inputs_hash.hexdigest()
+
+
+def predict_teacher_citations(teacher_model, teacher_model_path, tokenizer, examples, create_input_ids,
+                              targets_file=None, batch_size=8):
+    """Top-10 beam search citations of the teacher for each training example, cached in targets_file.
+
+    create_input_ids turns an example into the (1, max_token_limit) input ids that fill_mask uses. The cache is only
+    used if it was written for the same teacher and the same example inputs.
+    """
+    cache_key = None
+    if targets_file:
+        cache_key = {"teacher_model_path": os.path.abspath(teacher_model_path) if os.path.isdir(teacher_model_path)
+                     else teacher_model_path, "inputs_hash": hash_example_inputs(examples, create_input_ids)}
+    if targets_file and os.path.exists(targets_file):
+        with open(targets_file, "r") as infile:
+            cached_targets = json.load(infile)
+        if isinstance(cached_targets, dict) and all(cached_targets.get(key) == value
+                                                    for key, value in cache_key.items()):
+            print(f"--> Teacher citations are loaded from {targets_file}")
+            return cached_targets["predictions"]
+        print(f"--> {targets_file} was written for another teacher or other training examples, the teacher "
+              f"citations are predicted again")
+
+    teacher_model.eval()
+    evaluator = BatchedEvaluator(teacher_model, tokenizer, create_cit_generation_config(teacher_model), batch_size)
+    teacher_predictions = []
+    for batch_start in range(0, len(examples), batch_size):
+        batch_examples = examples[batch_start:batch_start + batch_size]
+        teacher_predictions.extend(evaluator.predict(torch.cat([create_input_ids(e) for e in batch_examples])))
+
+    if targets_file:
+        with open(targets_file, "w") as outfile:
+            json.dump({**cache_key, "predictions": teacher_predictions}, outfile)
+    return teacher_predictions
+
+
+def replace_targets_with_teacher_citations(examples, teacher_predictions):
+    # Sequence-level distillation (Kim & Rush, 2016): the target of each example is replaced by the teacher's top beam
+    # search citation, so the student learns the sequence the teacher would output. Lower ranked citations are not
+    # added as extra targets, since at the weight of the ground truth they would teach the student wrong citations.
+    # Examples the teacher predicts no citation for keep their ground truth target.
+    teacher_examples = []
+    for example, predictions in zip(examples, teacher_predictions):
+        top_citation = next((citation for citation in predictions if citation), None)
+        teacher_examples.append({**example, "masked_token_target": top_citation} if top_citation else example)
+    changed_count = sum(example["masked_token_target"] != teacher_example["masked_token_target"]
+                        for example, teacher_example in zip(examples, teacher_examples))
+    print(f"--> The teacher's top citation differs from the target of {changed_count} of {len(examples)} training "
+          f"examples")
+    return teacher_examples
@@ -0,0 +1,12 @@
+import torch
+
+
+def embed_mean_pooled(model, input_ids):
+    # Mean of the BART encoder states over the non-padding positions, normalized for cosine similarity
+    input_ids = input_ids.to(model.device)
+    attention_mask = (input_ids != model.config.pad_token_id).long()
+    with torch.no_grad():
+        encoder_states = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)[0]
+    mask = attention_mask.unsqueeze(-1).to(encoder_states.dtype)
+    pooled_states = (encoder_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    return torch.nn.functional.normalize(pooled_states.float(), dim=-1).cpu()
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import torch
+from transformers import BartForConditionalGeneration, BartTokenizerFast
+from cit_generation import create_cit_generation_config
+from dataset_files import find_dataset_file, read_dataset_column_names, read_dataset_columns, read_papers_table
+from exported_runtime import runtime_config_file_name, tokenizer_file_name
+from select_checkpoints import create_eval_inputs
+
+
+parser = argparse.ArgumentParser(description="Exports a trained model to ONNX or TorchScript graphs (an encoder, a "
+                                             "first decoder step and a decoder step with past key values) for "
+                                             "exported_runtime.py, and compares the runtime with transformers.")
+parser.add_argument("--model_path", type=str, help="Path of the trained model, e.g. ../models/<model_name>")
+parser.add_argument("--export_folder", type=str, help="Folder the graphs, tokenizer and runtime config are "
+                                                      "written to")
+parser.add_argument("--format", type=str, default="onnx", choices=["onnx", "torchscript"], help="Format of the "
+                                                                                                "exported graphs")
+parser.add_argument("--opset_version", type=int, default=14, help="ONNX opset version")
+parser.add_argument("--max_token_limit", type=int, default=400, help="Max amount of tokens of an input")
+parser.add_argument("--compare_dataset_path", type=str, default=None, help="Path to the folder of a dataset. Its "
+                                                                           "eval contexts are used to compare the "
+                                                                           "cold start and latency of the runtime "
+                                                                           "with the transformers path")
+parser.add_argument("--num_compare_examples", type=int, default=20, help="Number of eval contexts of the comparison")
+parser.add_argument("--num_threads", type=int, default=0, help="Number of intra-op threads of both paths in the "
+                                                               "comparison. 0 keeps the default")
+
+
+class EncoderGraph(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+
+    def forward(self, input_ids, attention_mask):
+        return (self.encoder(input_ids=input_ids, attention_mask=attention_mask)[0],)
+
+
+def flatten_past_key_values(past_key_values):
+    if hasattr(past_key_values, "to_legacy_cache"):  # Cache objects of newer transformers versions
+        past_key_values = past_key_values.to_legacy_cache()
+    return [past_state for layer_past in past_key_values for past_state in layer_past]
+
+
+class DecoderInitGraph(torch.nn.Module):
+    # First decoder step: log probabilities of the next token, and the self and cross-attention keys and values of
+    # every layer
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, decoder_input_ids, encoder_attention_mask, encoder_hidden_states):
+        decoder_outputs = self.model.model.decoder(input_ids=decoder_input_ids,
+                                                   encoder_hidden_states=encoder_hidden_states,
+                                                   encoder_attention_mask=encoder_attention_mask, use_cache=True)
+        logits = self.model.lm_head(decoder_outputs[0][:, -1, :]) + self.model.final_logits_bias
+        return (torch.log_softmax(logits, dim=-1), *flatten_past_key_values(decoder_outputs[1]))
+
+
+class DecoderWithPastGraph(torch.nn.Module):
+    # Later decoder steps: the last token of each beam and the past (self key, self value, cross key, cross value of
+    # each layer) in, log probabilities and the new self-attention keys and values out
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, decoder_input_ids, encoder_attention_mask, *past_states):
+        past_key_values = tuple(tuple(past_states[idx:idx + 4]) for idx in range(0, len(past_states), 4))
+        # The cross-attention keys and values come from the past, so the encoder states are not needed. Only their
+        # sequence length is checked, and a (batch, length, 1) stand-in keeps them out of the graph inputs.
+        encoder_hidden_states = encoder_attention_mask[:, :, None].to(past_states[2].dtype)
+        decoder_outputs = self.model.model.decoder(input_ids=decoder_input_ids,
+                                                   encoder_hidden_states=encoder_hidden_states,
+                                                   encoder_attention_mask=encoder_attention_mask,
+                                                   past_key_values=past_key_values, use_cache=True)
+        logits = self.model.lm_head(decoder_outputs[0][:, -1, :]) + self.model.final_logits_bias
+        new_past_states = flatten_past_key_values(decoder_outputs[1])
+        self_attention_states = [past_state for idx, past_state in enumerate(new_past_states) if idx % 4 < 2]
+        return (torch.log_softmax(logits, dim=-1), *self_attention_states)
+
+
+def create_runtime_config(model, tokenizer):
+    # The settings of create_cit_generation_config that the beam search of exported_runtime.py implements
+    generation_config = create_cit_generation_config(model)
+    unsupported_settings = {"repetition_penalty": 1.0, "encoder_repetition_penalty": 1.0,
+                            "encoder_no_repeat_ngram_size": 0, "bad_words_ids": None, "suppress_tokens": None,
+                            "begin_suppress_tokens": None, "sequence_bias": None}
+    for name, default_value in unsupported_settings.items():
+        if getattr(generation_config, name, default_value) not in (default_value, None):
+            raise ValueError(f"The exported runtime does not support the generation setting {name}")
+    if generation_config.do_sample or generation_config.early_stopping is not False:
+        raise ValueError("The exported runtime only supports diverse beam search with early_stopping=False")
+
+    return {"num_beams": generation_config.num_beams, "num_beam_groups": generation_config.num_beam_groups,
+            "diversity_penalty": generation_config.diversity_penalty,
+            "num_return_sequences": generation_config.num_return_sequences,
+            "max_length": generation_config.max_new_tokens + 1,  # The decoder starts with the decoder start token
+            "min_length": generation_config.min_length or 0,
+            "no_repeat_ngram_size": generation_config.no_repeat_ngram_size or 0,
+            "length_penalty": generation_config.length_penalty,
+            "forced_bos_token_id": generation_config.forced_bos_token_id,
+            "forced_eos_token_id": generation_config.forced_eos_token_id,
+            "decoder_start_token_id": model.config.decoder_start_token_id,
+            "eos_token_id": model.config.eos_token_id, "pad_token_id": model.config.pad_token_id,
+            "clean_up_tokenization_spaces": bool(tokenizer.clean_up_tokenization_spaces)}
+
+
+def export_graph(graph, example_inputs, export_path, export_format, input_names, output_names, dynamic_axes,
+                 opset_version):
+    if export_format == "onnx":
+        torch.onnx.export(graph, example_inputs, export_path, input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset_version, do_constant_folding=True)
+    else:
+        torch.jit.save(torch.jit.trace(graph, example_inputs, check_trace=False), export_path)
+
+
+def export_model(model_path, export_folder, export_format="onnx", opset_version=14):
+    os.makedirs(export_folder, exist_ok=True)
+    # Eager attention traces into plain matrix products, and torchscript=True unties the shared embeddings
+    model = BartForConditionalGeneration.from_pretrained(model_path, torchscript=True, attn_implementation="eager")
+    model.eval()
+    tokenizer = BartTokenizerFast.from_pretrained(model_path)
+    file_extension = "onnx" if export_format == "onnx" else "pt"
+    num_layers = model.config.decoder_layers
+
+    input_ids = tokenizer("Citation contexts are encoded <mask> once.", return_tensors="pt")["input_ids"]
+    attention_mask = torch.ones_like(input_ids)
+    past_names = [f"past_{layer}_{name}" for layer in range(num_layers)
+                  for name in ["self_key", "self_value", "cross_key", "cross_value"]]
+    present_names = [f"present_{layer}_{name}" for layer in range(num_layers) for name in ["self_key", "self_value"]]
+
+    with torch.no_grad():
+        encoder_graph = EncoderGraph(model)
+        encoder_hidden_states = encoder_graph(input_ids, attention_mask)[0]
+        export_graph(encoder_graph, (input_ids, attention_mask),
+                     os.path.join(export_folder, f"encoder.{file_extension}"), export_format,
+                     ["input_ids", "attention_mask"], ["encoder_hidden_states"],
+                     {"input_ids": {0: "batch", 1: "length"}, "attention_mask": {0: "batch", 1: "length"},
+                      "encoder_hidden_states": {0: "batch", 1: "length"}}, opset_version)
+
+        decoder_init_graph = DecoderInitGraph(model)
+        decoder_input_ids = torch.tensor([[model.config.decoder_start_token_id]])
+        init_outputs = decoder_init_graph(decoder_input_ids, attention_mask, encoder_hidden_states)
+        export_graph(decoder_init_graph, (decoder_input_ids, attention_mask, encoder_hidden_states),
+                     os.path.join(export_folder, f"decoder_init.{file_extension}"), export_format,
+                     ["decoder_input_ids", "encoder_attention_mask", "encoder_hidden_states"],
+                     ["log_probs"] + [name.replace("past", "present") for name in past_names],
+                     {"encoder_attention_mask": {0: "batch", 1: "length"},
+                      "encoder_hidden_states": {0: "batch", 1: "length"}, "log_probs": {0: "batch"},
+                      **{name.replace("past", "present"): {0: "batch", 2: "length" if "cross" in name else "steps"}
+                         for name in past_names}}, opset_version)
+
+        # Traced with two beams, so that the batch dimension is not folded into a constant
+        past_states = tuple(past_state.repeat(2, 1, 1, 1) for past_state in init_outputs[1:])
+        next_input_ids = torch.tensor([[model.config.forced_bos_token_id or 0]] * 2)
+        export_graph(DecoderWithPastGraph(model), (next_input_ids, attention_mask.repeat(2, 1), *past_states),
+                     os.path.join(export_folder, f"decoder_with_past.{file_extension}"), export_format,
+                     ["decoder_input_ids", "encoder_attention_mask"] + past_names, ["log_probs"] + present_names,
+                     {"decoder_input_ids": {0: "batch"}, "encoder_attention_mask": {0: "batch", 1: "length"},
+                      "log_probs": {0: "batch"},
+                      **{name: {0: "batch", 2: "length" if "cross" in name else "steps"} for name in past_names},
+                      **{name: {0: "batch", 2: "steps"} for name in present_names}}, opset_version)
+
+    tokenizer.backend_tokenizer.save(os.path.join(export_folder, tokenizer_file_name))
+    with open(os.path.join(export_folder, runtime_config_file_name), "w") as outfile:
+        json.dump(create_runtime_config(model, tokenizer), outfile, indent=2)
+
+
+def run_runtime_process(model_folder, backend, contexts_file, max_token_limit, num_threads):
+    # Cold start is the time from starting the process to its first prediction: interpreter start, imports, loading
+    # and the first request
+    runtime_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exported_runtime.py")
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, runtime_script, "--model_folder", model_folder, "--backend", backend,
+                                "--contexts_file", contexts_file, "--max_token_limit", str(max_token_limit),
+                                "--num_threads", str(num_threads)], stdout=subprocess.PIPE, text=True)
+    cold_start_seconds = None
+    result = None
+    for line in process.stdout:
+        if not line.startswith("{"):
+            continue
+        event = json.loads(line)
+        if event["event"] == "first_prediction":
+            cold_start_seconds = time.perf_counter() - start_time
+        elif event["event"] == "finished":
+            result = event
+    if process.wait() != 0 or result is None:
+        raise RuntimeError(f"The {backend} runtime process failed")
+    result["cold_start_seconds"] = cold_start_seconds
+    return result
+
+
+def compare_with_transformers(model_path, export_folder, export_format, dataset_path, num_examples, max_token_limit,
+                              num_threads):
+    eval_dataset_path = find_dataset_file(dataset_path, "context_dataset_eval")
+    column_names = read_dataset_column_names(eval_dataset_path)
+    columns = [column for column in ['citing_title', 'citing_abstract', 'citing_id', 'masked_cit_context']
+               if column in column_names]
+    eval_df = read_dataset_columns(eval_dataset_path, columns, nrows=num_examples + 1, dtype=str)
+    papers_table = read_papers_table(dataset_path) if "citing_id" in columns else None
+    contexts_file = os.path.join(export_folder, "comparison_contexts.json")
+    with open(contexts_file, "w") as outfile:
+        json.dump(create_eval_inputs(eval_df, papers_table), outfile)
+
+    results = {"transformers": run_runtime_process(model_path, "transformers", contexts_file, max_token_limit,
+                                                   num_threads),
+               export_format: run_runtime_process(export_folder, export_format, contexts_file, max_token_limit,
+                                                  num_threads)}
+    # Share of requests with the same top-10 citations, in the same order, on both paths
+    same_predictions = [transformers_predictions == exported_predictions for transformers_predictions,
+                        exported_predictions in zip(results["transformers"]["predictions"],
+                                                    results[export_format]["predictions"])]
+    for result in results.values():
+        del result["predictions"], result["event"]
+    results["same_top_10_share"] = sum(same_predictions) / len(same_predictions)
+    results["cold_start_speedup"] = results["transformers"]["cold_start_seconds"] / \
+        results[export_format]["cold_start_seconds"]
+    results["latency_speedup"] = results["transformers"]["mean_latency_ms"] / results[export_format]["mean_latency_ms"]
+    return results
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    export_model(args.model_path, args.export_folder, args.format, args.opset_version)
+    print(f"--> {args.format} graphs are written to {args.export_folder} in {time.perf_counter() - start_time:.1f} "
+          f"seconds")
+
+    if args.compare_dataset_path:
+        comparison = compare_with_transformers(args.model_path, args.export_folder, args.format,
+                                               args.compare_dataset_path, args.num_compare_examples,
+                                               args.max_token_limit, args.num_threads)
+        with open(os.path.join(args.export_folder, "runtime_comparison.json"), "w") as outfile:
+            json.dump(comparison, outfile, indent=2)
+        print(f"--> Runtime comparison: {json.dumps(comparison, indent=2)}")
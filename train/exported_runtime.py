@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from stage_timing import measure_peak_rss_mb
+
+
+# Minimal CPU runtime for models exported by export_model.py. It only needs numpy, the "tokenizers" library and
+# either onnxruntime or torch (for TorchScript graphs), so serving a request does not import or build a transformers
+# model. The citation beam search is a numpy port of the diverse (group) beam search that fill_mask runs through
+# model.generate with create_cit_generation_config.
+
+parser = argparse.ArgumentParser(description="Predicts the top-10 citations of masked contexts with an exported "
+                                             "model, and measures its cold start and per-request latency.")
+parser.add_argument("--model_folder", type=str, help="Folder written by export_model.py, or a transformers model "
+                                                     "folder for the transformers backend")
+parser.add_argument("--backend", type=str, default="onnx", choices=["onnx", "torchscript", "transformers"],
+                    help="Graphs that run the model. The transformers backend is the fill_mask path, for comparison")
+parser.add_argument("--contexts_file", type=str, help="JSON file with a list of masked contexts")
+parser.add_argument("--max_token_limit", type=int, default=400, help="Max amount of tokens of an input")
+parser.add_argument("--num_threads", type=int, default=0, help="Number of intra-op threads. 0 keeps the default")
+
+runtime_config_file_name = "runtime_config.json"
+tokenizer_file_name = "tokenizer.json"
+
+
+class OnnxGraphs:
+    def __init__(self, model_folder, num_threads=0):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        self.sessions = {name: onnxruntime.InferenceSession(os.path.join(model_folder, f"{name}.onnx"),
+                                                            session_options, providers=["CPUExecutionProvider"])
+                         for name in ["encoder", "decoder_init", "decoder_with_past"]}
+        self.input_names = {name: [graph_input.name for graph_input in session.get_inputs()]
+                            for name, session in self.sessions.items()}
+
+    def run(self, name, *inputs):
+        return self.sessions[name].run(None, dict(zip(self.input_names[name], inputs)))
+
+
+class TorchScriptGraphs:
+    def __init__(self, model_folder, num_threads=0):
+        import torch
+
+        self.torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.graphs = {name: torch.jit.load(os.path.join(model_folder, f"{name}.pt"))
+                       for name in ["encoder", "decoder_init", "decoder_with_past"]}
+
+    def run(self, name, *inputs):
+        with self.torch.inference_mode():
+            outputs = self.graphs[name](*[self.torch.from_numpy(graph_input) for graph_input in inputs])
+        return [output.numpy() for output in outputs]
+
+
+class BeamHypotheses:
+    # The best `num_beams` finished hypotheses of a beam group, scored by their length-normalized log probability
+    def __init__(self, num_beams, length_penalty):
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+        self.beams = []
+        self.worst_score = 1e9
+
+    def add(self, token_ids, sum_log_probs, generated_len):
+        score = sum_log_probs / (generated_len ** self.length_penalty)
+        if len(self.beams) < self.num_beams or score > self.worst_score:
+            self.beams.append((score, token_ids))
+            if len(self.beams) > self.num_beams:
+                sorted_scores = sorted([(s, idx) for idx, (s, _) in enumerate(self.beams)])
+                del self.beams[sorted_scores[0][1]]
+                self.worst_score = sorted_scores[1][0]
+            else:
+                self.worst_score = min(score, self.worst_score)
+
+    def is_done(self, best_sum_log_probs, generated_len):
+        # No running beam can become better than the worst finished one (early_stopping=False)
+        if len(self.beams) < self.num_beams:
+            return False
+        return self.worst_score >= best_sum_log_probs / generated_len ** self.length_penalty
+
+
+def find_banned_ngram_tokens(token_ids, ngram_size):
+    # Tokens that would repeat an n-gram of the sequence (no_repeat_ngram_size)
+    if len(token_ids) + 1 < ngram_size:
+        return []
+    prefix = tuple(token_ids[len(token_ids) + 1 - ngram_size:])
+    return [token_ids[idx + ngram_size - 1] for idx in range(len(token_ids) - ngram_size + 1)
+            if tuple(token_ids[idx:idx + ngram_size - 1]) == prefix]
+
+
+class CitationBeamSearch:
+    """Diverse beam search over exported encoder/decoder graphs for one input at a time.
+
+    The encoder and the first decoder step run once on the single input, and their outputs are shared by all beams.
+    Later steps feed only the last token of each beam to the decoder-with-past graph, and only the self-attention
+    cache is reordered between steps, since the cross-attention cache is the same for every beam.
+    """
+
+    def __init__(self, graphs, runtime_config):
+        self.graphs = graphs
+        self.config = runtime_config
+
+    def process_scores(self, log_probs, sequences, cur_len, previous_group_tokens):
+        config = self.config
+        if config["diversity_penalty"] and len(previous_group_tokens):
+            token_frequency = np.bincount(previous_group_tokens, minlength=log_probs.shape[-1])
+            log_probs = log_probs - config["diversity_penalty"] * token_frequency[:log_probs.shape[-1]]
+        if config["no_repeat_ngram_size"]:
+            for beam_idx, token_ids in enumerate(sequences):
+                log_probs[beam_idx, find_banned_ngram_tokens(token_ids, config["no_repeat_ngram_size"])] = -np.inf
+        if cur_len < config["min_length"]:
+            log_probs[:, config["eos_token_id"]] = -np.inf
+        if cur_len == 1 and config["forced_bos_token_id"] is not None:
+            log_probs = np.full_like(log_probs, -np.inf)
+            log_probs[:, config["forced_bos_token_id"]] = 0
+        if cur_len == config["max_length"] - 1 and config["forced_eos_token_id"] is not None:
+            log_probs = np.full_like(log_probs, -np.inf)
+            log_probs[:, config["forced_eos_token_id"]] = 0
+        return log_probs
+
+    def search(self, input_ids):
+        config = self.config
+        num_beams, num_groups = config["num_beams"], config["num_beam_groups"]
+        group_size = num_beams // num_groups
+        eos_token_id = config["eos_token_id"]
+
+        attention_mask = np.ones_like(input_ids)
+        encoder_states = self.graphs.run("encoder", input_ids, attention_mask)[0]
+        decoder_outputs = self.graphs.run("decoder_init", np.array([[config["decoder_start_token_id"]]]),
+                                          attention_mask, encoder_states)
+        log_probs = np.repeat(decoder_outputs[0], num_beams, axis=0)
+        past = [np.repeat(past_state, num_beams, axis=0) for past_state in decoder_outputs[1:]]
+        beam_attention_mask = np.repeat(attention_mask, num_beams, axis=0)
+
+        sequences = [[config["decoder_start_token_id"]] for _ in range(num_beams)]
+        # Only the first beam of each group starts active, so that a group's beams do not pick the same tokens
+        beam_scores = np.full(num_beams, -1e9, dtype=np.float32)
+        beam_scores[::group_size] = 0
+        hypotheses = [BeamHypotheses(group_size, config["length_penalty"]) for _ in range(num_groups)]
+        done = [False] * num_groups
+
+        while True:
+            cur_len = len(sequences[0])
+            current_tokens = np.zeros(num_beams, dtype=np.int64)
+            reordering_indices = np.zeros(num_beams, dtype=np.int64)
+            for group_idx in range(num_groups):
+                group_start = group_idx * group_size
+                if done[group_idx]:  # Finished groups keep running on padding, as in model.generate
+                    beam_scores[group_start:group_start + group_size] = 0
+                    current_tokens[group_start:group_start + group_size] = config["pad_token_id"]
+                    reordering_indices[group_start:group_start + group_size] = group_start
+                    sequences[group_start:group_start + group_size] = [
+                        sequences[group_start] + [config["pad_token_id"]] for _ in range(group_size)]
+                    continue
+
+                scores = self.process_scores(log_probs[group_start:group_start + group_size].copy(),
+                                             sequences[group_start:group_start + group_size], cur_len,
+                                             current_tokens[:group_start])
+                scores = (scores + beam_scores[group_start:group_start + group_size, None]).reshape(-1)
+                top_candidates = np.argsort(-scores, kind="stable")[:2 * group_size]
+
+                next_beams = []
+                for candidate_rank, candidate in enumerate(top_candidates):
+                    beam_idx, token_id = divmod(int(candidate), log_probs.shape[-1])
+                    if token_id == eos_token_id:
+                        if candidate_rank < group_size:
+                            hypotheses[group_idx].add(list(sequences[group_start + beam_idx]),
+                                                      float(scores[candidate]), cur_len)
+                    else:
+                        next_beams.append((float(scores[candidate]), token_id, beam_idx))
+                    if len(next_beams) == group_size:
+                        break
+
+                group_sequences = [sequences[group_start + beam_idx] + [token_id] for _, token_id, beam_idx
+                                   in next_beams]
+                sequences[group_start:group_start + group_size] = group_sequences
+                for offset, (score, token_id, beam_idx) in enumerate(next_beams):
+                    beam_scores[group_start + offset] = score
+                    current_tokens[group_start + offset] = token_id
+                    reordering_indices[group_start + offset] = group_start + beam_idx
+                done[group_idx] = hypotheses[group_idx].is_done(float(scores[top_candidates[0]]), cur_len)
+
+            if all(done) or len(sequences[0]) >= config["max_length"]:
+                break
+
+            # The past holds (self key, self value, cross key, cross value) per layer. The self-attention cache
+            # follows the beams, the cross-attention cache is the same for all of them.
+            for layer in range(len(past) // 4):
+                past[4 * layer] = past[4 * layer][reordering_indices]
+                past[4 * layer + 1] = past[4 * layer + 1][reordering_indices]
+            decoder_outputs = self.graphs.run("decoder_with_past", current_tokens[:, None], beam_attention_mask,
+                                              *past)
+            log_probs = decoder_outputs[0]
+            for layer in range(len(past) // 4):
+                past[4 * layer], past[4 * layer + 1] = decoder_outputs[1 + 2 * layer], decoder_outputs[2 + 2 * layer]
+
+        for group_idx in range(num_groups):
+            if not done[group_idx]:
+                for beam_idx in range(group_idx * group_size, (group_idx + 1) * group_size):
+                    hypotheses[group_idx].add(sequences[beam_idx], float(beam_scores[beam_idx]),
+                                              len(sequences[beam_idx]) - 1)
+
+        sorted_hypotheses = sorted([beam for group_hypotheses in hypotheses for beam in group_hypotheses.beams],
+                                   key=lambda beam: beam[0])
+        return [sorted_hypotheses.pop()[1] for _ in range(config["num_return_sequences"])]
+
+
+def clean_up_tokenization(text):
+    # The same clean-up of spaces before punctuation as the decode of the transformers tokenizers
+    return text.replace(" .", ".").replace(" ?", "?").replace(" !", "!").replace(" ,", ",").replace(" ' ", "'") \
+        .replace(" n't", "n't").replace(" 'm", "'m").replace(" 's", "'s").replace(" 've", "'ve").replace(" 're", "'re")
+
+
+def select_top_citations(citations, num_predictions=10):
+    unique_citations = list(dict.fromkeys(citations))
+    while len(unique_citations) < num_predictions:
+        unique_citations.append(unique_citations[-1])
+    return unique_citations[:num_predictions]
+
+
+class ExportedCitationPredictor:
+    # Tokenizer, graphs and beam search of an export folder: masked context in, top-10 citations out
+    def __init__(self, model_folder, backend="onnx", max_token_limit=400, num_threads=0):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_folder, runtime_config_file_name), "r") as infile:
+            self.runtime_config = json.load(infile)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_folder, tokenizer_file_name))
+        self.tokenizer.enable_truncation(max_token_limit)
+        graphs = OnnxGraphs(model_folder, num_threads) if backend == "onnx" else \
+            TorchScriptGraphs(model_folder, num_threads)
+        self.beam_search = CitationBeamSearch(graphs, self.runtime_config)
+
+    def predict(self, masked_context):
+        input_ids = np.array([self.tokenizer.encode(masked_context).ids], dtype=np.int64)
+        sequences = self.beam_search.search(input_ids)
+        citations = [self.tokenizer.decode(sequence, skip_special_tokens=True) for sequence in sequences]
+        if self.runtime_config["clean_up_tokenization_spaces"]:
+            citations = [clean_up_tokenization(citation) for citation in citations]
+        return select_top_citations([citation.strip() for citation in citations])
+
+
+class TransformersCitationPredictor:
+    # The model.generate call of fill_mask in the training scripts, as the baseline of the comparison. fill_mask pads
+    # every input to max_token_limit, but here the inputs are not padded, as in the exported path, so that the
+    # comparison only measures the export.
+    def __init__(self, model_folder, max_token_limit=400, num_threads=0):
+        import torch
+        from transformers import BartConfig, BartForConditionalGeneration, BartTokenizer
+        from cit_generation import create_cit_generation_config
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.torch = torch
+        self.max_token_limit = max_token_limit
+        config = BartConfig.from_pretrained(model_folder, attention_dropout=0.123)
+        self.tokenizer = BartTokenizer.from_pretrained(model_folder, truncation=True, model_max_length=max_token_limit)
+        self.model = BartForConditionalGeneration.from_pretrained(model_folder, config=config)
+        self.model.eval()
+        self.cit_generation_config = create_cit_generation_config(self.model)
+
+    def predict(self, masked_context):
+        input_ids = self.tokenizer.encode(masked_context, return_tensors="pt", max_length=self.max_token_limit,
+                                          truncation=True)
+        with self.torch.no_grad():
+            outputs = self.model.generate(input_ids, generation_config=self.cit_generation_config)
+        return select_top_citations([output.strip() for output in
+                                     self.tokenizer.batch_decode(outputs, skip_special_tokens=True)])
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    with open(args.contexts_file, "r") as infile:
+        masked_contexts = json.load(infile)
+
+    # Cold start: loading plus the first request, which the caller times from the process start
+    if args.backend == "transformers":
+        predictor = TransformersCitationPredictor(args.model_folder, args.max_token_limit, args.num_threads)
+    else:
+        predictor = ExportedCitationPredictor(args.model_folder, args.backend, args.max_token_limit,
+                                              args.num_threads)
+    predictions = [predictor.predict(masked_contexts[0])]
+    print(json.dumps({"event": "first_prediction"}), flush=True)
+
+    latencies = []
+    for masked_context in masked_contexts[1:]:
+        start_time = time.perf_counter()
+        predictions.append(predictor.predict(masked_context))
+        latencies.append(time.perf_counter() - start_time)
+
+    print(json.dumps({"event": "finished", "backend": args.backend, "num_requests": len(latencies),
+                      "mean_latency_ms": float(np.mean(latencies) * 1000) if latencies else None,
+                      "p95_latency_ms": float(np.percentile(latencies, 95) * 1000) if latencies else None,
+                      "peak_rss_mb": measure_peak_rss_mb(), "predictions": predictions}), flush=True)
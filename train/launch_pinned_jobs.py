@@ -0,0 +1,132 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from cpu_threads import format_core_list, get_available_cores, parse_core_list
+
+
+parser = argparse.ArgumentParser(description="Runs independent training or evaluation jobs side by side on one host. "
+                                             "Each running job is pinned to its own set of cores, so the jobs do not "
+                                             "oversubscribe the cores and slow each other down.")
+parser.add_argument("--jobs_file", type=str, required=True, help="Text file with one shell command per line. "
+                                                                "Empty lines and lines starting with # are "
+                                                                "skipped")
+parser.add_argument("--num_slots", type=int, default=2, help="Number of jobs that run at the same time. The cores "
+                                                             "are split into this many disjoint sets")
+parser.add_argument("--cpu_cores", type=str, default=None, help="Cores shared out to the jobs, e.g. \"0-31\". All "
+                                                                "cores available to the launcher by default")
+parser.add_argument("--log_folder", type=str, default=None, help="Folder for the output of each job (job_<n>.log). "
+                                                                 "The output goes to the terminal if it is not given")
+parser.add_argument("--working_folder", type=str, default=None, help="Folder the commands are run in. The current "
+                                                                     "folder by default")
+
+
+def read_job_commands(jobs_file):
+    with open(jobs_file, "r") as infile:
+        return [line.strip() for line in infile if line.strip() and not line.strip().startswith("#")]
+
+
+def split_cores(cores, num_slots):
+    # Contiguous, disjoint core sets of (nearly) equal size
+    if num_slots > len(cores):
+        raise ValueError(f"{num_slots} slots need at least {num_slots} cores, but only {len(cores)} are available")
+    slot_size, remainder = divmod(len(cores), num_slots)
+    core_sets = []
+    start = 0
+    for slot in range(num_slots):
+        end = start + slot_size + (1 if slot < remainder else 0)
+        core_sets.append(cores[start:end])
+        start = end
+    return core_sets
+
+
+def create_job_environment(cores):
+    # Thread pools of torch, OpenMP/MKL and the tokenizers are sized to the pinned cores instead of the whole host
+    environment = dict(os.environ)
+    environment["OMP_NUM_THREADS"] = str(len(cores))
+    environment["MKL_NUM_THREADS"] = str(len(cores))
+    environment["TOKENIZERS_PARALLELISM"] = "false"
+    return environment
+
+
+def start_job(job_idx, command, cores, log_folder, working_folder):
+    def pin_to_cores():
+        os.sched_setaffinity(0, cores)
+
+    print(f"--> Job {job_idx} started on cores {format_core_list(cores)}: {command}")
+    log_file = open(os.path.join(log_folder, f"job_{job_idx}.log"), "w") if log_folder else None
+    process = subprocess.Popen(command, shell=True, cwd=working_folder, env=create_job_environment(cores),
+                               preexec_fn=pin_to_cores, stdout=log_file,
+                               stderr=subprocess.STDOUT if log_file else None)
+    return process, log_file, time.perf_counter()
+
+
+def run_jobs(commands, core_sets, log_folder=None, working_folder=None, poll_interval=1.0):
+    # A free core set runs the next waiting job as soon as the job before it on these cores is finished
+    waiting_jobs = list(enumerate(commands))
+    free_core_sets = list(core_sets)
+    running_jobs = {}
+    return_codes = [None] * len(commands)
+
+    while waiting_jobs or running_jobs:
+        while waiting_jobs and free_core_sets:
+            job_idx, command = waiting_jobs.pop(0)
+            cores = free_core_sets.pop(0)
+            running_jobs[job_idx] = (cores,) + start_job(job_idx, command, cores, log_folder, working_folder)
+
+        time.sleep(poll_interval)
+        for job_idx, (cores, process, log_file, start_time) in list(running_jobs.items()):
+            if process.poll() is None:
+                continue
+            if log_file:
+                log_file.close()
+            return_codes[job_idx] = process.returncode
+            print(f"--> Job {job_idx} finished with exit code {process.returncode} in "
+                  f"{time.perf_counter() - start_time:.1f} seconds")
+            free_core_sets.append(cores)
+            del running_jobs[job_idx]
+
+    return return_codes
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.num_slots < 1:
+        parser.error("--num_slots must be at least 1")
+    if not os.path.isfile(args.jobs_file):
+        parser.error(f"--jobs_file {args.jobs_file} does not exist")
+
+    if not hasattr(os, "sched_setaffinity"):
+        sys.exit("--> Core pinning is only supported on Linux")
+
+    job_commands = read_job_commands(args.jobs_file)
+    if not job_commands:
+        print(f"--> No jobs in {args.jobs_file}")
+        sys.exit(0)
+
+    available_cores = get_available_cores()
+    if args.cpu_cores:
+        unavailable_cores = set(parse_core_list(args.cpu_cores)) - set(available_cores)
+        if unavailable_cores:
+            sys.exit(f"--> Cores {format_core_list(unavailable_cores)} are not available to the launcher")
+        available_cores = parse_core_list(args.cpu_cores)
+    num_slots = min(args.num_slots, len(job_commands))
+    if num_slots > len(available_cores):
+        parser.error(f"{num_slots} slots need at least {num_slots} cores, but only {len(available_cores)} are "
+                     f"available. Lower --num_slots")
+    job_core_sets = split_cores(available_cores, num_slots)
+
+    if args.log_folder:
+        os.makedirs(args.log_folder, exist_ok=True)
+
+    print(f"--> {len(job_commands)} jobs on {len(job_core_sets)} slots: "
+          + ", ".join(format_core_list(cores) for cores in job_core_sets))
+    job_return_codes = run_jobs(job_commands, job_core_sets, args.log_folder, args.working_folder)
+
+    failed_jobs = [job_idx for job_idx, return_code in enumerate(job_return_codes) if return_code != 0]
+    print(f"--> {len(job_commands) - len(failed_jobs)} of {len(job_commands)} jobs succeeded")
+    if failed_jobs:
+        print(f"--> Failed jobs: {', '.join(str(job_idx) for job_idx in failed_jobs)}")
+        sys.exit(1)
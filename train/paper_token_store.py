@@ -0,0 +1,72 @@
+class PaperTokenStore:
+    """Token ids of the "title </s> abstract </s>" part of global model inputs, tokenized once per citing paper.
+
+    Every context of a citing paper starts with the same title and abstract, so the inputs are assembled at the token
+    level: the stored ids of the paper are concatenated with the ids of the context. The abstract and the context are
+    cut to exactly `abstract_token_limit` and `context_token_limit` tokens of the training tokenizer.
+    """
+
+    def __init__(self, tokenizer, abstract_token_limit=200, context_token_limit=100):
+        self.tokenizer = tokenizer
+        self.abstract_token_limit = abstract_token_limit
+        self.context_token_limit = context_token_limit
+        self.space_ids = tokenizer.encode(" ", add_special_tokens=False)
+        self.paper_token_ids = {}
+
+    def get_paper_token_ids(self, paper_key, title, abstract):
+        if paper_key not in self.paper_token_ids:
+            # The spaces around "</s>" are tokenized as in the string inputs, so inputs within the limits get the
+            # same ids as "title </s> abstract </s> context"
+            title_ids = self.tokenizer.encode(title + " ", add_special_tokens=False)
+            abstract_ids = self.tokenizer.encode(" " + abstract, add_special_tokens=False)[:self.abstract_token_limit]
+            self.paper_token_ids[paper_key] = (title_ids + [self.tokenizer.sep_token_id] + abstract_ids +
+                                               self.space_ids + [self.tokenizer.sep_token_id])
+        return self.paper_token_ids[paper_key]
+
+    def trim_context_ids(self, context_ids):
+        # Keeps a window of context_token_limit tokens with the mask in its middle, or as close to it as the context
+        # allows
+        if len(context_ids) <= self.context_token_limit:
+            return context_ids
+        mask_token_id = self.tokenizer.mask_token_id
+        mask_idx = context_ids.index(mask_token_id) if mask_token_id in context_ids else 0
+        window_start = max(0, mask_idx - self.context_token_limit // 2)
+        window_start = min(window_start, len(context_ids) - self.context_token_limit)
+        return context_ids[window_start:window_start + self.context_token_limit]
+
+    def assemble_input_ids(self, paper_key, title, abstract, context_ids, max_length):
+        # Same layout as tokenizing "title </s> abstract </s> context" with truncation
+        body_ids = self.get_paper_token_ids(paper_key, title, abstract) + self.trim_context_ids(context_ids)
+        return [self.tokenizer.bos_token_id] + body_ids[:max_length - 2] + [self.tokenizer.eos_token_id]
+
+    def assemble_examples(self, examples, papers_table, max_length):
+        """Padded input ids and attention masks of a batch of examples, given as a dict of columns.
+
+        Only the contexts are tokenized, unless the examples have the token ids stored by the preprocessing in
+        "context_token_ids". The title and abstract come from the papers table for examples with a "citing_id".
+        """
+        if "context_token_ids" in examples:
+            context_ids_list = [[int(token_id) for token_id in context_token_ids.split()]
+                                for context_token_ids in examples["context_token_ids"]]
+        else:
+            # The leading space stands for the space after "</s>" in the string inputs
+            contexts = [" " + example.replace("<mask>", "<extra_id_0>", 1).replace("<mask>", " ").replace(
+                "<extra_id_0>", "<mask>") for example in examples["masked_cit_context"]]
+            context_ids_list = self.tokenizer(contexts, add_special_tokens=False)["input_ids"]
+
+        if "citing_id" in examples:
+            paper_keys = examples["citing_id"]
+            citing_papers = [papers_table[citing_id] for citing_id in paper_keys]
+        else:
+            citing_papers = list(zip(examples["citing_title"], examples["citing_abstract"]))
+            paper_keys = citing_papers
+
+        input_ids_list = [self.assemble_input_ids(paper_key, citing_title, citing_abstract, context_ids, max_length)
+                          for paper_key, (citing_title, citing_abstract), context_ids
+                          in zip(paper_keys, citing_papers, context_ids_list)]
+        return self.pad(input_ids_list, max_length)
+
+    def pad(self, input_ids_list, max_length):
+        padded_input_ids = [ids + [self.tokenizer.pad_token_id] * (max_length - len(ids)) for ids in input_ids_list]
+        attention_masks = [[1] * len(ids) + [0] * (max_length - len(ids)) for ids in input_ids_list]
+        return {"input_ids": padded_input_ids, "attention_mask": attention_masks}
@@ -0,0 +1,174 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+
+# Tokenizers, configs and models are resolved in this order:
+# 1. Names in the asset registry (e.g. "facebook/bart-base" and "roberta-base") load from their local folder, after
+#    the checksums of its files are verified. This works without network access, e.g. on an air-gapped cluster.
+# 2. Other names are looked up in the local Hugging Face cache first. from_pretrained with a hub name otherwise asks
+#    the hub for the newest revision of every file before it loads the cached copy, which adds seconds to the start
+#    of each job, or a timeout when the hub can not be reached.
+#
+# Each registered folder also has the fast tokenizer serialized as one "tokenizer.json" file. The Rust based
+# tokenizer classes load it directly instead of converting vocab.json and merges.txt in every process.
+
+project_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+default_registry_file = os.path.join(project_folder, "assets", "asset_registry.json")
+
+# Files of a hub model that are copied into the registry, which leaves out the TensorFlow, Flax and Rust weights
+asset_file_patterns = ["*.json", "*.txt", "*.model", "*.safetensors"]
+
+verified_files_name = ".verified_files.json"
+
+parser = argparse.ArgumentParser(description="Manages the local registry of pretrained models and tokenizers.")
+parser.add_argument("command", type=str, choices=["add", "verify", "list"], help="'add' copies a model into the "
+                    "registry, 'verify' checks the checksums of all registered files")
+parser.add_argument("--name", type=str, default=None, help="Name that the scripts use for the model, e.g. "
+                                                           "facebook/bart-base (for 'add')")
+parser.add_argument("--source", type=str, default=None, help="Folder with the files of the model, e.g. one saved "
+                                                             "with save_pretrained. It is downloaded from the hub "
+                                                             "by its name if it is not given (for 'add')")
+parser.add_argument("--registry_file", type=str, default=None, help="Registry file. Defaults to the "
+                                                                    "CITEBART_ASSET_REGISTRY environment variable, "
+                                                                    "or assets/asset_registry.json")
+
+
+def get_registry_file(registry_file=None):
+    return registry_file or os.environ.get("CITEBART_ASSET_REGISTRY") or default_registry_file
+
+
+def read_asset_registry(registry_file):
+    if not os.path.exists(registry_file):
+        return {}
+    with open(registry_file, "r") as infile:
+        return json.load(infile)["assets"]
+
+
+def calculate_file_checksum(file_path, chunk_size=1 << 20):
+    file_hash = hashlib.sha256()
+    with open(file_path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def verify_asset_files(asset_folder, file_checksums, rehash=False):
+    """Raises ValueError if a file of the asset is missing or its SHA-256 checksum differs from the registry.
+
+    Hashing the weights of bart-base takes about a second, so the size and modification time of each verified file
+    are kept in the asset folder. Later processes only hash files that changed since then, unless `rehash` is set.
+    """
+    verified_files_path = os.path.join(asset_folder, verified_files_name)
+    verified_files = {}
+    if os.path.exists(verified_files_path) and not rehash:
+        with open(verified_files_path, "r") as infile:
+            verified_files = json.load(infile)
+
+    newly_verified = False
+    for file_name, checksum in file_checksums.items():
+        file_path = os.path.join(asset_folder, file_name)
+        if not os.path.exists(file_path):
+            raise ValueError(f"{file_path} of the asset registry is missing")
+
+        file_stat = os.stat(file_path)
+        file_state = [file_stat.st_size, file_stat.st_mtime_ns, checksum]
+        if verified_files.get(file_name) == file_state:
+            continue
+        if calculate_file_checksum(file_path) != checksum:
+            raise ValueError(f"The checksum of {file_path} does not match the asset registry, the file is corrupt "
+                             f"or was changed after it was registered")
+        verified_files[file_name] = file_state
+        newly_verified = True
+
+    if newly_verified:
+        try:  # Written to a temporary file first, as other jobs may read it at the same time
+            temporary_path = f"{verified_files_path}.{os.getpid()}"
+            with open(temporary_path, "w") as outfile:
+                json.dump(verified_files, outfile)
+            os.replace(temporary_path, verified_files_path)
+        except OSError:  # A read-only asset folder is verified again by every process
+            pass
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_asset_folder(name, registry_file=None):
+    """The verified local folder of a registered name, or None for names that are not in the registry."""
+    registry_file = get_registry_file(registry_file)
+    asset = read_asset_registry(registry_file).get(name)
+    if asset is None:
+        return None
+
+    asset_folder = os.path.join(os.path.dirname(os.path.abspath(registry_file)), asset["folder"])
+    verify_asset_files(asset_folder, asset["files"])
+    return asset_folder
+
+
+def load_pretrained(loader_class, name_or_path, **kwargs):
+    """`loader_class.from_pretrained(name_or_path, **kwargs)`, from the asset registry or else the local cache."""
+    asset_folder = resolve_asset_folder(name_or_path)
+    if asset_folder is not None:
+        return loader_class.from_pretrained(asset_folder, **kwargs)
+
+    if os.path.isdir(name_or_path) or os.environ.get("HF_HUB_OFFLINE", "0") not in ("0", ""):
+        return loader_class.from_pretrained(name_or_path, **kwargs)
+
+    try:
+        return loader_class.from_pretrained(name_or_path, local_files_only=True, **kwargs)
+    except OSError:
+        print(f"--> {name_or_path} is not in the asset registry or the local cache, it is downloaded")
+        return loader_class.from_pretrained(name_or_path, **kwargs)
+
+
+def register_asset(name, source=None, registry_file=None):
+    """Copies the files of a model into the registry folder, with a serialized fast tokenizer and their checksums."""
+    from transformers import AutoTokenizer
+
+    registry_file = get_registry_file(registry_file)
+    if source is None:
+        from huggingface_hub import snapshot_download
+        source = snapshot_download(name, allow_patterns=asset_file_patterns)
+
+    asset_folder_name = name.replace("/", "--")
+    asset_folder = os.path.join(os.path.dirname(os.path.abspath(registry_file)), asset_folder_name)
+    os.makedirs(asset_folder, exist_ok=True)
+    for file_name in sorted(os.listdir(source)):
+        if os.path.isfile(os.path.join(source, file_name)) and file_name != verified_files_name:
+            shutil.copyfile(os.path.join(source, file_name), os.path.join(asset_folder, file_name))
+
+    if not os.path.exists(os.path.join(asset_folder, "tokenizer.json")):
+        # Converting the byte-level BPE files to a fast tokenizer takes longer than loading the slow tokenizer, so
+        # it is done once here
+        fast_tokenizer = AutoTokenizer.from_pretrained(asset_folder, use_fast=True)
+        fast_tokenizer.backend_tokenizer.save(os.path.join(asset_folder, "tokenizer.json"))
+
+    file_checksums = {file_name: calculate_file_checksum(os.path.join(asset_folder, file_name))
+                      for file_name in sorted(os.listdir(asset_folder))
+                      if os.path.isfile(os.path.join(asset_folder, file_name)) and file_name != verified_files_name}
+
+    assets = read_asset_registry(registry_file)
+    assets[name] = {"folder": asset_folder_name, "files": file_checksums}
+    with open(registry_file, "w") as outfile:
+        json.dump({"assets": assets}, outfile, indent=2)
+    print(f"--> {name} is registered with {len(file_checksums)} files in {asset_folder}")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    asset_registry_file = get_registry_file(args.registry_file)
+
+    if args.command == "add":
+        if args.name is None:
+            parser.error("--name is required for 'add'")
+        register_asset(args.name, args.source, asset_registry_file)
+    elif args.command == "verify":
+        for asset_name, registered_asset in read_asset_registry(asset_registry_file).items():
+            verify_asset_files(os.path.join(os.path.dirname(os.path.abspath(asset_registry_file)),
+                                            registered_asset["folder"]), registered_asset["files"], rehash=True)
+            print(f"--> {asset_name}: OK")
+    else:
+        for asset_name, registered_asset in read_asset_registry(asset_registry_file).items():
+            print(f"{asset_name}: {registered_asset['folder']} ({len(registered_asset['files'])} files)")
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import re
+import time
+import numpy as np
+import torch
+from transformers import BartForConditionalGeneration, BartTokenizer
+from batched_evaluation import BatchedEvaluator
+from cit_generation import create_cit_generation_config
+from dataset_files import (find_dataset_file, join_citing_paper_text, read_dataset_column_names, read_dataset_columns,
+                           read_papers_table)
+from paper_token_store import PaperTokenStore
+
+
+parser = argparse.ArgumentParser(description="Ranks the Trainer checkpoints of a model, and the average of the "
+                                             "weights of its last checkpoints, by Hits@10 on a fixed eval subsample, "
+                                             "and exports the best one.")
+parser.add_argument("--checkpoints_folder", type=str, help="Folder of the checkpoint-<step> folders of one model, "
+                                                           "e.g. ../checkpoints/<model_name>")
+parser.add_argument("--dataset_path", type=str, help="Path to the folder of the dataset the model is trained on")
+parser.add_argument("--export_path", type=str, help="Folder the best model and its tokenizer are saved to, e.g. "
+                                                    "../models/<model_name>")
+parser.add_argument("--max_token_limit", type=int, default=400, help="Max amount allowed for tokens used for training "
+                                                                     "and evaluation")
+parser.add_argument("--num_eval_examples", type=int, default=500, help="Number of eval set examples in the subsample")
+parser.add_argument("--seed", type=int, default=42, help="Seed of the eval subsample")
+parser.add_argument("--batch_size", type=int, default=8, help="Number of inputs generated for at once")
+parser.add_argument("--num_checkpoints", type=int, default=0, help="Number of last checkpoints that are ranked. 0 "
+                                                                   "ranks all of them")
+parser.add_argument("--average_last", type=int, default=3, help="Number of last checkpoints whose weights are "
+                                                                "averaged into an extra candidate. 0 or 1 disables "
+                                                                "averaging")
+parser.add_argument("--export", type=str, default="best", choices=["best", "average"],
+                    help="Which model is exported: the best ranked candidate, or always the averaged weights")
+
+subsample_file_name = "eval_subsample_{num_examples}_{seed}_{max_token_limit}{input_settings_suffix}.npz"
+scores_file_name = "checkpoint_scores.json"
+averaged_candidate_name = "average_of_last_{num_checkpoints}"
+
+
+def find_checkpoints(checkpoints_folder):
+    # checkpoint-<step> folders written by the Trainer, ordered by step
+    checkpoints = []
+    for folder_name in os.listdir(checkpoints_folder):
+        step_match = re.fullmatch(r"checkpoint-([0-9]+)", folder_name)
+        if step_match and os.path.isdir(os.path.join(checkpoints_folder, folder_name)):
+            checkpoints.append((int(step_match.group(1)), os.path.join(checkpoints_folder, folder_name)))
+    return [checkpoint_path for _, checkpoint_path in sorted(checkpoints)]
+
+
+def read_checkpoint_eval_loss(checkpoint_path):
+    # The eval loss that the Trainer logged at the step of the checkpoint, if there is one
+    trainer_state_path = os.path.join(checkpoint_path, "trainer_state.json")
+    if not os.path.exists(trainer_state_path):
+        return None
+    with open(trainer_state_path, "r") as infile:
+        trainer_state = json.load(infile)
+    eval_losses = [log["eval_loss"] for log in trainer_state.get("log_history", [])
+                   if "eval_loss" in log and log.get("step") == trainer_state.get("global_step")]
+    return eval_losses[-1] if eval_losses else None
+
+
+def read_input_settings(model_path):
+    """The citation_input_settings that the global training script saves in the config of its models, or None.
+
+    None stands for string inputs that are tokenized with truncation, as in the base training script and the global
+    one without pretokenized_abstracts.
+    """
+    with open(os.path.join(model_path, "config.json"), "r") as infile:
+        input_settings = json.load(infile).get("citation_input_settings")
+    if input_settings and input_settings["pretokenized_abstracts"]:
+        return input_settings
+    return None
+
+
+def create_input_settings_suffix(input_settings):
+    if input_settings is None:
+        return ""
+    return (f"_{'stored_ids' if input_settings['stored_context_ids'] else 'pretokenized'}"
+            f"_{input_settings['abstract_token_limit']}_{input_settings['context_token_limit']}")
+
+
+def create_eval_inputs(eval_df, papers_table):
+    # The same input strings as fill_mask gets in calc_eval_metrics of the training scripts
+    masked_contexts = [masked_context.replace("OTHERCIT", "") for masked_context in eval_df["masked_cit_context"]]
+    if "citing_title" in eval_df.columns:
+        return [citing_title + " </s> " + citing_abstract + " </s> " + masked_context
+                for citing_title, citing_abstract, masked_context
+                in zip(eval_df["citing_title"].fillna(""), eval_df["citing_abstract"].fillna(""), masked_contexts)]
+    if "citing_id" in eval_df.columns:
+        return [join_citing_paper_text(papers_table, citing_id, masked_context)
+                for citing_id, masked_context in zip(eval_df["citing_id"], masked_contexts)]
+    return masked_contexts
+
+
+def assemble_eval_input_ids(tokenizer, eval_df, papers_table, max_token_limit, input_settings):
+    # The same token ids as the global training script assembles with pretokenized_abstracts (and stored_context_ids)
+    paper_token_store = PaperTokenStore(tokenizer, abstract_token_limit=input_settings["abstract_token_limit"],
+                                        context_token_limit=input_settings["context_token_limit"])
+    examples = {column: list(eval_df[column]) for column in eval_df.columns if column != "masked_token_target"}
+    examples["masked_cit_context"] = [masked_context.replace("OTHERCIT", "")
+                                      for masked_context in examples["masked_cit_context"]]
+    return np.array(paper_token_store.assemble_examples(examples, papers_table, max_token_limit)["input_ids"],
+                    dtype=np.int32)
+
+
+def load_eval_subsample(tokenizer, dataset_folder, cache_folder, num_examples, seed, max_token_limit,
+                        input_settings=None):
+    """Token ids and targets of a random eval subsample, tokenized once and cached in cache_folder.
+
+    The subsample only depends on the eval set, the seed and its size, so every checkpoint of a model, and every run
+    of this tool, is ranked on the same examples. The inputs are built as in training, see read_input_settings.
+    """
+    cache_path = os.path.join(cache_folder, subsample_file_name.format(
+        num_examples=num_examples, seed=seed, max_token_limit=max_token_limit,
+        input_settings_suffix=create_input_settings_suffix(input_settings)))
+    eval_dataset_path = find_dataset_file(dataset_folder, "context_dataset_eval")
+    if os.path.exists(cache_path):
+        eval_subsample = np.load(cache_path)
+        if str(eval_subsample["eval_dataset_path"]) == os.path.abspath(eval_dataset_path):
+            print(f"--> Eval subsample is loaded from {cache_path}")
+            return torch.from_numpy(eval_subsample["input_ids"].astype(np.int64)), eval_subsample["targets"].tolist()
+
+    column_names = read_dataset_column_names(eval_dataset_path)
+    columns = [column for column in ['citing_title', 'citing_abstract', 'citing_id', 'masked_cit_context',
+                                     'masked_token_target'] if column in column_names]
+    if input_settings is not None and input_settings["stored_context_ids"]:
+        if "context_token_ids" not in column_names:
+            raise ValueError(f"The model is trained with stored_context_ids, but {eval_dataset_path} has no "
+                             f"context_token_ids column")
+        columns.append("context_token_ids")
+    eval_df = read_dataset_columns(eval_dataset_path, columns, dtype=str)
+    rng = np.random.default_rng(seed)
+    eval_df = eval_df.iloc[np.sort(rng.choice(len(eval_df), min(num_examples, len(eval_df)), replace=False))]
+
+    papers_table = read_papers_table(dataset_folder) if "citing_id" in columns else None
+    if input_settings is None:
+        input_ids = tokenizer(create_eval_inputs(eval_df, papers_table), max_length=max_token_limit, truncation=True,
+                              padding="max_length", return_tensors="np")["input_ids"].astype(np.int32)
+    else:
+        input_ids = assemble_eval_input_ids(tokenizer, eval_df, papers_table, max_token_limit, input_settings)
+    targets = list(eval_df["masked_token_target"])
+    np.savez(cache_path, input_ids=input_ids, targets=np.array(targets),
+             eval_dataset_path=os.path.abspath(eval_dataset_path))
+    print(f"--> Eval subsample of {len(targets)} examples is cached to {cache_path}")
+    return torch.from_numpy(input_ids.astype(np.int64)), targets
+
+
+def average_checkpoint_weights(checkpoint_paths):
+    # Uniform average of the floating point weights, accumulated in float32 one checkpoint at a time. Integer buffers
+    # are taken from the last checkpoint.
+    averaged_model = None
+    weight_sums = {}
+    for checkpoint_path in checkpoint_paths:
+        model = BartForConditionalGeneration.from_pretrained(checkpoint_path)
+        for name, tensor in model.state_dict().items():
+            if tensor.is_floating_point():
+                weight_sums[name] = weight_sums.get(name, 0) + tensor.float()
+        averaged_model = model
+
+    averaged_state_dict = averaged_model.state_dict()
+    for name, weight_sum in weight_sums.items():
+        averaged_state_dict[name] = (weight_sum / len(checkpoint_paths)).to(averaged_state_dict[name].dtype)
+    averaged_model.load_state_dict(averaged_state_dict)
+    return averaged_model
+
+
+def evaluate_model(model, tokenizer, input_ids, targets, batch_size):
+    model.eval()
+    evaluator = BatchedEvaluator(model, tokenizer, create_cit_generation_config(model), batch_size=batch_size)
+    start_time = time.perf_counter()
+    metrics = evaluator.evaluate(input_ids, targets)
+    metrics["evaluation_seconds"] = time.perf_counter() - start_time
+    return metrics
+
+
+def load_scores(scores_path):
+    if not os.path.exists(scores_path):
+        return {}
+    with open(scores_path, "r") as infile:
+        return json.load(infile)
+
+
+def rank_checkpoints(checkpoint_paths, tokenizer, input_ids, targets, batch_size, average_last, scores_path,
+                     subsample_key):
+    """Scores every checkpoint and the averaged weights of the last `average_last` ones on the eval subsample.
+
+    Scores are kept in scores_path per subsample, so a rerun after more epochs only evaluates the new checkpoints
+    (and those that a new training run has overwritten).
+    Returns the candidates ordered by Hits@10, then MRR, and the averaged model if there is one.
+    """
+    all_scores = load_scores(scores_path)
+    scores = all_scores.setdefault(subsample_key, {})
+    candidates = []
+    for checkpoint_path in checkpoint_paths:
+        checkpoint_name = os.path.basename(checkpoint_path)
+        modified_time = os.path.getmtime(checkpoint_path)
+        if scores.get(checkpoint_name, {}).get("modified_time") != modified_time:  # New or overwritten checkpoint
+            print(f"--> Evaluating {checkpoint_name}")
+            model = BartForConditionalGeneration.from_pretrained(checkpoint_path)
+            scores[checkpoint_name] = evaluate_model(model, tokenizer, input_ids, targets, batch_size)
+            scores[checkpoint_name]["trainer_eval_loss"] = read_checkpoint_eval_loss(checkpoint_path)
+            scores[checkpoint_name]["modified_time"] = modified_time
+            with open(scores_path, "w") as outfile:
+                json.dump(all_scores, outfile, indent=2)
+        candidates.append({"name": checkpoint_name, "path": checkpoint_path, **scores[checkpoint_name]})
+
+    averaged_model = None
+    averaged_checkpoints = checkpoint_paths[-average_last:] if average_last > 1 else []
+    if len(averaged_checkpoints) > 1:
+        candidate_name = averaged_candidate_name.format(num_checkpoints=len(averaged_checkpoints))
+        print(f"--> Evaluating the average of {', '.join(os.path.basename(path) for path in averaged_checkpoints)}")
+        averaged_model = average_checkpoint_weights(averaged_checkpoints)
+        candidates.append({"name": candidate_name, "path": None,
+                           "averaged_checkpoints": [os.path.basename(path) for path in averaged_checkpoints],
+                           **evaluate_model(averaged_model, tokenizer, input_ids, targets, batch_size)})
+
+    candidates.sort(key=lambda candidate: (-candidate["hits_at_10"], -candidate["mrr"]))
+    return candidates, averaged_model
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    checkpoint_paths = find_checkpoints(args.checkpoints_folder)
+    if not checkpoint_paths:
+        raise SystemExit(f"No checkpoint-<step> folders in {args.checkpoints_folder}")
+    if args.num_checkpoints:
+        checkpoint_paths = checkpoint_paths[-args.num_checkpoints:]
+    if args.export == "average" and min(args.average_last, len(checkpoint_paths)) < 2:
+        raise SystemExit("--export average needs --average_last and at least 2 checkpoints")
+
+    # Checkpoints trained with other input settings would be ranked on inputs they were not trained on
+    input_settings = read_input_settings(checkpoint_paths[-1])
+    for checkpoint_path in checkpoint_paths:
+        if read_input_settings(checkpoint_path) != input_settings:
+            raise SystemExit(f"{checkpoint_path} is trained with other input settings than {checkpoint_paths[-1]}, "
+                             f"rank them separately with --num_checkpoints")
+
+    # The Trainer saves the tokenizer into every checkpoint
+    tokenizer = BartTokenizer.from_pretrained(checkpoint_paths[-1])
+    input_ids, targets = load_eval_subsample(tokenizer, args.dataset_path, args.checkpoints_folder,
+                                             args.num_eval_examples, args.seed, args.max_token_limit, input_settings)
+    if input_settings is not None:
+        print(f"--> The eval inputs are assembled from token ids as in training: {input_settings}")
+
+    subsample_key = (f"{args.num_eval_examples}_{args.seed}_{args.max_token_limit}"
+                     f"{create_input_settings_suffix(input_settings)}")
+    candidates, averaged_model = rank_checkpoints(checkpoint_paths, tokenizer, input_ids, targets, args.batch_size,
+                                                  args.average_last,
+                                                  os.path.join(args.checkpoints_folder, scores_file_name),
+                                                  subsample_key)
+
+    for rank, candidate in enumerate(candidates, 1):
+        print(f"{rank}. {candidate['name']}: Hits@10 = {candidate['hits_at_10']:.4f}, "
+              f"Exact match = {candidate['exact_match']:.4f}, MRR = {candidate['mrr']:.4f}")
+
+    exported_candidate = candidates[0] if args.export == "best" else \
+        next(candidate for candidate in candidates if candidate["path"] is None)
+    exported_model = averaged_model if exported_candidate["path"] is None else \
+        BartForConditionalGeneration.from_pretrained(exported_candidate["path"])
+    exported_model.save_pretrained(args.export_path)
+    tokenizer.save_pretrained(args.export_path)
+
+    with open(os.path.join(args.export_path, "checkpoint_selection.json"), "w") as outfile:
+        json.dump({"exported": exported_candidate["name"], "num_eval_examples": len(targets), "seed": args.seed,
+                   "candidates": candidates}, outfile, indent=2)
+    print(f"\n--> {exported_candidate['name']} is exported to {args.export_path}")
@@ -0,0 +1,149 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+
+def measure_peak_rss_mb():
+    # On Linux, ru_maxrss keeps the peak of the parent after fork and exec, so a spawned or started process would
+    # report at least the peak of the process that started it. VmHWM is the peak of the current process only.
+    try:
+        with open("/proc/self/status") as infile:
+            for line in infile:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:  # No /proc, e.g. on macOS
+        pass
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+def put_job_result(function, job, result_queue):
+    # A failed job (e.g. bf16 or torch.compile not supported on the host) is reported instead of its result
+    try:
+        result = function(job)
+    except Exception as error:
+        result = {"error": f"{type(error).__name__}: {error}"}
+    result_queue.put(result)
+
+
+def run_in_spawned_process(function, job, poll_seconds=1.0):
+    """`function(job)` in a fresh spawned process, so that its peak RSS and timings belong to this job only.
+
+    A non-daemonic process is used instead of a Pool worker, so that the job can start its own dataloader workers.
+    If the job raises or its process dies, e.g. killed when it ran out of memory, a dict with an "error" message is
+    returned instead of its result.
+    """
+    spawn_context = multiprocessing.get_context("spawn")
+    result_queue = spawn_context.Queue()
+    process = spawn_context.Process(target=put_job_result, args=(function, job, result_queue))
+    process.start()
+    while True:
+        try:
+            result = result_queue.get(timeout=poll_seconds)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # The process ended. Its result may still be in the queue.
+        try:
+            result = result_queue.get(timeout=poll_seconds)
+        except queue.Empty:
+            result = {"error": f"The job process exited with code {process.exitcode} without a result"}
+        break
+    process.join()
+    return result
+
+
+class StageTimer:
+    """Wall-clock time, number of calls, items and tokens of the named stages of a run.
+
+    Stages can be nested, e.g. "tokenization" runs inside "dataset_map", so their shares of the total time can add
+    up to more than 1. With `record_trace`, every stage call is also kept as a Chrome trace event, which
+    chrome://tracing and https://ui.perfetto.dev show as a timeline.
+    """
+
+    def __init__(self, record_trace=False):
+        self.record_trace = record_trace
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        self.open_stages = {}
+        self.trace_events = []
+
+    def start(self, name):
+        self.open_stages[name] = time.perf_counter()
+
+    def stop(self, name, items=0, tokens=0):
+        stop_time = time.perf_counter()
+        start_time = self.open_stages.pop(name)
+        stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0, "tokens": 0})
+        stage["calls"] += 1
+        stage["seconds"] += stop_time - start_time
+        stage["items"] += items
+        stage["tokens"] += tokens
+        stage["peak_rss_mb"] = measure_peak_rss_mb()  # Peak RSS of the process when the stage last ended
+
+        if self.record_trace:
+            self.trace_events.append({"name": name, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                                      "ts": (start_time - self.start_time) * 1e6,
+                                      "dur": (stop_time - start_time) * 1e6})
+
+    @contextlib.contextmanager
+    def stage(self, name, items=0):
+        # Stages whose tokens are only known at their end call start and stop with tokens instead
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name, items=items)
+
+    def report(self):
+        total_seconds = time.perf_counter() - self.start_time
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {**stage, "mean_ms": 1000 * stage["seconds"] / stage["calls"],
+                            "share_of_total": stage["seconds"] / total_seconds}
+            if stage["items"]:
+                stages[name]["items_per_second"] = stage["items"] / stage["seconds"]
+            if stage["tokens"]:
+                stages[name]["tokens_per_second"] = stage["tokens"] / stage["seconds"]
+        return {"total_seconds": total_seconds, "peak_rss_mb": measure_peak_rss_mb(), "stages": stages}
+
+    def format_summary(self):
+        timing_report = self.report()
+        lines = [f"{name}: {stage['seconds']:.2f} s ({stage['share_of_total']:.1%}) in {stage['calls']} calls"
+                 + (f", {stage['tokens_per_second']:.0f} tokens/sec" if "tokens_per_second" in stage else "")
+                 for name, stage in sorted(timing_report["stages"].items(), key=lambda item: -item[1]["seconds"])]
+        lines.append(f"total: {timing_report['total_seconds']:.2f} s, peak RSS {timing_report['peak_rss_mb']:.0f} MB")
+        return "\n".join(lines)
+
+    def write_report(self, report_file, **extra):
+        os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+        with open(report_file, "w") as outfile:
+            json.dump({**extra, **self.report()}, outfile, indent=2)
+
+    def write_chrome_trace(self, trace_file):
+        os.makedirs(os.path.dirname(os.path.abspath(trace_file)), exist_ok=True)
+        with open(trace_file, "w") as outfile:
+            json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, outfile)
+
+
+def create_epoch_timing_callback(stage_timer, num_train_examples):
+    # A Trainer callback that times each training epoch as the "train_epoch" stage
+    from transformers import TrainerCallback
+
+    class EpochTimingCallback(TrainerCallback):
+        def on_epoch_begin(self, args, state, control, **kwargs):
+            stage_timer.start("train_epoch")
+
+        def on_epoch_end(self, args, state, control, **kwargs):
+            stage_timer.stop("train_epoch", items=num_train_examples)
+
+    return EpochTimingCallback()
@@ -1,12 +1,11 @@
-from typing import List, Any
-from datasets import DatasetDict, Dataset
-from transformers import (BartForConditionalGeneration, BartTokenizer, Trainer, TrainingArguments,
-                          BartConfig, GenerationConfig, DataCollatorForSeq2Seq)
-import pandas as pd
 import argparse
+import json
 import math
-from tqdm import tqdm
-import numpy as np
+import os
+import time
+from cpu_threads import add_cpu_thread_arguments, configure_cpu_threads_from_args
+from dataset_files import find_missing_dataset_files
+from stage_timing import StageTimer, create_epoch_timing_callback
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--max_token_limit", type=int, default=400, help="Max amount allowed for tokens used for training "
@@ -25,10 +24,112 @@ parser.add_argument("--auto_find_batch_size", type=bool, default=False, help="Ma
                                                                              "automatically select an appropriate "
                                                                              "batch size")
 parser.add_argument("--skip_training", type=bool, default=False, help="Skips training and directly perform evaluation")
+parser.add_argument("--early_stop_generation", type=bool, default=False, help="Make this flag True to stop beam search "
+                                                                              "once every running beam ends with "
+                                                                              "the year of a citation")
+parser.add_argument("--gradient_accumulation_steps", type=int, default=1, help="Number of batches whose gradients "
+                                                                                "are accumulated before each "
+                                                                                "optimizer step")
+parser.add_argument("--bf16", type=bool, default=False, help="Make this flag True to train with bf16 mixed precision "
+                                                             "(autocast on CPU)")
+parser.add_argument("--torch_compile", type=bool, default=False, help="Make this flag True to compile the model with "
+                                                                      "torch.compile before training")
+parser.add_argument("--dataloader_num_workers", type=int, default=0, help="Number of worker processes that load and "
+                                                                          "collate the training batches")
+parser.add_argument("--disable_pin_memory", type=bool, default=False, help="Make this flag True to load the batches "
+                                                                           "without pinned memory")
+parser.add_argument("--cascade_inference", type=bool, default=False, help="Make this flag True to answer "
+                                                                         "confident inputs with the popularity-prior "
+                                                                         "stage and run beam search only for the "
+                                                                         "others during evaluation")
+parser.add_argument("--cascade_confidence_threshold", type=float, default=0.5, help="Minimum confidence of the "
+                                                                                    "popularity-prior stage to "
+                                                                                    "skip beam search")
+parser.add_argument("--cascade_top_k", type=int, default=1000, help="Number of most frequent training citations "
+                                                                    "that the popularity-prior stage can predict")
+parser.add_argument("--cascade_table_path", type=str, default=None, help="File the citation table of the "
+                                                                         "popularity-prior stage is saved to, or "
+                                                                         "loaded from if it exists")
+parser.add_argument("--teacher_model_path", type=str, default=None, help="Path of a fine-tuned model that a "
+                                                                         "shallower student is distilled from. The "
+                                                                         "student starts from the teacher's weights "
+                                                                         "instead of pretrained_model_path")
+parser.add_argument("--student_encoder_layers", type=int, default=0, help="Number of encoder layers of the student. "
+                                                                          "0 keeps those of the teacher")
+parser.add_argument("--student_decoder_layers", type=int, default=2, help="Number of decoder layers of the student. "
+                                                                          "0 keeps those of the teacher")
+parser.add_argument("--distillation_alpha", type=float, default=0.5, help="Weight of the loss on the teacher's "
+                                                                          "logits, against the loss on the labels")
+parser.add_argument("--distillation_temperature", type=float, default=2.0, help="Softmax temperature of the "
+                                                                                "teacher's and student's logits")
+parser.add_argument("--distillation_top_k", type=int, default=20, help="Number of the teacher's largest logits per "
+                                                                       "target position that the student learns")
+parser.add_argument("--teacher_citation_targets", type=bool, default=False, help="Make this flag True to train the "
+                                                                                "student on the teacher's top beam "
+                                                                                "search citation of each training "
+                                                                                "context instead of its target "
+                                                                                "(sequence-level distillation). This "
+                                                                                "runs beam search over the training "
+                                                                                "set once")
+parser.add_argument("--teacher_targets_file", type=str, default=None, help="JSON file the teacher's citations of "
+                                                                           "the training set are saved to, or loaded "
+                                                                           "from if it exists")
+parser.add_argument("--fast_tokenizer", type=bool, default=False, help="Make this flag True to use the Rust based "
+                                                                       "tokenizer, which loads the serialized "
+                                                                       "tokenizer.json of the asset registry")
+parser.add_argument("--timing_report_file", type=str, default=None, help="JSON file that the time, items and "
+                                                                         "tokens of each stage of the run are written "
+                                                                         "to. Defaults to a timing_report_<time>.json "
+                                                                         "file in the checkpoints folder of the model")
+parser.add_argument("--timing_trace_file", type=str, default=None, help="File that a Chrome trace of the stages is "
+                                                                        "written to, for chrome://tracing or "
+                                                                        "ui.perfetto.dev")
+add_cpu_thread_arguments(parser)
+
+dataset_file_names = ["context_dataset_train", "context_dataset_eval"]
+
+# Replaced by the timer of the run in __main__. Scripts loaded as modules, e.g. by the benchmarks, record into this one.
+stage_timer = StageTimer()
+
+if __name__ == '__main__':
+    # --help, invalid arguments and missing dataset files exit here, before the slow imports of torch, transformers
+    # and datasets below
+    args = parser.parse_args()
+    if args.dataset_path is None:
+        parser.error("--dataset_path is required")
+    missing_dataset_files = find_missing_dataset_files(args.dataset_path, dataset_file_names)
+    if missing_dataset_files:
+        parser.error(f"{', '.join(missing_dataset_files)} (.csv or .parquet) not found in {args.dataset_path}")
+    if args.model_name is None and not args.skip_training:
+        parser.error("--model_name is required for training")
+    if args.teacher_model_path and args.skip_training:
+        # The student is created from the teacher and would be evaluated untrained
+        parser.error("--teacher_model_path can not be combined with --skip_training. Evaluate a trained student with "
+                     "--pretrained_model_path")
+
+    # The timing report of the run starts here, so that it includes the imports
+    stage_timer = StageTimer(record_trace=args.timing_trace_file is not None)
+    stage_timer.start("imports")
+    configure_cpu_threads_from_args(args)
+
+from datasets import DatasetDict, Dataset  # noqa: E402
+from transformers import (BartForConditionalGeneration, BartTokenizer, BartTokenizerFast, Trainer,  # noqa: E402
+                          TrainingArguments, BartConfig, DataCollatorForSeq2Seq, StoppingCriteriaList)
+import pandas as pd  # noqa: E402
+from tqdm import tqdm  # noqa: E402
+import numpy as np  # noqa: E402
+from batched_evaluation import compare_pred_with_correct_value, select_top_predictions  # noqa: E402
+from cascade_prediction import CascadePredictor, create_popularity_prior_stage  # noqa: E402
+from cit_generation import CitationStoppingCriteria, create_cit_generation_config  # noqa: E402
+from dataset_files import find_dataset_file, read_dataset_columns  # noqa: E402
+from distillation import (DistillationTrainer, create_student_model, predict_teacher_citations,  # noqa: E402
+                          replace_targets_with_teacher_citations)
+from pretrained_assets import load_pretrained  # noqa: E402
 
 
 # Preprocessing function
 def preprocess_function(examples):
+    stage_timer.start("tokenization")
     inputs = [example.replace("<mask>", "<extra_id_0>", 1).replace("<mask>", "").replace("<extra_id_0>", "<mask>")
               for example in examples["masked_cit_context"]]
     targets = [example for example in examples["masked_token_target"]]
@@ -36,11 +137,16 @@ def preprocess_function(examples):
     model_inputs = tokenizer(inputs, max_length=max_token_limit, truncation=True, padding="max_length")
     labels = tokenizer(targets, max_length=max_token_limit, truncation=True, padding="max_length")
     model_inputs["labels"] = labels["input_ids"]
+    stage_timer.stop("tokenization", items=len(targets), tokens=sum(map(sum, model_inputs["attention_mask"])))
     return model_inputs
 
 
+# Only these columns of the dataset files are loaded
+dataset_columns = ['masked_cit_context', 'masked_token_target']
+
+
 def read_dataset():
-    train_df = pd.read_csv(train_dataset_path)
+    train_df = read_dataset_columns(train_dataset_path, dataset_columns)
     train_set = []
 
     for _, i in train_df.iterrows():
@@ -50,7 +156,7 @@ def read_dataset():
 
         train_set.append(temp_dict)
 
-    eval_df = pd.read_csv(eval_dataset_path)
+    eval_df = read_dataset_columns(eval_dataset_path, dataset_columns)
     eval_set = []
 
     for _, i in eval_df.iterrows():
@@ -63,88 +169,48 @@ def read_dataset():
     return train_set, eval_set
 
 
-def fill_mask(sentence):
-    input_ids = tokenizer.encode(sentence.replace("<mask>", "<extra_id_0>").replace("<mask>", "").
-                                 replace("<extra_id_0>", "<mask>"),
-                                 return_tensors="pt", max_length=max_token_limit, truncation=True,
-                                 padding="max_length").to("cuda")
-
-    outputs = model.generate(
-        input_ids,
-        generation_config=cit_generation_config
-    )
+def create_fill_mask_input_ids(sentence):
+    return tokenizer.encode(sentence.replace("<mask>", "<extra_id_0>").replace("<mask>", "").
+                            replace("<extra_id_0>", "<mask>"),
+                            return_tensors="pt", max_length=max_token_limit, truncation=True,
+                            padding="max_length")
 
+
+def create_example_input_ids(example):
+    return create_fill_mask_input_ids(example["masked_cit_context"])
+
+
+def fill_mask(sentence):
+    stage_timer.start("encode")
+    input_ids = create_fill_mask_input_ids(sentence).to(model.device)
+    stage_timer.stop("encode", items=1)
+
+    stage_timer.start("generate")
+    if early_stop_generation:
+        outputs = model.generate(
+            input_ids,
+            generation_config=cit_generation_config,
+            stopping_criteria=StoppingCriteriaList([cit_stopping_criteria])
+        )
+    else:
+        outputs = model.generate(
+            input_ids,
+            generation_config=cit_generation_config
+        )
+    decoder_step_counts.append(outputs.shape[-1] - 1)  # The first position is the decoder start token.
+    # The tokens are the decoder positions of all returned sequences
+    stage_timer.stop("generate", items=1, tokens=outputs.numel() - outputs.shape[0])
+
+    stage_timer.start("decode")
     predictions = []
     for output in outputs:
         decoded_output = tokenizer.decode(output, skip_special_tokens=True)
         temp_prediction = decoded_output.strip()
         predictions.append(temp_prediction)
+    stage_timer.stop("decode", items=len(outputs))
 
-    # Get unique predictions
-    unique_predictions: List[Any] = list(dict.fromkeys(predictions))  # Remove duplicates while preserving order
-
-    # Print the top 10 predictions
-    # for i, pred in enumerate(unique_predictions, 1):
-    #     print(f"Prediction {i}: {pred} \n\n")
-
-    last_item_of_predictions = unique_predictions[-1]
-    while len(unique_predictions) < 10:
-        unique_predictions.append(last_item_of_predictions)
-
-    return unique_predictions[:10]
-
-
-def compare_pred_with_correct_value(predictions, ground_truth):
-    hits_at_10_flag = False
-    exact_match_flag = False
-    temp_reciprocal_rank = 0
-
-    if "and" in ground_truth:
-        truth_tokens = ground_truth.replace(" and ", ", ").replace(",", "").split()
-        if len(truth_tokens) == 3:
-            for p_idx in range(len(predictions)):
-                if (truth_tokens[0] in predictions[p_idx] and truth_tokens[1] in predictions[p_idx] and
-                        truth_tokens[2] in predictions[p_idx]):
-                    # print(f"\n---> Ground truth citation: {ground_truth}\nCorrect Pred =====>> {p}\n")
-                    hits_at_10_flag = True
-                    temp_reciprocal_rank = 1 / (p_idx + 1)
-                    break
-            if (truth_tokens[0] in predictions[0] and truth_tokens[1] in predictions[0] and
-                    truth_tokens[2] in predictions[0]):
-                exact_match_flag = True
-
-    elif "et al" in ground_truth:
-        truth_tokens = ground_truth.replace(" et al.,", "").split()
-        for p_idx in range(len(predictions)):
-            if truth_tokens[0] in predictions[p_idx] and truth_tokens[1] in predictions[p_idx]:
-                # print(f"\n---> Ground truth citation: {ground_truth}\nCorrect Pred =====>> {p}\n")
-                hits_at_10_flag = True
-                temp_reciprocal_rank = 1 / (p_idx + 1)
-                break
-        if truth_tokens[0] in predictions[0] and truth_tokens[1] in predictions[0]:
-            exact_match_flag = True
-    else:
-        truth_tokens = ground_truth.replace(",", "").split()
-        for p_idx in range(len(predictions)):
-            if truth_tokens[0] in predictions[p_idx] and truth_tokens[1] in predictions[p_idx]:
-                # print(f"\n---> Ground truth citation: {ground_truth}\nCorrect Pred =====>> {p}\n")
-                hits_at_10_flag = True
-                temp_reciprocal_rank = 1 / (p_idx + 1)
-                break
-        if truth_tokens[0] in predictions[0] and truth_tokens[1] in predictions[0]:
-            exact_match_flag = True
-
-    if hits_at_10_flag is False:
-        for p_idx in range(len(predictions)):
-            if predictions[p_idx] == ground_truth:
-                hits_at_10_flag = True
-                temp_reciprocal_rank = 1 / (p_idx + 1)
-                break
-
-    if predictions[0] == ground_truth:
-        exact_match_flag = True
-
-    return hits_at_10_flag, exact_match_flag, temp_reciprocal_rank
+    # The top 10 unique predictions, cut as in BatchedEvaluator, so select_checkpoints.py reports the same metrics
+    return select_top_predictions(predictions)
 
 
 def calc_eval_metrics(val_dataset):
@@ -157,10 +223,21 @@ def calc_eval_metrics(val_dataset):
         masked_cit_context = e["masked_cit_context"]
         target_token = e["masked_token_target"]
 
-        temp_predictions = fill_mask(masked_cit_context)
+        if cascade_predictor is None:
+            temp_predictions = fill_mask(masked_cit_context)
+        else:
+            temp_predictions, prediction_stage = cascade_predictor.predict(create_example_input_ids(e),
+                                                                           lambda: fill_mask(masked_cit_context))
         # print(f"\n--> Ground truth cit = {target_token}\n\n")
+        stage_timer.start("compare")
         hits_at_10_flag, exact_match_flag, temp_reciprocal_rank = compare_pred_with_correct_value(temp_predictions,
                                                                                                   target_token)
+        stage_timer.stop("compare", items=1)
+        if cascade_predictor is not None:
+            first_stage_hit_flag, first_stage_exact_match_flag, _ = compare_pred_with_correct_value(
+                cascade_predictor.last_first_stage_predictions, target_token)
+            cascade_predictor.record_metrics(prediction_stage, hits_at_10_flag, exact_match_flag,
+                                             temp_reciprocal_rank, first_stage_hit_flag, first_stage_exact_match_flag)
         if hits_at_10_flag:
             hit_count += 1
         if exact_match_flag:
@@ -178,9 +255,19 @@ def calc_eval_metrics(val_dataset):
 
     print("\n=======>>> Recall@10 measurement value (between 0 and 1) = ", hit_at_10_metric, "\n")
 
+    if decoder_step_counts:  # Empty if the cascade answered every example without beam search
+        avg_decoder_steps = np.mean(decoder_step_counts)
+        # Only the steps of this run are known. The reduction from early_stop_generation is measured by comparing the
+        # steps of runs with and without it, e.g. the "generation" benchmark of benchmarks/run_benchmarks.py.
+        print("\n=======>>> Average decoder steps per example = ", avg_decoder_steps,
+              f"(at most {cit_generation_config.max_new_tokens})\n")
+
+    if cascade_predictor is not None:
+        print("\n=======>>> Cascade inference per stage = ", json.dumps(cascade_predictor.report(), indent=2), "\n")
+
 
 if __name__ == '__main__':
-    args = parser.parse_args()
+    stage_timer.stop("imports")
 
     max_token_limit = args.max_token_limit
     custom_model_name = args.model_name
@@ -188,8 +275,8 @@ if __name__ == '__main__':
     model_save_location = f"{args.models_path}/{custom_model_name}"
 
     dataset_folder = args.dataset_path
-    train_dataset_path = dataset_folder + "/context_dataset_train.csv"
-    eval_dataset_path = dataset_folder + "/context_dataset_eval.csv"
+    train_dataset_path = find_dataset_file(dataset_folder, "context_dataset_train")
+    eval_dataset_path = find_dataset_file(dataset_folder, "context_dataset_eval")
 
     num_epochs = args.num_epochs
 
@@ -202,28 +289,21 @@ if __name__ == '__main__':
 
     skip_training = args.skip_training
 
+    early_stop_generation = args.early_stop_generation
+
     # Initialize the config
-    config = BartConfig.from_pretrained(pretrained_model_name_or_path, attention_dropout=0.123)
+    config = load_pretrained(BartConfig, pretrained_model_name_or_path, attention_dropout=0.123)
 
     # Initialize the tokenizer
-    tokenizer = BartTokenizer.from_pretrained(pretrained_model_name_or_path, truncation=True,
-                                              padding='max_length', model_max_length=max_token_limit)
-
-    # Set up the model
-    model = BartForConditionalGeneration.from_pretrained(pretrained_model_name_or_path, config=config)
+    stage_timer.start("load_tokenizer")
+    tokenizer = load_pretrained(BartTokenizerFast if args.fast_tokenizer else BartTokenizer,
+                                pretrained_model_name_or_path, truncation=True, padding='max_length',
+                                model_max_length=max_token_limit)
+    stage_timer.stop("load_tokenizer")
 
-    cit_generation_config = GenerationConfig.from_model_config(model.config)
-
-    cit_generation_config.max_new_tokens = 25
-    cit_generation_config.do_sample = False
-    cit_generation_config.top_k = 50
-    cit_generation_config.num_return_sequences = 20
-    cit_generation_config.early_stopping = False
-    cit_generation_config.num_beams = 20
-    cit_generation_config.forced_bos_token_id = 0
-
-    cit_generation_config.num_beam_groups = 10
-    cit_generation_config.diversity_penalty = 1.5
+    # Beam search stops as soon as every running beam holds a complete citation when early_stop_generation is set.
+    cit_stopping_criteria = CitationStoppingCriteria(tokenizer)
+    decoder_step_counts = []
 
     # Example data to view dataset structure
     """data = {
@@ -240,7 +320,20 @@ if __name__ == '__main__':
         ]
     }"""
 
+    stage_timer.start("read_dataset")
     train_dataset, eval_dataset = read_dataset()
+    stage_timer.stop("read_dataset", items=len(train_dataset) + len(eval_dataset))
+
+    teacher_model = None
+    if args.teacher_model_path:
+        teacher_model = load_pretrained(BartForConditionalGeneration, args.teacher_model_path)
+
+    if teacher_model is not None and args.teacher_citation_targets and not skip_training:
+        teacher_predictions = predict_teacher_citations(teacher_model, args.teacher_model_path, tokenizer,
+                                                        train_dataset, create_example_input_ids,
+                                                        args.teacher_targets_file,
+                                                        batch_size=train_and_eval_batch_sizes)
+        train_dataset = replace_targets_with_teacher_citations(train_dataset, teacher_predictions)
 
     data = {
         "train": train_dataset,
@@ -257,7 +350,21 @@ if __name__ == '__main__':
     })
 
     # Preprocess the datasets
+    stage_timer.start("dataset_map")
     tokenized_datasets = dataset.map(preprocess_function, batched=True)
+    stage_timer.stop("dataset_map", items=sum(dataset.num_rows.values()))
+
+    # Set up the model. It is loaded once the datasets are tokenized, so that errors in the dataset show up without
+    # waiting for the model, and the model's memory is not held while the datasets are built.
+    stage_timer.start("load_model")
+    if teacher_model is not None:
+        model = create_student_model(teacher_model, num_encoder_layers=args.student_encoder_layers,
+                                     num_decoder_layers=args.student_decoder_layers)
+    else:
+        model = load_pretrained(BartForConditionalGeneration, pretrained_model_name_or_path, config=config)
+    stage_timer.stop("load_model")
+
+    cit_generation_config = create_cit_generation_config(model)
 
     data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, model=model)
 
@@ -271,7 +378,12 @@ if __name__ == '__main__':
         logging_strategy="epoch",
         warmup_steps=warmup_steps,
         save_strategy="epoch",
-        save_total_limit=5
+        save_total_limit=5,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        bf16=args.bf16,
+        torch_compile=args.torch_compile,
+        dataloader_num_workers=args.dataloader_num_workers,
+        dataloader_pin_memory=not args.disable_pin_memory
     )
 
     if auto_find_batch_size_flag is True:
@@ -280,23 +392,51 @@ if __name__ == '__main__':
         training_args.per_device_train_batch_size = train_and_eval_batch_sizes
         training_args.per_device_eval_batch_size = train_and_eval_batch_sizes
 
-    trainer = Trainer(
+    # With a teacher, the training loss also includes the teacher's top-k logits
+    distillation_kwargs = {} if teacher_model is None else {"teacher_model": teacher_model,
+                                                            "alpha": args.distillation_alpha,
+                                                            "temperature": args.distillation_temperature,
+                                                            "top_k": args.distillation_top_k}
+    trainer = (Trainer if teacher_model is None else DistillationTrainer)(
+        **distillation_kwargs,
         model=model,
         args=training_args,
         train_dataset=tokenized_datasets["train"],
         eval_dataset=tokenized_datasets["eval"],
         data_collator=data_collator,
-        tokenizer=tokenizer
+        tokenizer=tokenizer,
+        callbacks=[create_epoch_timing_callback(stage_timer, len(tokenized_datasets["train"]))]
     )
 
     if not skip_training:
-        trainer.train()
+        with stage_timer.stage("train"):
+            trainer.train()
 
         trainer.save_model(model_save_location)
         tokenizer.save_pretrained(model_save_location)
 
-    eval_results = trainer.evaluate()
+    with stage_timer.stage("trainer_evaluate"):
+        eval_results = trainer.evaluate()
     print(f"\n*****************\n======>> Eval loss after fine-tuning: {eval_results['eval_loss']}\n"
           f"======>> Perplexity after fine-tuning: {math.exp(eval_results['eval_loss']):.2f}\n\n")
 
-    calc_eval_metrics(eval_dataset)
+    cascade_predictor = None
+    if args.cascade_inference:
+        model.eval()
+        popularity_prior_stage = create_popularity_prior_stage(model, data["train"], create_example_input_ids,
+                                                               pretrained_model_name_or_path if skip_training
+                                                               else model_save_location,
+                                                               table_path=args.cascade_table_path,
+                                                               top_k=args.cascade_top_k)
+        cascade_predictor = CascadePredictor(popularity_prior_stage,
+                                             confidence_threshold=args.cascade_confidence_threshold)
+
+    with stage_timer.stage("calc_eval_metrics", items=len(eval_dataset)):
+        calc_eval_metrics(eval_dataset)
+
+    timing_report_file = args.timing_report_file or os.path.join(checkpoints_location,
+                                                                 f"timing_report_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    stage_timer.write_report(timing_report_file, settings=vars(args))
+    print(f"\n=======>>> Time per stage (written to {timing_report_file}):\n{stage_timer.format_summary()}\n")
+    if args.timing_trace_file:
+        stage_timer.write_chrome_trace(args.timing_trace_file)
@@ -1,12 +1,10 @@
-from typing import List, Any
-from datasets import DatasetDict, Dataset
-from transformers import (BartForConditionalGeneration, BartTokenizer, TrainingArguments,
-                          BartConfig, GenerationConfig, DataCollatorForSeq2Seq)  # Trainer
-import pandas as pd
 import argparse
-# import math
-from tqdm import tqdm
-# import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train"))
+from cpu_threads import add_cpu_thread_arguments, configure_cpu_threads_from_args  # noqa: E402
+from dataset_files import find_missing_dataset_files  # noqa: E402
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--max_token_limit", type=int, default=400, help="Max amount allowed for tokens used for training "
@@ -28,6 +26,34 @@ parser.add_argument("--skip_training", type=bool, default=False, help="Skips tra
 parser.add_argument("--dataset_read_limit", type=int, default=300, help="Maximum number of rows to read from dataset.")
 parser.add_argument("--first_index_to_generate", type=int, default=50, help="First index to generate from the dataset.")
 parser.add_argument("--last_index_to_generate", type=int, default=52, help="Last index to generate from the dataset.")
+parser.add_argument("--fast_tokenizer", type=bool, default=False, help="Make this flag True to use the Rust based "
+                                                                       "tokenizer, which loads the serialized "
+                                                                       "tokenizer.json of the asset registry")
+add_cpu_thread_arguments(parser)
+
+dataset_file_names = ["context_dataset_train", "context_dataset_eval"]
+
+if __name__ == '__main__':
+    # --help, invalid arguments and missing dataset files exit here, before the slow imports of torch, transformers
+    # and datasets below
+    args = parser.parse_args()
+    if args.dataset_path is None:
+        parser.error("--dataset_path is required")
+    missing_dataset_files = find_missing_dataset_files(args.dataset_path, dataset_file_names)
+    if missing_dataset_files:
+        parser.error(f"{', '.join(missing_dataset_files)} (.csv or .parquet) not found in {args.dataset_path}")
+    configure_cpu_threads_from_args(args)
+
+from typing import List, Any  # noqa: E402
+from datasets import DatasetDict, Dataset  # noqa: E402
+from transformers import (BartForConditionalGeneration, BartTokenizer, BartTokenizerFast,  # noqa: E402
+                          TrainingArguments, BartConfig, GenerationConfig, DataCollatorForSeq2Seq)  # Trainer
+import pandas as pd  # noqa: E402
+# import math
+from tqdm import tqdm  # noqa: E402
+# import numpy as np
+from dataset_files import find_dataset_file, read_dataset_columns  # noqa: E402
+from pretrained_assets import load_pretrained  # noqa: E402
 
 
 # Preprocessing function
@@ -42,8 +68,12 @@ def preprocess_function(examples):
     return model_inputs
 
 
+# Only these columns of the dataset files are loaded
+dataset_columns = ['citation_context', 'masked_cit_context', 'masked_token_target']
+
+
 def read_dataset():
-    train_df = pd.read_csv(train_dataset_path, nrows=dataset_read_limit)
+    train_df = read_dataset_columns(train_dataset_path, dataset_columns, nrows=dataset_read_limit)
     train_set = []
 
     for _, i in train_df.iterrows():
@@ -53,7 +83,7 @@ def read_dataset():
 
         train_set.append(temp_dict)
 
-    eval_df = pd.read_csv(eval_dataset_path, nrows=dataset_read_limit)
+    eval_df = read_dataset_columns(eval_dataset_path, dataset_columns, nrows=dataset_read_limit)
     eval_set = []
 
     dataset_index = -1
@@ -197,16 +227,14 @@ def calc_eval_metrics(val_dataset):
 
 
 if __name__ == '__main__':
-    args = parser.parse_args()
-
     max_token_limit = args.max_token_limit
     custom_model_name = args.model_name
     checkpoints_location = f"{args.checkpoints_path}/{custom_model_name}"
     model_save_location = f"{args.models_path}/{custom_model_name}"
 
     dataset_folder = args.dataset_path
-    train_dataset_path = dataset_folder + "/context_dataset_train.csv"
-    eval_dataset_path = dataset_folder + "/context_dataset_eval.csv"
+    train_dataset_path = find_dataset_file(dataset_folder, "context_dataset_train")
+    eval_dataset_path = find_dataset_file(dataset_folder, "context_dataset_eval")
 
     num_epochs = args.num_epochs
 
@@ -224,27 +252,12 @@ if __name__ == '__main__':
     last_index_to_generate = args.last_index_to_generate
 
     # Initialize the config
-    config = BartConfig.from_pretrained(pretrained_model_name_or_path, attention_dropout=0.123)
+    config = load_pretrained(BartConfig, pretrained_model_name_or_path, attention_dropout=0.123)
 
     # Initialize the tokenizer
-    tokenizer = BartTokenizer.from_pretrained(pretrained_model_name_or_path, truncation=True,
-                                              padding='max_length', model_max_length=max_token_limit)
-
-    # Set up the model
-    model = BartForConditionalGeneration.from_pretrained(pretrained_model_name_or_path, config=config)
-
-    cit_generation_config = GenerationConfig.from_model_config(model.config)
-
-    cit_generation_config.max_new_tokens = 25
-    cit_generation_config.do_sample = False
-    cit_generation_config.top_k = 50
-    cit_generation_config.num_return_sequences = 20
-    cit_generation_config.early_stopping = False
-    cit_generation_config.num_beams = 20
-    cit_generation_config.forced_bos_token_id = 0
-
-    cit_generation_config.num_beam_groups = 10
-    cit_generation_config.diversity_penalty = 1.5
+    tokenizer = load_pretrained(BartTokenizerFast if args.fast_tokenizer else BartTokenizer,
+                                pretrained_model_name_or_path, truncation=True, padding='max_length',
+                                model_max_length=max_token_limit)
 
     # Example data to view dataset structure
     """data = {
@@ -280,6 +293,23 @@ if __name__ == '__main__':
     # Preprocess the datasets
     tokenized_datasets = dataset.map(preprocess_function, batched=True)
 
+    # Set up the model. It is loaded once the datasets are tokenized, so that errors in the dataset show up without
+    # waiting for the model.
+    model = load_pretrained(BartForConditionalGeneration, pretrained_model_name_or_path, config=config)
+
+    cit_generation_config = GenerationConfig.from_model_config(model.config)
+
+    cit_generation_config.max_new_tokens = 25
+    cit_generation_config.do_sample = False
+    cit_generation_config.top_k = 50
+    cit_generation_config.num_return_sequences = 20
+    cit_generation_config.early_stopping = False
+    cit_generation_config.num_beams = 20
+    cit_generation_config.forced_bos_token_id = 0
+
+    cit_generation_config.num_beam_groups = 10
+    cit_generation_config.diversity_penalty = 1.5
+
     data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, model=model)
 
     training_args = TrainingArguments(
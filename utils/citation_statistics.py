@@ -0,0 +1,262 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train"))
+from dataset_files import find_dataset_file, iter_dataset_column_chunks, read_dataset_column_names  # noqa: E402
+from streaming_sketches import CountMinSketch, HyperLogLog, TDigest  # noqa: E402
+
+
+parser = argparse.ArgumentParser(description="Citation statistics of preprocessed datasets: appearance counts of "
+                                             "each citation, their frequencies, quantiles and a Zipf fit.")
+parser.add_argument("--dataset_paths", type=str, nargs="+", help="Dataset files, dataset folders, or folders that "
+                                                                 "contain dataset folders")
+parser.add_argument("--dataset_file_name", type=str, default="context_dataset", help="Name of the dataset file inside "
+                                                                                     "the dataset folders, without "
+                                                                                     "its extension")
+parser.add_argument("--output_file", type=str, default="citation_statistics.json", help="Path of the JSON file that "
+                                                                                        "the statistics are written "
+                                                                                        "to")
+parser.add_argument("--chunk_size", type=int, default=500000, help="Number of rows read at once")
+parser.add_argument("--include_appearance_counts", type=bool, default=False, help="Make this flag True to also write "
+                                                                                  "the appearance count of every "
+                                                                                  "citation")
+parser.add_argument("--approximate", type=bool, default=False, help="Make this flag True to compute approximate "
+                                                                    "statistics in one streaming pass with bounded "
+                                                                    "memory: heavy-hitter citations, the number of "
+                                                                    "unique citations and token length quantiles")
+parser.add_argument("--num_heavy_hitters", type=int, default=20, help="Number of most frequent citations reported by "
+                                                                      "the approximate statistics")
+parser.add_argument("--check_against_exact", type=bool, default=False, help="Make this flag True to also compute the "
+                                                                            "exact statistics and check that the "
+                                                                            "approximate ones are within their error "
+                                                                            "bounds (for small datasets)")
+
+quantile_levels = [0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+
+
+def find_dataset_files(dataset_path, dataset_file_name="context_dataset"):
+    # A dataset file, a dataset folder, or a folder of dataset folders -> {dataset name: dataset file path}
+    if os.path.isfile(dataset_path):
+        return {os.path.splitext(os.path.basename(dataset_path))[0]: dataset_path}
+
+    dataset_file_path = find_dataset_file(dataset_path, dataset_file_name)
+    if os.path.exists(dataset_file_path):
+        return {os.path.basename(os.path.normpath(dataset_path)): dataset_file_path}
+
+    dataset_files = {}
+    for folder_name in sorted(os.listdir(dataset_path)):
+        dataset_file_path = find_dataset_file(os.path.join(dataset_path, folder_name), dataset_file_name)
+        if os.path.exists(dataset_file_path):
+            dataset_files[folder_name] = dataset_file_path
+    return dataset_files
+
+
+def count_citation_appearances(dataset_file_path, chunk_size=500000):
+    # Appearance count of each masked_token_target, most frequent first. Only this column is read, chunk by chunk,
+    # and the partial counts are merged every few chunks to keep the memory bounded by the number of citations.
+    merged_counts = pd.Series(dtype="int64")
+    partial_counts = []
+    for chunk_df in iter_dataset_column_chunks(dataset_file_path, ["masked_token_target"], chunk_size, dtype=str):
+        partial_counts.append(chunk_df["masked_token_target"].value_counts())
+        if len(partial_counts) == 16:
+            merged_counts = pd.concat([merged_counts] + partial_counts).groupby(level=0).sum()
+            partial_counts = []
+    if partial_counts:
+        merged_counts = pd.concat([merged_counts] + partial_counts).groupby(level=0).sum()
+
+    return merged_counts.astype("int64").sort_values(ascending=False, kind="stable")
+
+
+def fit_zipf_exponent(appearance_counts):
+    # Least squares fit of log(count) = log(C) - s * log(rank) on the rank-frequency curve
+    counts = np.sort(np.asarray(appearance_counts, dtype=np.float64))[::-1]
+    if len(counts) < 2:
+        return {"exponent": None, "r_squared": None}
+
+    log_ranks = np.log(np.arange(1, len(counts) + 1))
+    log_counts = np.log(counts)
+    slope, intercept = np.polyfit(log_ranks, log_counts, 1)
+    residuals = log_counts - (slope * log_ranks + intercept)
+    total_variance = np.sum((log_counts - log_counts.mean()) ** 2)
+    r_squared = 1.0 - np.sum(residuals ** 2) / total_variance if total_variance > 0 else 1.0
+    return {"exponent": float(-slope), "r_squared": float(r_squared)}
+
+
+def calculate_citation_statistics(appearance_counts, more_than=75, less_than=7):
+    counts = appearance_counts.to_numpy()
+    frequency_of_frequency = appearance_counts.value_counts().sort_index(ascending=False)
+
+    return {
+        "num_contexts": int(counts.sum()),
+        "num_citations": int(len(counts)),
+        "max_appearance_count": int(counts.max()),
+        "most_frequent_citation": str(appearance_counts.index[0]),
+        "min_appearance_count": int(counts.min()),
+        "least_frequent_citation": str(appearance_counts.index[-1]),
+        "mean_appearance_count": float(counts.mean()),
+        "median_appearance_count": float(np.median(counts)),
+        "appearance_count_quantiles": {str(level): float(value)
+                                       for level, value in zip(quantile_levels, np.quantile(counts, quantile_levels))},
+        f"citations_with_more_than_{more_than}_appearances": int((counts > more_than).sum()),
+        f"citations_with_less_than_{less_than}_appearances": int((counts < less_than).sum()),
+        "citations_with_only_1_appearance": int((counts == 1).sum()),
+        "appearance_count_frequencies": {str(count): int(frequency)
+                                         for count, frequency in frequency_of_frequency.items()},
+        "zipf_fit": fit_zipf_exponent(counts),
+    }
+
+
+def count_whitespace_tokens(texts):
+    return texts.fillna("").str.count(r"\S+").to_numpy()
+
+
+def summarize_length_digest(length_digest):
+    return {"min": length_digest.min_value, "max": length_digest.max_value,
+            "quantiles": {str(level): length_digest.quantile(level) for level in quantile_levels},
+            "rank_error_bounds": {str(level): length_digest.rank_error_bound(level) for level in quantile_levels}}
+
+
+def calculate_approximate_statistics(dataset_file_path, chunk_size=500000, num_heavy_hitters=20):
+    # One streaming pass with fixed-size sketches. Token lengths are counted in whitespace-separated tokens, for
+    # the contexts and for the citing abstracts of global datasets (per paper if they are in a papers table).
+    dataset_column_names = read_dataset_column_names(dataset_file_path)
+    length_columns = {"context": "masked_cit_context", "abstract": "citing_abstract"}
+    length_columns = {name: column for name, column in length_columns.items() if column in dataset_column_names}
+
+    count_min_sketch = CountMinSketch(num_candidates=max(1000, 10 * num_heavy_hitters))
+    hyper_log_log = HyperLogLog()
+    length_digests = {name: TDigest() for name in length_columns}
+    num_contexts = 0
+
+    read_columns = ["masked_token_target"] + list(length_columns.values())
+    for chunk_df in iter_dataset_column_chunks(dataset_file_path, read_columns, chunk_size, dtype=str):
+        citation_targets = chunk_df["masked_token_target"]
+        count_min_sketch.update(citation_targets)
+        hyper_log_log.update(citation_targets)
+        num_contexts += int(citation_targets.notna().sum())
+        for name, column in length_columns.items():
+            length_digests[name].update(count_whitespace_tokens(chunk_df[column]))
+
+    papers_table_path = find_dataset_file(os.path.dirname(dataset_file_path), "papers_table")
+    if "abstract" not in length_columns and os.path.exists(papers_table_path):
+        length_digests["abstract"] = TDigest()
+        for chunk_df in iter_dataset_column_chunks(papers_table_path, ["abstract"], chunk_size, dtype=str):
+            length_digests["abstract"].update(count_whitespace_tokens(chunk_df["abstract"]))
+
+    num_citations_estimate = hyper_log_log.estimate()
+    return {
+        "num_contexts": num_contexts,
+        "num_citations_estimate": num_citations_estimate,
+        "num_citations_error_bound": hyper_log_log.error_bound(),
+        "mean_appearance_count_estimate": num_contexts / num_citations_estimate if num_citations_estimate else None,
+        "heavy_hitters": [{"citation": str(citation), "appearance_count_estimate": estimate}
+                          for citation, estimate in count_min_sketch.heavy_hitters(num_heavy_hitters)],
+        "heavy_hitters_error_bound": count_min_sketch.error_bound(),
+        "token_lengths": {name: summarize_length_digest(length_digest)
+                          for name, length_digest in length_digests.items()},
+    }
+
+
+def check_against_exact_statistics(approximate_statistics, dataset_file_path, chunk_size=500000):
+    # Exact numbers of the same dataset, and whether each approximate number is within its error bound
+    exact_appearance_counts = count_citation_appearances(dataset_file_path, chunk_size)
+    checks = {}
+
+    max_overestimate = approximate_statistics["heavy_hitters_error_bound"]["max_overestimate"]
+    heavy_hitter_errors = [heavy_hitter["appearance_count_estimate"] -
+                           int(exact_appearance_counts.get(heavy_hitter["citation"], 0))
+                           for heavy_hitter in approximate_statistics["heavy_hitters"]]
+    exact_top_citations = set(exact_appearance_counts.index[:len(heavy_hitter_errors)])
+    checks["heavy_hitters"] = {
+        "max_count_error": max(heavy_hitter_errors, default=0),
+        "overlap_with_exact_top": len(exact_top_citations & {heavy_hitter["citation"] for heavy_hitter
+                                                             in approximate_statistics["heavy_hitters"]}),
+        "within_bound": all(0 <= error <= max_overestimate for error in heavy_hitter_errors),
+    }
+
+    num_citations = len(exact_appearance_counts)
+    relative_error = abs(approximate_statistics["num_citations_estimate"] - num_citations) / max(num_citations, 1)
+    relative_error_bound = approximate_statistics["num_citations_error_bound"]["relative_error_at_3_sigma"]
+    checks["num_citations"] = {
+        "exact": num_citations, "relative_error": relative_error,
+        "within_bound": relative_error <= relative_error_bound,
+    }
+
+    exact_length_columns = {"context": "masked_cit_context", "abstract": "citing_abstract"}
+    for name, length_summary in approximate_statistics["token_lengths"].items():
+        if exact_length_columns[name] in read_dataset_column_names(dataset_file_path):
+            length_file_path, length_column = dataset_file_path, exact_length_columns[name]
+        else:
+            length_file_path = find_dataset_file(os.path.dirname(dataset_file_path), "papers_table")
+            length_column = "abstract"
+        exact_lengths = np.sort(np.concatenate([count_whitespace_tokens(chunk_df[length_column]) for chunk_df
+                                                in iter_dataset_column_chunks(length_file_path, [length_column],
+                                                                              chunk_size, dtype=str)]))
+        # The rank error of an estimate is the distance of its quantile level to the ranks of its value
+        rank_errors = {}
+        for level, estimate in length_summary["quantiles"].items():
+            lowest_rank = np.searchsorted(exact_lengths, estimate, side="left") / len(exact_lengths)
+            highest_rank = np.searchsorted(exact_lengths, estimate, side="right") / len(exact_lengths)
+            rank_errors[level] = float(max(lowest_rank - float(level), float(level) - highest_rank, 0.0))
+        checks[f"{name}_token_lengths"] = {
+            "exact_quantiles": {str(level): float(value)
+                                for level, value in zip(quantile_levels, np.quantile(exact_lengths, quantile_levels))},
+            "rank_errors": rank_errors,
+            "within_bound": all(rank_errors[level] <= length_summary["rank_error_bounds"][level] +
+                                1 / len(exact_lengths) for level in rank_errors),
+        }
+
+    return checks
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    all_dataset_files = {}
+    for path in args.dataset_paths:
+        all_dataset_files.update(find_dataset_files(path, args.dataset_file_name))
+    if not all_dataset_files:
+        sys.exit("--> No dataset files are found")
+
+    all_statistics = {}
+    all_checks_passed = True
+    for dataset_name, dataset_file in all_dataset_files.items():
+        if args.approximate:
+            all_statistics[dataset_name] = {"dataset_file": dataset_file}
+            all_statistics[dataset_name].update(calculate_approximate_statistics(dataset_file, args.chunk_size,
+                                                                                 args.num_heavy_hitters))
+            print(f"--> {dataset_name}: {all_statistics[dataset_name]['num_contexts']} contexts, "
+                  f"~{all_statistics[dataset_name]['num_citations_estimate']:.0f} citations")
+            if args.check_against_exact:
+                exact_checks = check_against_exact_statistics(all_statistics[dataset_name], dataset_file,
+                                                              args.chunk_size)
+                all_statistics[dataset_name]["checks_against_exact"] = exact_checks
+                for check_name, check in exact_checks.items():
+                    print(f"----> {check_name}: {'within' if check['within_bound'] else 'OUTSIDE'} the error bound")
+                    all_checks_passed = all_checks_passed and check["within_bound"]
+            continue
+
+        citation_appearance_counts = count_citation_appearances(dataset_file, args.chunk_size)
+        if citation_appearance_counts.empty:
+            print(f"--> {dataset_name}: no citations, skipped")
+            continue
+        all_statistics[dataset_name] = {"dataset_file": dataset_file}
+        all_statistics[dataset_name].update(calculate_citation_statistics(citation_appearance_counts))
+        if args.include_appearance_counts:
+            all_statistics[dataset_name]["appearance_counts"] = {str(citation): int(count) for citation, count
+                                                                 in citation_appearance_counts.items()}
+
+        print(f"--> {dataset_name}: {all_statistics[dataset_name]['num_contexts']} contexts, "
+              f"{all_statistics[dataset_name]['num_citations']} citations, "
+              f"median {all_statistics[dataset_name]['median_appearance_count']:.1f} appearances, "
+              f"Zipf exponent {all_statistics[dataset_name]['zipf_fit']['exponent']}")
+
+    with open(args.output_file, "w") as outfile:
+        json.dump(all_statistics, outfile, indent=2)
+    print(f"\n--> Statistics are written to {args.output_file}")
+    if not all_checks_passed:
+        sys.exit(1)
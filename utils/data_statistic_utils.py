@@ -1,22 +1,27 @@
-import pandas as pd
 import matplotlib.pyplot as plt
-import statistics
+import argparse
 import json
+import os
+import sys
+import pandas as pd
 
-dataset_name = "arxiv300k_ignore_1s_token_300"
-all_contexts_file = f"./{dataset_name}/context_dataset.csv"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train"))
+from dataset_files import find_dataset_file  # noqa: E402
+from citation_statistics import calculate_citation_statistics, count_citation_appearances  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--dataset_path", type=str, default="./arxiv300k_ignore_1s_token_300", help="Path to the folder "
+                                                                                               "of the dataset")
+parser.add_argument("--chunk_size", type=int, default=500000, help="Number of rows read at once")
+parser.add_argument("--write_statistic_files", type=bool, default=False, help="Make this flag True to write the "
+                                                                              "statistic files into "
+                                                                              "../dataset_statistic_files")
 
+dataset_name = "arxiv300k_ignore_1s_token_300"
 
-def count_ref_appearances():
-    contexts_df = pd.read_csv(all_contexts_file)
-    appearance_count_dict = {}
-    for i in contexts_df.iterrows():
-        if i[1]["masked_token_target"] not in appearance_count_dict.keys():
-            appearance_count_dict[i[1]["masked_token_target"]] = 1
-        else:
-            appearance_count_dict[i[1]["masked_token_target"]] += 1
 
-    return appearance_count_dict
+def count_ref_appearances(all_contexts_file, chunk_size=500000):
+    return count_citation_appearances(all_contexts_file, chunk_size).to_dict()
 
 
 def find_min_and_max_ref_appearances(appearance_count_dict):
@@ -34,11 +39,7 @@ def find_min_and_max_ref_appearances(appearance_count_dict):
 
 
 def find_all_appearance_counts(appearance_count_dict):
-    all_appearance_counts_lst = []
-    for i in appearance_count_dict.keys():
-        all_appearance_counts_lst.append(appearance_count_dict[i])
-
-    return all_appearance_counts_lst
+    return list(appearance_count_dict.values())
 
 
 def draw_histogram_of_all_cit_per_context(all_appearance_counts_lst):
@@ -48,11 +49,7 @@ def draw_histogram_of_all_cit_per_context(all_appearance_counts_lst):
 
 
 def draw_histogram_of_partial_cit_per_context(appearance_count_dict):
-    all_appearance_counts_lst = []
-    for i in appearance_count_dict.keys():
-        if appearance_count_dict[i] > 75:
-            continue
-        all_appearance_counts_lst.append(appearance_count_dict[i])
+    all_appearance_counts_lst = [count for count in appearance_count_dict.values() if count <= 75]
 
     plt.hist(all_appearance_counts_lst, bins=15)
     plt.title(f"Histogram of citations per contexts - Partial version (Less than 75 count) - {dataset_name}")
@@ -60,16 +57,10 @@ def draw_histogram_of_partial_cit_per_context(appearance_count_dict):
 
 
 def find_how_many_cites_have_more_than_75_appearances_and_less_than_7(appearance_count_dict):
-    more_than_75_count = 0
-    less_than_7_count = 0
-    only_1_count = 0
-    for i in appearance_count_dict.keys():
-        if appearance_count_dict[i] > 75:
-            more_than_75_count += 1
-        elif appearance_count_dict[i] < 7:
-            less_than_7_count += 1
-        if appearance_count_dict[i] == 1:
-            only_1_count += 1
+    citation_statistics = calculate_citation_statistics(pd.Series(appearance_count_dict, dtype="int64"))
+    more_than_75_count = citation_statistics["citations_with_more_than_75_appearances"]
+    less_than_7_count = citation_statistics["citations_with_less_than_7_appearances"]
+    only_1_count = citation_statistics["citations_with_only_1_appearance"]
     print("\n--> Number of citations that have more than 75 appearances inside the contexts of the dataset =",
           more_than_75_count)
     print("\n--> Number of citations that have less than 7 appearances inside the contexts of the dataset =",
@@ -79,8 +70,9 @@ def find_how_many_cites_have_more_than_75_appearances_and_less_than_7(appearance
 
 
 def calculate_average_and_median_of_cit_per_ref(appearance_counts_list):
-    avg = statistics.mean(appearance_counts_list)
-    median = statistics.median(appearance_counts_list)
+    appearance_counts_series = pd.Series(appearance_counts_list, dtype="int64")
+    avg = appearance_counts_series.mean()
+    median = appearance_counts_series.median()
 
     print("\n===> Average of all citation counts per references of the dataset =", avg)
     print("\n===> Median of all citation counts per references of the dataset =", median)
@@ -88,13 +80,8 @@ def calculate_average_and_median_of_cit_per_ref(appearance_counts_list):
 
 
 def create_appearance_count_frequency_dict(appearance_counts_list):
-    appearance_count_frequency_dict = {}
-    for i in appearance_counts_list:
-        if i not in appearance_count_frequency_dict.keys():
-            appearance_count_frequency_dict[i] = 1
-        else:
-            appearance_count_frequency_dict[i] += 1
-    return appearance_count_frequency_dict
+    return {int(count): int(frequency)
+            for count, frequency in pd.Series(appearance_counts_list, dtype="int64").value_counts().items()}
 
 
 def draw_log_log_graphs(appearance_counts_list):
@@ -140,18 +127,25 @@ def write_out_statistic_files(appearance_count_dict, appearance_counts_list, app
         json.dump(sorted_appearance_count_frequency_dict, outfile)
 
 
-appearance_counts = count_ref_appearances()
-find_min_and_max_ref_appearances(appearance_counts)
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    dataset_name = os.path.basename(os.path.normpath(args.dataset_path))
+    all_contexts_file = find_dataset_file(args.dataset_path, "context_dataset")
+
+    appearance_counts = count_ref_appearances(all_contexts_file, args.chunk_size)
+    find_min_and_max_ref_appearances(appearance_counts)
 
-all_appearance_counts = find_all_appearance_counts(appearance_counts)
-# draw_histogram_of_all_cit_per_context(appearance_counts)
-# draw_histogram_of_partial_cit_per_context(appearance_counts)
+    all_appearance_counts = find_all_appearance_counts(appearance_counts)
+    # draw_histogram_of_all_cit_per_context(appearance_counts)
+    # draw_histogram_of_partial_cit_per_context(appearance_counts)
 
-find_how_many_cites_have_more_than_75_appearances_and_less_than_7(appearance_counts)
+    find_how_many_cites_have_more_than_75_appearances_and_less_than_7(appearance_counts)
 
-_, _ = calculate_average_and_median_of_cit_per_ref(all_appearance_counts)
+    _, _ = calculate_average_and_median_of_cit_per_ref(all_appearance_counts)
 
-# draw_log_log_graphs(all_appearance_counts)
+    # draw_log_log_graphs(all_appearance_counts)
 
-# appearance_count_frequencies = create_appearance_count_frequency_dict(all_appearance_counts)
-# write_out_statistic_files(appearance_counts, all_appearance_counts, appearance_count_frequencies)
+    if args.write_statistic_files:
+        appearance_count_frequencies = create_appearance_count_frequency_dict(all_appearance_counts)
+        write_out_statistic_files(appearance_counts, all_appearance_counts, appearance_count_frequencies)
@@ -1,12 +1,10 @@
-from typing import List, Any
-from datasets import DatasetDict, Dataset
-from transformers import (BartForConditionalGeneration, BartTokenizer, TrainingArguments,   # Trainer
-                          BartConfig, GenerationConfig, DataCollatorForSeq2Seq)
-import pandas as pd
 import argparse
-# import math
-from tqdm import tqdm
-# import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train"))
+from cpu_threads import add_cpu_thread_arguments, configure_cpu_threads_from_args  # noqa: E402
+from dataset_files import find_missing_dataset_files  # noqa: E402
 
 
 parser = argparse.ArgumentParser()
@@ -29,12 +27,46 @@ parser.add_argument("--skip_training", type=bool, default=False, help="Skips tra
 parser.add_argument("--dataset_read_limit", type=int, default=300, help="Maximum number of rows to read from dataset.")
 parser.add_argument("--first_index_to_generate", type=int, default=50, help="First index to generate from the dataset.")
 parser.add_argument("--last_index_to_generate", type=int, default=52, help="Last index to generate from the dataset.")
+parser.add_argument("--fast_tokenizer", type=bool, default=False, help="Make this flag True to use the Rust based "
+                                                                       "tokenizer, which loads the serialized "
+                                                                       "tokenizer.json of the asset registry")
+add_cpu_thread_arguments(parser)
+
+dataset_file_names = ["context_dataset_train", "context_dataset_eval"]
+
+if __name__ == '__main__':
+    # --help, invalid arguments and missing dataset files exit here, before the slow imports of torch, transformers
+    # and datasets below
+    args = parser.parse_args()
+    if args.dataset_path is None:
+        parser.error("--dataset_path is required")
+    missing_dataset_files = find_missing_dataset_files(args.dataset_path, dataset_file_names)
+    if missing_dataset_files:
+        parser.error(f"{', '.join(missing_dataset_files)} (.csv or .parquet) not found in {args.dataset_path}")
+    configure_cpu_threads_from_args(args)
+
+from typing import List, Any  # noqa: E402
+from datasets import DatasetDict, Dataset  # noqa: E402
+from transformers import (BartForConditionalGeneration, BartTokenizer, BartTokenizerFast,  # noqa: E402
+                          TrainingArguments, BartConfig, GenerationConfig, DataCollatorForSeq2Seq)  # Trainer
+import pandas as pd  # noqa: E402
+# import math
+from tqdm import tqdm  # noqa: E402
+# import numpy as np
+from dataset_files import (find_dataset_file, join_citing_paper_text, read_dataset_columns,  # noqa: E402
+                           read_papers_table)
+from pretrained_assets import load_pretrained  # noqa: E402
 
 
 # Preprocessing function
 def preprocess_function(examples):
+    input_texts = examples["masked_cit_context"]
+    if "citing_id" in examples:  # The citing title and abstract of datasets with a paper table are joined per batch
+        input_texts = [join_citing_paper_text(papers_table, citing_id, masked_context)
+                       for citing_id, masked_context in zip(examples["citing_id"], input_texts)]
+
     inputs = [example.replace("<mask>", "<extra_id_0>", 1).replace("<mask>", " ").replace("<extra_id_0>", "<mask>")
-              for example in examples["masked_cit_context"]]
+              for example in input_texts]
     targets = [example for example in examples["masked_token_target"]]
 
     model_inputs = tokenizer(inputs, max_length=max_token_limit, truncation=True, padding="max_length")
@@ -43,23 +75,37 @@ def preprocess_function(examples):
     return model_inputs
 
 
+# Only these columns of the dataset files are loaded. Datasets with a paper table have the citing paper id instead of
+# the citing title and abstract.
+dataset_columns = ['citing_title', 'citing_abstract', 'masked_cit_context', 'masked_token_target']
+normalized_dataset_columns = ['citing_id', 'masked_cit_context', 'masked_token_target']
+
+
 def read_dataset():
-    train_df = pd.read_csv(train_dataset_path, nrows=dataset_read_limit)
+    columns = dataset_columns if papers_table is None else normalized_dataset_columns
+    train_df = read_dataset_columns(train_dataset_path, columns, nrows=dataset_read_limit,
+                                    dtype={'citing_id': str})
     train_set = []
 
     for _, i in train_df.iterrows():
-        temp_citing_title = i['citing_title']
-        temp_citing_abstract = i['citing_abstract']
         temp_masked_context = i['masked_cit_context'].replace("OTHERCIT", "")
 
-        temp_train_input = temp_citing_title + " </s> " + temp_citing_abstract + " </s> " + temp_masked_context
+        if papers_table is None:
+            temp_citing_title = i['citing_title']
+            temp_citing_abstract = i['citing_abstract']
+
+            temp_train_input = temp_citing_title + " </s> " + temp_citing_abstract + " </s> " + temp_masked_context
 
-        temp_dict = {"masked_cit_context": temp_train_input,
-                     "masked_token_target": i['masked_token_target']}
+            temp_dict = {"masked_cit_context": temp_train_input,
+                         "masked_token_target": i['masked_token_target']}
+        else:  # The citing title and abstract are joined when the inputs are tokenized
+            temp_dict = {"citing_id": i['citing_id'], "masked_cit_context": temp_masked_context,
+                         "masked_token_target": i['masked_token_target']}
 
         train_set.append(temp_dict)
 
-    eval_df = pd.read_csv(eval_dataset_path, nrows=dataset_read_limit)
+    eval_df = read_dataset_columns(eval_dataset_path, columns, nrows=dataset_read_limit,
+                                    dtype={'citing_id': str})
     eval_set = []
 
     dataset_index = -1
@@ -67,14 +113,19 @@ def read_dataset():
         dataset_index += 1
         if dataset_index < first_index_to_generate or dataset_index >= last_index_to_generate:
             continue
-        temp_citing_title = i['citing_title']
-        temp_citing_abstract = i['citing_abstract']
         temp_masked_context = i['masked_cit_context'].replace("OTHERCIT", "")
 
-        temp_eval_input = temp_citing_title + " </s> " + temp_citing_abstract + " </s> " + temp_masked_context
+        if papers_table is None:
+            temp_citing_title = i['citing_title']
+            temp_citing_abstract = i['citing_abstract']
+
+            temp_eval_input = temp_citing_title + " </s> " + temp_citing_abstract + " </s> " + temp_masked_context
 
-        temp_dict = {"masked_cit_context": temp_eval_input,
-                     "masked_token_target": i['masked_token_target']}
+            temp_dict = {"masked_cit_context": temp_eval_input,
+                         "masked_token_target": i['masked_token_target']}
+        else:  # The citing title and abstract are joined when the inputs are tokenized
+            temp_dict = {"citing_id": i['citing_id'], "masked_cit_context": temp_masked_context,
+                         "masked_token_target": i['masked_token_target']}
 
         eval_set.append(temp_dict)
 
@@ -183,6 +234,8 @@ def calc_eval_metrics(val_dataset):
     for e in tqdm(val_dataset):
         pred_comparison_count += 1
         masked_cit_context = e["masked_cit_context"]
+        if "citing_id" in e:
+            masked_cit_context = join_citing_paper_text(papers_table, e["citing_id"], masked_cit_context)
         target_token = e["masked_token_target"]
 
         print(f"\n\n==============>>> Ground truth cit = {target_token}\n")
@@ -210,16 +263,15 @@ def calc_eval_metrics(val_dataset):
 
 
 if __name__ == '__main__':
-    args = parser.parse_args()
-
     max_token_limit = args.max_token_limit
     custom_model_name = args.model_name
     checkpoints_location = f"{args.checkpoints_path}/{custom_model_name}"
     model_save_location = f"{args.models_path}/{custom_model_name}"
 
     dataset_folder = args.dataset_path
-    train_dataset_path = dataset_folder + "/context_dataset_train.csv"
-    eval_dataset_path = dataset_folder + "/context_dataset_eval.csv"
+    train_dataset_path = find_dataset_file(dataset_folder, "context_dataset_train")
+    eval_dataset_path = find_dataset_file(dataset_folder, "context_dataset_eval")
+    papers_table = read_papers_table(dataset_folder)
 
     num_epochs = args.num_epochs
 
@@ -237,27 +289,12 @@ if __name__ == '__main__':
     last_index_to_generate = args.last_index_to_generate
 
     # Initialize the config
-    config = BartConfig.from_pretrained(pretrained_model_name_or_path, attention_dropout=0.123)
+    config = load_pretrained(BartConfig, pretrained_model_name_or_path, attention_dropout=0.123)
 
     # Initialize the tokenizer
-    tokenizer = BartTokenizer.from_pretrained(pretrained_model_name_or_path, truncation=True,
-                                              padding='max_length', model_max_length=max_token_limit)
-
-    # Set up the model
-    model = BartForConditionalGeneration.from_pretrained(pretrained_model_name_or_path, config=config)
-
-    cit_generation_config = GenerationConfig.from_model_config(model.config)
-
-    cit_generation_config.max_new_tokens = 25
-    cit_generation_config.do_sample = False
-    cit_generation_config.top_k = 50
-    cit_generation_config.num_return_sequences = 20
-    cit_generation_config.early_stopping = False
-    cit_generation_config.num_beams = 20
-    cit_generation_config.forced_bos_token_id = 0
-
-    cit_generation_config.num_beam_groups = 10
-    cit_generation_config.diversity_penalty = 1.5
+    tokenizer = load_pretrained(BartTokenizerFast if args.fast_tokenizer else BartTokenizer,
+                                pretrained_model_name_or_path, truncation=True, padding='max_length',
+                                model_max_length=max_token_limit)
 
     # Example data to view dataset structure
     """data = {
@@ -293,6 +330,23 @@ if __name__ == '__main__':
     # Preprocess the datasets
     tokenized_datasets = dataset.map(preprocess_function, batched=True)
 
+    # Set up the model. It is loaded once the datasets are tokenized, so that errors in the dataset show up without
+    # waiting for the model.
+    model = load_pretrained(BartForConditionalGeneration, pretrained_model_name_or_path, config=config)
+
+    cit_generation_config = GenerationConfig.from_model_config(model.config)
+
+    cit_generation_config.max_new_tokens = 25
+    cit_generation_config.do_sample = False
+    cit_generation_config.top_k = 50
+    cit_generation_config.num_return_sequences = 20
+    cit_generation_config.early_stopping = False
+    cit_generation_config.num_beams = 20
+    cit_generation_config.forced_bos_token_id = 0
+
+    cit_generation_config.num_beam_groups = 10
+    cit_generation_config.diversity_penalty = 1.5
+
     data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, model=model)
 
     training_args = TrainingArguments(
@@ -0,0 +1,189 @@
+import math
+import numpy as np
+import pandas as pd
+
+
+# Fixed-size sketches for statistics of corpora that do not fit into memory. Each one is updated with whole chunks
+# of values, so that the work per chunk is done by numpy/pandas, and reports the error bound of its estimates.
+
+def hash_values(values):
+    # Stable 64-bit hashes of strings, the same in every run and process
+    return pd.util.hash_pandas_object(pd.Series(values, dtype=object), index=False).to_numpy(dtype=np.uint64)
+
+
+def bit_length(values):
+    # Bit length of each uint64, computed on 32-bit halves so that the float conversion is exact
+    high_bits = (values >> np.uint64(32)).astype(np.float64)
+    low_bits = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high_bits > 0, np.frexp(high_bits)[1] + 32, np.frexp(low_bits)[1])
+
+
+class CountMinSketch:
+    """Approximate counts of items, with a candidate list of the most frequent ones (heavy hitters).
+
+    An estimate is never below the true count, and exceeds it by at most `epsilon * total_count` with probability
+    `1 - delta`, where `epsilon = e / width` and `delta = e ** -depth`. The candidates are re-estimated whenever they
+    appear in a chunk, and only the `num_candidates` largest estimates are kept.
+    """
+
+    def __init__(self, width=2 ** 16, depth=5, num_candidates=1000):
+        self.width = width
+        self.depth = depth
+        self.num_candidates = num_candidates
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total_count = 0
+        self.candidates = {}
+
+    @property
+    def epsilon(self):
+        return math.e / self.width
+
+    @property
+    def delta(self):
+        return math.exp(-self.depth)
+
+    def get_columns(self, hashes):
+        # Kirsch-Mitzenmacher: the rows use h1 + i * h2 of the two 32-bit halves of one 64-bit hash
+        first_hashes = hashes & np.uint64(0xFFFFFFFF)
+        second_hashes = hashes >> np.uint64(32)
+        return [((first_hashes + np.uint64(row) * second_hashes) % np.uint64(self.width)).astype(np.int64)
+                for row in range(self.depth)]
+
+    def estimate_hashes(self, hashes):
+        return np.min([self.table[row, columns] for row, columns in enumerate(self.get_columns(hashes))], axis=0)
+
+    def update(self, values):
+        item_counts = pd.Series(values, dtype=object).dropna().value_counts()
+        if item_counts.empty:
+            return
+        items = item_counts.index.to_numpy()
+        hashes = hash_values(items)
+        counts = item_counts.to_numpy(dtype=np.int64)
+
+        for row, columns in enumerate(self.get_columns(hashes)):
+            np.add.at(self.table[row], columns, counts)
+        self.total_count += int(counts.sum())
+
+        for item, estimate in zip(items, self.estimate_hashes(hashes)):
+            self.candidates[item] = int(estimate)
+        if len(self.candidates) > 2 * self.num_candidates:
+            self.candidates = dict(sorted(self.candidates.items(), key=lambda x: -x[1])[:self.num_candidates])
+
+    def estimate(self, item):
+        return int(self.estimate_hashes(hash_values([item]))[0])
+
+    def heavy_hitters(self, k=10):
+        # Candidate estimates are refreshed, since they may have grown in chunks where the candidate was absent
+        candidate_items = list(self.candidates)
+        if not candidate_items:
+            return []
+        estimates = self.estimate_hashes(hash_values(candidate_items))
+        top_indices = np.argsort(-estimates, kind="stable")[:k]
+        return [(candidate_items[i], int(estimates[i])) for i in top_indices]
+
+    def error_bound(self):
+        return {"max_overestimate": self.epsilon * self.total_count, "confidence": 1.0 - self.delta}
+
+
+class HyperLogLog:
+    """Approximate number of distinct items, with a relative standard error of `1.04 / sqrt(2 ** precision)`."""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.num_registers = 2 ** precision
+        self.registers = np.zeros(self.num_registers, dtype=np.int8)
+
+    def update(self, values):
+        values = pd.Series(values, dtype=object).dropna().unique()
+        if len(values) == 0:
+            return
+        hashes = hash_values(values)
+        register_indices = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remaining_bits = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        # Position of the first set bit in the remaining 64 - precision bits
+        ranks = ((64 - self.precision) - bit_length(remaining_bits) + 1).astype(np.int8)
+        np.maximum.at(self.registers, register_indices, ranks)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.num_registers)
+        raw_estimate = alpha * self.num_registers ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        num_empty_registers = int(np.sum(self.registers == 0))
+        if raw_estimate <= 2.5 * self.num_registers and num_empty_registers > 0:
+            # Linear counting is more accurate for small cardinalities
+            return self.num_registers * math.log(self.num_registers / num_empty_registers)
+        return float(raw_estimate)
+
+    def error_bound(self):
+        relative_standard_error = 1.04 / math.sqrt(self.num_registers)
+        return {"relative_standard_error": relative_standard_error,
+                "relative_error_at_3_sigma": 3 * relative_standard_error}
+
+
+class TDigest:
+    """Approximate quantiles from centroids (mean, weight) that are small at the tails and larger in the middle.
+
+    Merging t-digest with the k1 scale function and `compression` as its size parameter. The error bound of a
+    quantile is half the weight of the centroid that it falls into, relative to the total weight.
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.zeros(0, dtype=np.float64)
+        self.weights = np.zeros(0, dtype=np.float64)
+        self.min_value = math.inf
+        self.max_value = -math.inf
+
+    @property
+    def total_weight(self):
+        return float(self.weights.sum())
+
+    def scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.min_value = min(self.min_value, float(values.min()))
+        self.max_value = max(self.max_value, float(values.max()))
+        # Repeated values (e.g. integer token lengths) enter as one weighted point each
+        unique_values, counts = np.unique(values, return_counts=True)
+        self.merge(np.concatenate([self.means, unique_values]), np.concatenate([self.weights, counts]))
+
+    def merge(self, means, weights):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total_weight = weights.sum()
+
+        merged_means, merged_weights = [means[0]], [weights[0]]
+        weight_before = 0.0
+        lower_scale = self.scale(0.0)
+        for mean, weight in zip(means[1:], weights[1:]):
+            if self.scale((weight_before + merged_weights[-1] + weight) / total_weight) - lower_scale <= 1:
+                merged_weights[-1] += weight
+                merged_means[-1] += (mean - merged_means[-1]) * weight / merged_weights[-1]
+            else:
+                weight_before += merged_weights[-1]
+                lower_scale = self.scale(weight_before / total_weight)
+                merged_means.append(mean)
+                merged_weights.append(weight)
+
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights, dtype=np.float64)
+
+    def quantile(self, q):
+        if len(self.means) == 0:
+            return math.nan
+        if len(self.means) == 1:
+            return float(self.means[0])
+        # Interpolates between the centroid centres, whose ranks are the cumulative weight up to their middle
+        centre_ranks = np.cumsum(self.weights) - self.weights / 2
+        rank = q * self.total_weight
+        positions = np.concatenate([[0.0], centre_ranks, [self.total_weight]])
+        values = np.concatenate([[self.min_value], self.means, [self.max_value]])
+        return float(np.interp(rank, positions, values))
+
+    def rank_error_bound(self, q):
+        centroid_idx = min(int(np.searchsorted(np.cumsum(self.weights), q * self.total_weight)), len(self.weights) - 1)
+        return float(self.weights[centroid_idx] / 2 / self.total_weight)
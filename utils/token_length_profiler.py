@@ -0,0 +1,247 @@
+import argparse
+import json
+import math
+import os
+import sys
+import numpy as np
+from transformers import BartConfig, BartTokenizerFast
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "train"))
+from dataset_files import (iter_dataset_column_chunks, join_citing_paper_text, read_dataset_column_names,  # noqa: E402
+                           read_papers_table)
+from citation_statistics import find_dataset_files  # noqa: E402
+from pretrained_assets import load_pretrained  # noqa: E402
+
+
+parser = argparse.ArgumentParser(description="Tokenizes the training inputs and targets of each dataset with the "
+                                             "training tokenizer and reports their length histogram, the padding "
+                                             "waste, truncation and projected training cost of each candidate "
+                                             "max_token_limit, and recommends a limit and bucket boundaries.")
+parser.add_argument("--dataset_paths", type=str, nargs="+", help="Dataset files, dataset folders, or folders that "
+                                                                 "contain dataset folders")
+parser.add_argument("--dataset_file_name", type=str, default="context_dataset_train", help="Name of the dataset file "
+                                                                                           "inside the dataset "
+                                                                                           "folders, without its "
+                                                                                           "extension")
+parser.add_argument("--pretrained_model_path", type=str, default="facebook/bart-base", help="Path or name of the "
+                                                                                            "model whose tokenizer "
+                                                                                            "and architecture are "
+                                                                                            "used")
+parser.add_argument("--output_file", type=str, default="token_length_profile.json", help="Path of the JSON file that "
+                                                                                         "the profiles are written to")
+parser.add_argument("--candidate_limits", type=int, nargs="+", default=[128, 160, 192, 200, 224, 256, 300, 320, 350,
+                                                                        384, 400, 448, 512],
+                    help="max_token_limit values to compare")
+parser.add_argument("--coverage", type=float, default=0.95, help="Share of the inputs that the recommended limit "
+                                                                 "keeps without truncation")
+parser.add_argument("--num_buckets", type=int, default=4, help="Number of length buckets to recommend")
+parser.add_argument("--histogram_bin_width", type=int, default=8, help="Width of the length histogram bins")
+parser.add_argument("--max_rows", type=int, default=None, help="Profile only the first rows of each dataset")
+parser.add_argument("--chunk_size", type=int, default=10000, help="Number of rows tokenized at once")
+
+# Limits and bucket boundaries are rounded up to multiples of 8, which suit the matrix kernels
+length_alignment = 8
+
+
+def create_training_inputs(chunk_df, papers_table):
+    # The same input strings as "preprocess_function" of the training scripts
+    if "citing_title" in chunk_df.columns:
+        input_texts = [citing_title + " </s> " + citing_abstract + " </s> " + masked_context.replace("OTHERCIT", "")
+                       for citing_title, citing_abstract, masked_context
+                       in zip(chunk_df["citing_title"].fillna(""), chunk_df["citing_abstract"].fillna(""),
+                              chunk_df["masked_cit_context"])]
+        extra_mask_replacement = " "
+    elif "citing_id" in chunk_df.columns:
+        input_texts = [join_citing_paper_text(papers_table, citing_id, masked_context.replace("OTHERCIT", ""))
+                       for citing_id, masked_context in zip(chunk_df["citing_id"], chunk_df["masked_cit_context"])]
+        extra_mask_replacement = " "
+    else:
+        input_texts = [masked_context.replace("OTHERCIT", "") for masked_context in chunk_df["masked_cit_context"]]
+        extra_mask_replacement = ""
+
+    return [text.replace("<mask>", "<extra_id_0>", 1).replace("<mask>", extra_mask_replacement)
+            .replace("<extra_id_0>", "<mask>") for text in input_texts]
+
+
+def measure_token_lengths(tokenizer, dataset_file_path, chunk_size=10000, max_rows=None):
+    column_names = read_dataset_column_names(dataset_file_path)
+    columns = [column for column in ['citing_title', 'citing_abstract', 'citing_id', 'masked_cit_context',
+                                     'masked_token_target'] if column in column_names]
+    papers_table = read_papers_table(os.path.dirname(dataset_file_path)) if "citing_id" in columns else None
+    if "citing_id" in columns and papers_table is None:
+        raise ValueError(f"{dataset_file_path} has citing paper ids, but its folder has no papers table")
+
+    input_lengths, target_lengths = [], []
+    num_rows = 0
+    for chunk_df in iter_dataset_column_chunks(dataset_file_path, columns, chunk_size, dtype=str):
+        if max_rows is not None:
+            chunk_df = chunk_df.head(max_rows - num_rows)
+        chunk_df = chunk_df.dropna(subset=["masked_cit_context", "masked_token_target"])
+        inputs = create_training_inputs(chunk_df, papers_table)
+        input_lengths.append(np.array([len(ids) for ids in tokenizer(inputs)["input_ids"]], dtype=np.int32))
+        target_lengths.append(np.array([len(ids) for ids in tokenizer(list(chunk_df["masked_token_target"]))
+                                        ["input_ids"]], dtype=np.int32))
+        num_rows += len(chunk_df)
+        if max_rows is not None and num_rows >= max_rows:
+            break
+
+    return np.concatenate(input_lengths), np.concatenate(target_lengths)
+
+
+def create_length_histogram(lengths, bin_width):
+    bin_counts = np.bincount(lengths // bin_width)
+    return {f"{bin_idx * bin_width}-{(bin_idx + 1) * bin_width - 1}": int(count)
+            for bin_idx, count in enumerate(bin_counts) if count > 0}
+
+
+def estimate_training_cost(model_config, input_length, target_length):
+    """Projected forward + backward FLOPs and activation memory of one training sample.
+
+    Matrix multiplications count 2 FLOPs per multiply-add, and the backward pass costs twice the forward pass.
+    Activation memory follows the per-layer estimate of Korthikanti et al. (2022), L * d * (34 + 5 * heads * L / d)
+    bytes in 16-bit precision, doubled for fp32 training; decoder layers also keep their cross-attention.
+    """
+    d_model = model_config.d_model
+    encoder_ffn, decoder_ffn = model_config.encoder_ffn_dim, model_config.decoder_ffn_dim
+    encoder_layers, decoder_layers = model_config.encoder_layers, model_config.decoder_layers
+
+    encoder_layer_flops = 2 * input_length * (4 * d_model ** 2 + 2 * d_model * encoder_ffn) + \
+        4 * input_length ** 2 * d_model
+    # Self-attention, cross-attention (its keys and values come from the encoder outputs) and feed-forward
+    decoder_layer_flops = 2 * target_length * (6 * d_model ** 2 + 2 * d_model * decoder_ffn) + \
+        2 * input_length * 2 * d_model ** 2 + 4 * target_length ** 2 * d_model + \
+        4 * target_length * input_length * d_model
+    lm_head_flops = 2 * target_length * d_model * model_config.vocab_size
+    forward_flops = encoder_layers * encoder_layer_flops + decoder_layers * decoder_layer_flops + lm_head_flops
+
+    def layer_activation_bytes(length, heads):
+        return 2 * length * d_model * (34 + 5 * heads * length / d_model)
+
+    activation_bytes = encoder_layers * layer_activation_bytes(input_length, model_config.encoder_attention_heads) + \
+        decoder_layers * 1.5 * layer_activation_bytes(target_length, model_config.decoder_attention_heads)
+    return {"training_gflops_per_sample": 3 * forward_flops / 1e9,
+            "activation_mb_per_sample": activation_bytes / 2 ** 20}
+
+
+def align_length(length):
+    return int(math.ceil(length / length_alignment) * length_alignment)
+
+
+def profile_candidate_limit(input_lengths, target_lengths, max_token_limit, model_config):
+    # The training scripts pad the inputs and the labels to max_token_limit
+    kept_input_lengths = np.minimum(input_lengths, max_token_limit)
+    kept_target_lengths = np.minimum(target_lengths, max_token_limit)
+    padded_tokens = 2 * max_token_limit * len(input_lengths)
+    profile = {
+        "truncated_inputs": float(np.mean(input_lengths > max_token_limit)),
+        "truncated_input_tokens": float(1 - kept_input_lengths.sum() / input_lengths.sum()),
+        "input_padding_waste": float(1 - kept_input_lengths.mean() / max_token_limit),
+        "total_padding_waste": float(1 - (kept_input_lengths.sum() + kept_target_lengths.sum()) / padded_tokens),
+    }
+    profile.update(estimate_training_cost(model_config, max_token_limit, max_token_limit))
+    # Without padding: inputs and labels as long as they are, e.g. with length bucketing and dynamic padding
+    unpadded_cost = estimate_training_cost(model_config, float(kept_input_lengths.mean()),
+                                           float(kept_target_lengths.mean()))
+    profile["unpadded_training_gflops_per_sample"] = unpadded_cost["training_gflops_per_sample"]
+    return profile
+
+
+def find_bucket_boundaries(lengths, max_token_limit, num_buckets):
+    # Upper bounds of the buckets that minimize the padded tokens, when each input is padded to the bound of its
+    # bucket. Dynamic programming over the aligned lengths: best[b][j] is the cost of covering the first j
+    # boundaries with b buckets.
+    aligned_lengths = np.minimum((np.minimum(lengths, max_token_limit) + length_alignment - 1) // length_alignment,
+                                 max_token_limit // length_alignment)
+    counts = np.bincount(aligned_lengths, minlength=max_token_limit // length_alignment + 1)
+    candidate_bounds = np.nonzero(counts)[0]
+    if len(candidate_bounds) == 0:
+        return [], 0.0
+    cumulative_counts = np.concatenate([[0], np.cumsum(counts[candidate_bounds])])
+
+    num_candidates = len(candidate_bounds)
+    num_buckets = min(num_buckets, num_candidates)
+    best_costs = np.full((num_buckets + 1, num_candidates + 1), np.inf)
+    best_costs[0][0] = 0
+    previous_ends = np.zeros((num_buckets + 1, num_candidates + 1), dtype=np.int64)
+    for bucket in range(1, num_buckets + 1):
+        for end in range(1, num_candidates + 1):
+            # A bucket that holds the candidates start..end-1 pads them all to the bound of end-1
+            starts = np.arange(0, end)
+            costs = best_costs[bucket - 1][starts] + \
+                (cumulative_counts[end] - cumulative_counts[starts]) * candidate_bounds[end - 1]
+            best_start = int(np.argmin(costs))
+            best_costs[bucket][end] = costs[best_start]
+            previous_ends[bucket][end] = best_start
+
+    bucket_bounds = []
+    end = num_candidates
+    for bucket in range(num_buckets, 0, -1):
+        bucket_bounds.append(int(candidate_bounds[end - 1]) * length_alignment)
+        end = previous_ends[bucket][end]
+    bucket_bounds = sorted(set(bucket_bounds))
+
+    padded_tokens = 0
+    lower_bound = 0
+    capped_lengths = np.minimum(lengths, max_token_limit)
+    for bucket_bound in bucket_bounds:
+        padded_tokens += int(np.sum((capped_lengths > lower_bound) & (capped_lengths <= bucket_bound))) * bucket_bound
+        lower_bound = bucket_bound
+    return bucket_bounds, float(1 - capped_lengths.sum() / padded_tokens)
+
+
+def profile_dataset(tokenizer, model_config, dataset_file_path, candidate_limits, coverage, num_buckets,
+                    histogram_bin_width, chunk_size=10000, max_rows=None):
+    input_lengths, target_lengths = measure_token_lengths(tokenizer, dataset_file_path, chunk_size, max_rows)
+    quantile_levels = [0.5, 0.9, 0.95, 0.99, 1.0]
+
+    recommended_limit = align_length(np.quantile(input_lengths, coverage))
+    bucket_bounds, bucket_padding_waste = find_bucket_boundaries(input_lengths, recommended_limit, num_buckets)
+    return {
+        "num_examples": int(len(input_lengths)),
+        "input_length_quantiles": {str(level): float(np.quantile(input_lengths, level)) for level in quantile_levels},
+        "target_length_quantiles": {str(level): float(np.quantile(target_lengths, level))
+                                    for level in quantile_levels},
+        "input_length_histogram": create_length_histogram(input_lengths, histogram_bin_width),
+        "candidate_limits": {str(max_token_limit): profile_candidate_limit(input_lengths, target_lengths,
+                                                                           max_token_limit, model_config)
+                             for max_token_limit in sorted(set(candidate_limits + [recommended_limit]))},
+        "recommendation": {
+            "max_token_limit": recommended_limit,
+            "coverage": coverage,
+            # Labels are citation strings of a few tokens, so padding them to max_token_limit is mostly waste
+            "target_max_length": align_length(np.max(target_lengths)),
+            "bucket_boundaries": bucket_bounds,
+            "bucket_input_padding_waste": bucket_padding_waste,
+        },
+    }
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    all_dataset_files = {}
+    for path in args.dataset_paths:
+        all_dataset_files.update(find_dataset_files(path, args.dataset_file_name))
+    if not all_dataset_files:
+        sys.exit("--> No dataset files are found")
+
+    tokenizer = load_pretrained(BartTokenizerFast, args.pretrained_model_path)
+    bart_config = load_pretrained(BartConfig, args.pretrained_model_path)
+
+    all_profiles = {}
+    for dataset_name, dataset_file in all_dataset_files.items():
+        all_profiles[dataset_name] = {"dataset_file": dataset_file}
+        all_profiles[dataset_name].update(profile_dataset(tokenizer, bart_config, dataset_file, args.candidate_limits,
+                                                          args.coverage, args.num_buckets, args.histogram_bin_width,
+                                                          args.chunk_size, args.max_rows))
+        recommendation = all_profiles[dataset_name]["recommendation"]
+        recommended_profile = all_profiles[dataset_name]["candidate_limits"][str(recommendation["max_token_limit"])]
+        print(f"--> {dataset_name}: max_token_limit {recommendation['max_token_limit']} "
+              f"({recommended_profile['truncated_inputs']:.1%} truncated, "
+              f"{recommended_profile['input_padding_waste']:.1%} input padding), "
+              f"buckets {recommendation['bucket_boundaries']} "
+              f"({recommendation['bucket_input_padding_waste']:.1%} input padding)")
+
+    with open(args.output_file, "w") as outfile:
+        json.dump(all_profiles, outfile, indent=2)
+    print(f"\n--> Token length profiles are written to {args.output_file}")